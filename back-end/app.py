@@ -1,26 +1,59 @@
 
 ''' This is the main part of the application, responsible for running the flask application and the blueprints.
 
+    create_app() builds the app, nothing connects to mongoDB until the first request, so it is safe to build the app
+    in a parent process and fork workers from it (see wsgi.py and gunicorn.conf.py for running it in production).
+    Importing this file has no side effects, it doesn't connect, start threads or read the .env file.
+
+    Development server:
+        py app.py
 '''
 ### --- IMPROTS --- ###
+if __name__ == "__main__":
+    # Only when run directly, the settings in .env have to be in the environment before the other imports read them
+    from dotenv import load_dotenv
+    load_dotenv()
+
 from flask import Flask
 from blueprints.auth.auth import auth_bp
 from blueprints.groups.groups import groups_bp
 from blueprints.posts.posts import posts_bp
 from blueprints.comments.comments import comments_bp
 from blueprints.calendar.calendar import calendar_bp
+from blueprints.jobs.jobs import jobs_bp
 from flask_cors import CORS
+import indexes, timelines, group_search, json_provider, compression, jobs, memberships
 
 ### --- FLASK APPLICATION AND BLUEPRINTS --- ###
-app = Flask(__name__)
-CORS(app, resources={r"/api/*": {"origins": ["http://localhost:4200", "https://alchemaxdemo.co.uk"]}},
-          allow_headers=["Authorization", "Content-Type", "x-access-token"])
-app.register_blueprint(auth_bp)
-app.register_blueprint(groups_bp)
-app.register_blueprint(posts_bp)
-app.register_blueprint(comments_bp)
-app.register_blueprint(calendar_bp)
+def create_app():
+    app = Flask(__name__)
+    json_provider.init_app(app) # ObjectId and dates straight to JSON, with orjson if it's installed
+    compression.init_app(app) # gzip/brotli for anything over ALCHEMAX_COMPRESSION_MIN_BYTES
+    CORS(app, resources={r"/api/*": {"origins": ["http://localhost:4200", "https://alchemaxdemo.co.uk"]}},
+              allow_headers=["Authorization", "Content-Type", "x-access-token"], expose_headers=["X-Next-Cursor"])
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(groups_bp)
+    app.register_blueprint(posts_bp)
+    app.register_blueprint(comments_bp)
+    app.register_blueprint(calendar_bp)
+    app.register_blueprint(jobs_bp)
+    jobs.init_app(app) # background jobs (deleting accounts and groups), see jobs.py
+
+    ### --- INDEXES --- ###
+    # Adds "flask --app app ensure-indexes" and "flask --app app verify-indexes", the blueprints register the indexes themselves
+    indexes.init_app(app)
+    timelines.init_app(app) # "flask --app app rebuild-timelines", only needed for timeline mode
+    group_search.init_app(app) # "flask --app app index-group-search", once for groups created before the search fields
+    memberships.init_app(app) # "flask --app app backfill-memberships", once for memberships from before the collection
+
+    return app
 
 
 if __name__ == "__main__":
-    app.run(debug=True)
\ No newline at end of file
+    # Creating indexes that already exist does nothing, so this is safe on every start
+    try:
+        indexes.ensure_indexes()
+    except Exception as e:
+        print("Unable to create indexes: " + str(e))
+
+    create_app().run(debug=True)
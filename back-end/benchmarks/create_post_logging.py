@@ -0,0 +1,45 @@
+''' Latency of /api/create_post with the old synchronous control logs and the queued writer (log_writer.py)
+
+    "before" writes every control log with an acknowledged insert_one on the request thread, like the handlers used to,
+    "after" is log_writer.enqueue. Run it with --mongo to see the round trip that the queue takes off the request
+
+    python -m benchmarks.create_post_logging [--mongo] [--seconds 2]
+'''
+
+### --- IMPORTS --- ###
+from benchmarks import harness
+
+
+def main():
+    args = harness.arguments(__doc__)
+    app, client, db = harness.build_app(args.mongo)
+
+    import log_writer
+    group_id = str(db.groups.insert_one({"group_name": "Bench group", "group_access": "Public", "requests": []}).inserted_id)
+    user_id = harness.make_user(db, "bench-user", ownerOf=[group_id])
+    headers = {"x-access-token": harness.token_for(user_id, "bench-user")}
+    form = {"group_id": group_id, "post_title": "Bench", "event_button": "No", "post_message": "A post for the benchmark"}
+
+    def create_post():
+        response = client.post("/api/create_post", headers=headers, data=form)
+        assert response.status_code == 201
+
+    def synchronous(logsMessage):
+        db.logs.insert_one(dict(logsMessage))
+        return True
+
+    queued = log_writer.enqueue
+    rows = []
+    for case, enqueue in (("insert_one per log (before)", synchronous), ("queued writer (after)", queued)):
+        log_writer.enqueue = enqueue
+        create_post() # warm up
+        perSecond, timings = harness.run_for(args.seconds, create_post)
+        rows.append((case, {"req/s": perSecond, "p50 ms": harness.percentile(timings, 50), "p99 ms": harness.percentile(timings, 99)}))
+    log_writer.enqueue = queued
+    log_writer.shutdown()
+
+    harness.report("POST /api/create_post, one worker thread", rows)
+
+
+if __name__ == "__main__":
+    main()
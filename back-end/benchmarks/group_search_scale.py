@@ -0,0 +1,97 @@
+''' The group search at scale, the old unanchored $regex with skip against group_search.search() with cursors
+
+    Fills a scratch groups collection with --groups groups (made up names and categories, with the search fields), creates the
+    registered indexes, then times page 1 and page --deep-page of a few searches both ways.
+
+    The numbers only mean something with --mongo, mongomock has no indexes so both ways scan everything:
+        python -m benchmarks.group_search_scale --mongo --groups 1000000
+    With --mongo it also prints the documents each first page examined (from explain)
+
+    python -m benchmarks.group_search_scale [--mongo] [--groups 20000] [--deep-page 50]
+'''
+
+### --- IMPORTS --- ###
+import random, re, time
+from benchmarks import harness
+
+words = ["sim", "racing", "club", "football", "chess", "book", "running", "photo", "gaming", "hiking", "cycling", "choir",
+         "drama", "garden", "coding", "knitting", "climbing", "film", "jazz", "yoga", "rowing", "astronomy", "baking", "poker"]
+categories = ["Sim Racing", "Sport", "Social Club", "Music", "Games", "Outdoors", "Arts", "Technology"]
+searches = ["sim", "racing club", "Astronomy", "zzz no match"]
+pageSize = 10
+
+
+def _fill(db, count):
+    import group_search
+    rng = random.Random(1)
+    batch = []
+    for i in range(count):
+        name = " ".join(rng.choice(words).title() for _ in range(rng.randint(2, 4))) + " " + str(i)
+        category = rng.choice(categories)
+        batch.append({"group_name": name, "category": category, "group_access": "Public", "requests": [],
+                      **group_search.search_document(name, category)})
+        if len(batch) == 10000:
+            db.groups.insert_many(batch)
+            batch = []
+    if batch:
+        db.groups.insert_many(batch)
+
+def _old(db, text, page):
+    ''' What search_by_name used to do '''
+    return list(db.groups.find({"group_name": {"$regex": text, "$options": "i"}}, {"group_name": 1, "category": 1})
+                .skip(pageSize * (page - 1)).limit(pageSize))
+
+def _new(text, page):
+    ''' group_search.search, following the cursor to the page (each page is one query, like the front end paging) '''
+    import group_search
+    cursor = None
+    for _ in range(page):
+        found, cursor = group_search.search("name", text, pageSize, cursor, {"group_name": 1, "category": 1})
+        if cursor is None:
+            break
+    return found
+
+def _timed(call, repeats=3):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        call()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+def _examined(db, text):
+    ''' Documents examined by the first page, old and new, from explain (real mongoDB only) '''
+    import group_search
+    field, _ = group_search.searchFields["name"]
+    old = db.groups.find({"group_name": {"$regex": text, "$options": "i"}}).limit(pageSize).explain()
+    new = db.groups.find({field: {"$regex": "^" + re.escape(group_search.normalise(text))}}).sort([(field, 1), ("_id", 1)]).limit(pageSize + 1).explain()
+    stats = lambda plan: plan.get("executionStats", {}).get("totalDocsExamined", 0)
+    return stats(old), stats(new)
+
+
+def main():
+    args = harness.arguments(__doc__, groups=20000, deep_page=50)
+    db = harness.database(args.mongo)
+
+    import indexes
+    print("Filling " + str(args.groups) + " groups...")
+    _fill(db, args.groups)
+    indexes.ensure_indexes(db)
+
+    rows = []
+    for text in searches:
+        for page in (1, args.deep_page):
+            rows.append(("'" + text + "' page " + str(page), {
+                "old ms": _timed(lambda: _old(db, text, page)),
+                "new ms": _timed(lambda: _new(text, page))
+            }))
+    harness.report("Group search by name, " + str(args.groups) + " groups, fastest of 3 (new pages are walked with the cursor)", rows)
+
+    if args.mongo:
+        print("\nDocuments examined for the first page (old, new):")
+        for text in searches:
+            print("  '" + text + "': " + str(_examined(db, text)))
+
+
+if __name__ == "__main__":
+    main()
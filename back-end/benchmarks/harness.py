@@ -0,0 +1,163 @@
+''' Shared setup for the benchmarks in this folder
+
+    Each benchmark is run from the back-end folder as a module, e.g.
+        python -m benchmarks.profile_claims
+
+    By default the app runs against mongomock (in memory), which shows the CPU side of a change but hides the network.
+    With --mongo it uses the real mongoDB in ALCHEMAX_MONGO_URI instead, writing to a scratch database
+    (ALCHEMAX_BENCH_DB, "alchemax_bench") that is dropped first, so round trips show up in the numbers as well
+'''
+
+### --- IMPORTS --- ###
+import argparse, datetime, os, sys, threading, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ALCHEMAX_SECRET_KEY", "benchmark-secret-key-at-least-32-bytes")
+
+
+### --- SETUP --- ###
+def arguments(description, **extra):
+    ''' The common command line (--mongo, --seconds), extra is name -> default for any more options '''
+    parser = argparse.ArgumentParser(description=description)
+    parser.add_argument("--mongo", action="store_true", help="use the real mongoDB in ALCHEMAX_MONGO_URI")
+    parser.add_argument("--seconds", type=float, default=2, help="how long to run each case for")
+    for name, default in extra.items():
+        parser.add_argument("--" + name.replace("_", "-"), type=type(default), default=default)
+    return parser.parse_args()
+
+def database(realMongo=False):
+    ''' Points globals at mongomock or a scratch database on the real server, returns globals.db '''
+    import globals, health
+
+    if realMongo:
+        from dotenv import load_dotenv
+        load_dotenv()
+        os.environ["ALCHEMAX_MONGO_DB"] = os.environ.get("ALCHEMAX_BENCH_DB", "alchemax_bench")
+        globals.client.drop_database(globals.database_name())
+    else:
+        import mongomock
+        globals._client = mongomock.MongoClient()
+        globals._clientPid = os.getpid()
+        health._startedPid = os.getpid() # nothing to monitor, the breaker stays closed
+
+    return globals.db
+
+roundTrips = {"find", "find_one", "aggregate", "count_documents", "distinct", "insert_one", "insert_many", "update_one",
+              "update_many", "delete_one", "delete_many", "find_one_and_update", "bulk_write"}
+
+class _Pool:
+    ''' poolSize connections, a round trip holds one for as long as it takes, reported to mongo_pool like pymongo's own pool '''
+    def __init__(self, size):
+        import mongo_pool
+        self._slots = threading.BoundedSemaphore(size)
+        self._listener = mongo_pool.listener
+
+    def take(self):
+        self._listener.connection_check_out_started(None)
+        start = time.perf_counter()
+        self._slots.acquire()
+        self._listener.connection_checked_out(argparse.Namespace(duration=time.perf_counter() - start))
+
+    def give_back(self):
+        self._slots.release()
+        self._listener.connection_checked_in(None)
+
+class _SlowCollection:
+    def __init__(self, collection, seconds, pool):
+        self._collection = collection
+        self._seconds = seconds
+        self._pool = pool
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in roundTrips:
+            return attribute
+
+        def slow(*args, **kwargs):
+            if self._pool:
+                self._pool.take()
+            try:
+                time.sleep(self._seconds) # releases the GIL, like pymongo waiting on the socket
+                return attribute(*args, **kwargs)
+            finally:
+                if self._pool:
+                    self._pool.give_back()
+        return slow
+
+class _SlowDatabase:
+    def __init__(self, database, seconds, pool):
+        self._database = database
+        self._seconds = seconds
+        self._pool = pool
+
+    def __getitem__(self, name):
+        return _SlowCollection(self._database[name], self._seconds, self._pool)
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+class _SlowClient:
+    def __init__(self, client, seconds, pool=None):
+        self._client = client
+        self._seconds = seconds
+        self._pool = pool
+
+    def __getitem__(self, name):
+        return _SlowDatabase(self._client[name], self._seconds, self._pool)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+def add_latency(milliseconds, poolSize=None):
+    ''' Makes every mongomock call that would be a round trip wait milliseconds first, so the network shows up without a real server.
+        With poolSize each round trip also needs one of poolSize connections, waiting for one like pymongo's pool
+    '''
+    import globals
+    if milliseconds or poolSize:
+        globals._client = _SlowClient(globals._client, (milliseconds or 0) / 1000, _Pool(poolSize) if poolSize else None)
+
+def build_app(realMongo=False):
+    ''' The app, a test client and globals.db, on mongomock or the scratch database '''
+    db = database(realMongo)
+    from app import create_app
+    app = create_app()
+    return app, app.test_client(), db
+
+def make_user(db, username, **fields):
+    user = {"username": username, "email": username + "@example.com", "admin": False, "memberOf": [], "ownerOf": [], **fields}
+    return str(db.users.insert_one(user).inserted_id)
+
+def token_for(user_id, username, admin=False):
+    import jwt, globals
+    return jwt.encode({
+        "user_db_id": user_id,
+        "user": username,
+        "admin": admin,
+        "exp": datetime.datetime.now(datetime.UTC) + datetime.timedelta(minutes=60)
+    }, globals.secret_key, algorithm="HS256")
+
+
+### --- TIMING --- ###
+def run_for(seconds, call):
+    ''' Calls call() over and over for seconds, returns (calls per second, list of each calls milliseconds) '''
+    timings = []
+    end = time.perf_counter() + seconds
+    while True:
+        start = time.perf_counter()
+        if start >= end:
+            break
+        call()
+        timings.append((time.perf_counter() - start) * 1000)
+    return len(timings) / seconds, timings
+
+def percentile(timings, p):
+    ordered = sorted(timings)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else 0
+
+def report(title, rows):
+    ''' Prints a small table, rows is a list of (case, {column: value}) '''
+    print(title)
+    columns = list(rows[0][1]) if rows else []
+    print("  " + "case".ljust(28) + "".join(column.rjust(14) for column in columns))
+    for case, values in rows:
+        print("  " + case.ljust(28) + "".join(("%.2f" % values[column]).rjust(14) for column in columns))
@@ -0,0 +1,80 @@
+''' Encoding a feed of posts the old way (a loop converting _id and dates, then the standard library) and with json_provider.py
+
+    "before" is what the endpoints used to do before jsonify, "after" is AlchemaxJSONProvider with orjson, and again with
+    the standard library fallback it uses when orjson isn't installed. Both give the same JSON, checked before timing.
+    No database is involved, so --mongo makes no difference here
+
+    python -m benchmarks.json_feed [--seconds 2] [--posts 1000]
+'''
+
+### --- IMPORTS --- ###
+import copy, datetime, json
+from benchmarks import harness
+
+
+def _feed(posts):
+    from bson import ObjectId
+    now = datetime.datetime(2025, 1, 1)
+    return [{
+        "_id" : ObjectId(),
+        "group_id" : str(ObjectId()),
+        "creator" : str(ObjectId()),
+        "post_title" : "Post " + str(i),
+        "post_message" : "A message that is about as long as a normal post would be, give or take a few words " * 3,
+        "event_button" : "Yes" if i % 5 == 0 else "No",
+        "event_date" : now + datetime.timedelta(days=i) if i % 5 == 0 else None,
+        "date_posted" : now - datetime.timedelta(minutes=i),
+        "comment_count" : i % 12,
+        "creator_username" : "user" + str(i % 50),
+        "group_name" : "Group " + str(i % 20)
+    } for i in range(posts)]
+
+
+def main():
+    args = harness.arguments(__doc__, posts=1000)
+
+    from flask import Flask
+    from flask.json.provider import DefaultJSONProvider
+    import json_provider
+
+    feed = _feed(args.posts)
+    app = Flask(__name__)
+    oldProvider = DefaultJSONProvider(app)
+    newProvider = json_provider.AlchemaxJSONProvider(app)
+
+    def old():
+        # What the endpoints used to do
+        converted = copy.copy(feed)
+        for i, post in enumerate(converted):
+            post = converted[i] = dict(post)
+            post["_id"] = str(post["_id"])
+            if "date_posted" in post:
+                post["date_posted"] = post["date_posted"].isoformat()
+            if "event_date" in post and post["event_date"]:
+                post["event_date"] = post["event_date"].isoformat()
+        return oldProvider.dumps({"feed": converted, "next_cursor": None}, separators=(",", ":"))
+
+    def new():
+        return newProvider.dumps({"feed": feed, "next_cursor": None}, separators=(",", ":"))
+
+    orjson = json_provider.orjson
+    cases = [("loop + stdlib json (before)", old, orjson)]
+    if orjson is not None:
+        cases.append(("provider, orjson (after)", new, orjson))
+    else:
+        print("orjson isn't installed (pip install orjson), only the standard library fallback is measured\n")
+    cases.append(("provider, stdlib fallback", new, None))
+
+    rows = []
+    for case, encode, encoder in cases:
+        json_provider.orjson = encoder
+        assert json.loads(encode()) == json.loads(old())
+        perSecond, timings = harness.run_for(args.seconds, encode)
+        rows.append((case, {"feeds/s": perSecond, "p50 ms": harness.percentile(timings, 50), "p99 ms": harness.percentile(timings, 99)}))
+    json_provider.orjson = orjson
+
+    harness.report("Encoding a " + str(args.posts) + " post feed", rows)
+
+
+if __name__ == "__main__":
+    main()
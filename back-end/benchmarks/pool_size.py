@@ -0,0 +1,80 @@
+''' p50/p99 latency of the home feed with --clients threads at once, for each pool size in --pool-sizes (ALCHEMAX_MONGO_MAX_POOL_SIZE)
+
+    Each thread is one request being handled at a time (a gunicorn thread), so with fewer connections than threads the
+    requests queue for one, the checkout wait columns come from mongo_pool.py and are the time spent in that queue.
+    A pool as big as the number of threads removes the wait, making it any bigger only adds connections the server has to keep
+    (every worker process has its own pool, see globals.get_client)
+
+    With --mongo a new MongoClient is made for each pool size, against the scratch database.
+    mongomock has no pool, so without --mongo every round trip waits --latency-ms holding one of the pool size connections,
+    the same way a pymongo connection is held for the round trip
+
+    python -m benchmarks.pool_size [--mongo] [--seconds 2] [--latency-ms 2] [--clients 16] [--pool-sizes 1,2,4,8,16,32]
+'''
+
+### --- IMPORTS --- ###
+import datetime, os, threading
+from benchmarks import harness
+
+
+def _load(app, url, headers, clients, seconds):
+    ''' clients threads, each with its own test client, returns (requests per second, list of each requests milliseconds) '''
+    timings = []
+
+    def client():
+        testClient = app.test_client()
+        def view():
+            response = testClient.get(url, headers=headers)
+            assert response.status_code == 200, response.get_data()
+        perSecond, mine = harness.run_for(seconds, view)
+        timings.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(timings) / seconds, timings
+
+
+def main():
+    args = harness.arguments(__doc__, latency_ms=2.0, clients=16, pool_sizes="1,2,4,8,16,32")
+    app, client, db = harness.build_app(args.mongo)
+
+    import globals, mongo_pool
+    group_id = str(db.groups.insert_one({"group_name": "Bench group", "group_access": "Public", "requests": []}).inserted_id)
+    user_id = harness.make_user(db, "bench-user", memberOf=[group_id])
+    now = datetime.datetime(2025, 1, 1)
+    db.posts.insert_many([{"group_id": group_id, "creator": user_id, "post_title": "Post " + str(i), "post_message": "Hello",
+                           "event_button": "No", "date_posted": now + datetime.timedelta(minutes=i)} for i in range(50)])
+    headers = {"x-access-token": harness.token_for(user_id, "bench-user")}
+    mock = globals._client
+
+    rows = []
+    for size in [int(size) for size in args.pool_sizes.split(",")]:
+        if args.mongo:
+            # A new client with this pool size, the old one is closed so its connections don't count
+            os.environ["ALCHEMAX_MONGO_MAX_POOL_SIZE"] = str(size)
+            old = globals._client
+            globals._clientPid = None
+            globals.get_client()
+            old.close()
+        else:
+            globals._client = mock
+            harness.add_latency(args.latency_ms, size)
+
+        _load(app, "/api/home", headers, 1, 0.2) # warm up the caches (and open a connection)
+        mongo_pool.reset()
+        perSecond, timings = _load(app, "/api/home", headers, args.clients, args.seconds)
+        pool = mongo_pool.stats()
+        rows.append(("pool of " + str(size), {"req/s": perSecond, "p50 ms": harness.percentile(timings, 50),
+                                              "p99 ms": harness.percentile(timings, 99),
+                                              "wait p50 ms": pool["checkout_wait_ms"]["p50"], "wait p99 ms": pool["checkout_wait_ms"]["p99"],
+                                              "failures": pool["checkout_failures"]}))
+
+    latency = "real mongoDB" if args.mongo else str(args.latency_ms) + " ms per round trip"
+    harness.report("GET /api/home, " + str(args.clients) + " threads, " + latency, rows)
+
+
+if __name__ == "__main__":
+    main()
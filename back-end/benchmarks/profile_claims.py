@@ -0,0 +1,37 @@
+''' Requests per second on /api/profile with and without the verified claims cache (decorators.py)
+
+    "before" turns the cache off, so every request decodes and verifies the HS256 token again like jwt_required used to
+
+    python -m benchmarks.profile_claims [--mongo] [--seconds 2]
+'''
+
+### --- IMPORTS --- ###
+from benchmarks import harness
+
+
+def main():
+    args = harness.arguments(__doc__)
+    app, client, db = harness.build_app(args.mongo)
+
+    import decorators
+    user_id = harness.make_user(db, "bench-user", firstName="Bench", lastName="User")
+    headers = {"x-access-token": harness.token_for(user_id, "bench-user")}
+
+    def profile():
+        response = client.get("/api/profile", headers=headers)
+        assert response.status_code == 200
+
+    cachedClaims = decorators._cached_claims
+    rows = []
+    for case, cache in (("decode every request (before)", False), ("claims cache (after)", True)):
+        decorators._cached_claims = cachedClaims if cache else (lambda tokenFingerprint: None)
+        profile() # warm up
+        perSecond, timings = harness.run_for(args.seconds, profile)
+        rows.append((case, {"req/s": perSecond, "p50 ms": harness.percentile(timings, 50), "p99 ms": harness.percentile(timings, 99)}))
+    decorators._cached_claims = cachedClaims
+
+    harness.report("GET /api/profile, one worker thread", rows)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+''' Requests per second from the development server against gunicorn with 1 and --workers workers (see gunicorn.conf.py)
+
+    Each server is started in its own process on a free port, then --clients threads in this process send GET --path
+    (as the bench user) over keep-alive connections for --seconds, the same as an HTTP load tool would.
+
+    Without --mongo every server process has its own mongomock with the same bench user in it, so the numbers show how
+    much more the workers get through on this box's cores. With --mongo they share the scratch database and the round trips
+    show as well. The load comes from threads in one python process, on a big box it can run out before the workers do,
+    check the numbers with an HTTP load tool there (see gunicorn.conf.py)
+
+    gunicorn doesn't run on Windows, without it only the development server is measured
+
+    python -m benchmarks.server_throughput [--mongo] [--seconds 2] [--workers 4] [--clients 32] [--path /api/profile]
+'''
+
+### --- IMPORTS --- ###
+import http.client, os, socket, subprocess, sys, threading, time
+from benchmarks import harness
+
+backEnd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+benchUserId = "65f000000000000000000001" # the same in every server process, so one token works on all of them
+
+
+### --- SERVER SIDE --- ###
+def _mongomock_per_process():
+    ''' Gives each server process (and each forked worker) its own mongomock, with the bench user in it '''
+    from bson import ObjectId
+    import globals, health, mongomock
+
+    lock = threading.Lock()
+    clients = {}
+
+    def get_client():
+        if os.getpid() not in clients:
+            with lock:
+                if os.getpid() not in clients:
+                    client = mongomock.MongoClient()
+                    client[globals.database_name()].users.insert_one({"_id": ObjectId(benchUserId), "username": "bench-user",
+                        "email": "bench-user@example.com", "firstName": "Bench", "lastName": "User", "admin": False,
+                        "memberOf": [], "ownerOf": []})
+                    health._startedPid = os.getpid() # nothing to monitor, the breaker stays closed
+                    clients[os.getpid()] = client
+        return clients[os.getpid()]
+
+    globals.get_client = get_client
+    globals.get_db = lambda: get_client()[globals.database_name()]
+    return get_client
+
+def serve_app():
+    ''' The app the benchmark servers run, "benchmarks.server_throughput:serve_app()" '''
+    from app import create_app
+    app = create_app()
+
+    if not os.environ.get("ALCHEMAX_BENCH_MONGO"):
+        get_client = _mongomock_per_process()
+
+        @app.before_request
+        def bench_client():
+            get_client()
+
+    return app
+
+
+### --- LOAD SIDE --- ###
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _start(command, port, env):
+    ''' Starts a server and waits until it answers, returns the process '''
+    process = subprocess.Popen(command, cwd=backEnd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1).close()
+            return process
+        except OSError:
+            if process.poll() is not None:
+                break
+            time.sleep(0.1)
+    process.kill()
+    raise RuntimeError("The server didn't start: " + " ".join(command))
+
+def _stop(process):
+    process.terminate()
+    try:
+        process.wait(10)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+def _load(port, path, headers, clients, seconds):
+    ''' clients threads sending path for seconds, returns (requests per second, list of each requests milliseconds, errors) '''
+    timings = []
+    errors = []
+    end = time.perf_counter() + seconds
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        mine = []
+        failed = 0
+        while True:
+            start = time.perf_counter()
+            if start >= end:
+                break
+            try:
+                connection.request("GET", path, headers=headers)
+                response = connection.getresponse()
+                response.read()
+                failed += response.status != 200
+            except (OSError, http.client.HTTPException):
+                failed += 1
+                connection.close() # reconnects on the next request
+            mine.append((time.perf_counter() - start) * 1000)
+        connection.close()
+        timings.extend(mine)
+        errors.append(failed)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(timings) / seconds, timings, sum(errors)
+
+
+def main():
+    args = harness.arguments(__doc__, workers=4, clients=32, path="/api/profile")
+
+    env = dict(os.environ)
+    if args.mongo:
+        from bson import ObjectId
+        db = harness.database(True)
+        db.users.insert_one({"_id": ObjectId(benchUserId), "username": "bench-user", "email": "bench-user@example.com",
+                             "firstName": "Bench", "lastName": "User", "admin": False, "memberOf": [], "ownerOf": []})
+        env = {**os.environ, "ALCHEMAX_BENCH_MONGO": "1"} # harness.database has set ALCHEMAX_MONGO_DB to the scratch database
+    headers = {"x-access-token": harness.token_for(benchUserId, "bench-user")}
+
+    servers = [("flask dev server", lambda port: [sys.executable, "-c",
+                "from benchmarks.server_throughput import serve_app; serve_app().run(port=" + str(port) + ", threaded=True)"])]
+    try:
+        import gunicorn
+        for workers in sorted({1, args.workers}):
+            servers.append(("gunicorn " + str(workers) + " worker" + ("s" if workers > 1 else ""),
+                            lambda port, workers=workers: [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py",
+                                "--bind", "127.0.0.1:" + str(port), "--workers", str(workers), "--access-logfile", os.devnull,
+                                "benchmarks.server_throughput:serve_app()"]))
+    except ImportError:
+        print("gunicorn isn't installed (pip install gunicorn), only measuring the development server\n")
+
+    rows = []
+    for case, command in servers:
+        port = _free_port()
+        process = _start(command(port), port, env)
+        try:
+            _load(port, args.path, headers, args.clients, 0.5) # warm up
+            perSecond, timings, errors = _load(port, args.path, headers, args.clients, args.seconds)
+        finally:
+            _stop(process)
+        rows.append((case, {"req/s": perSecond, "p50 ms": harness.percentile(timings, 50), "p99 ms": harness.percentile(timings, 99),
+                            "errors": errors}))
+
+    harness.report("GET " + args.path + ", " + str(args.clients) + " clients" + (", real mongoDB" if args.mongo else ", mongomock per process"), rows)
+
+
+if __name__ == "__main__":
+    main()
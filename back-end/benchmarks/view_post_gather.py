@@ -0,0 +1,74 @@
+''' Requests per second on a single post (view_one_post) with its lookups one after the other and with parallel.gather
+
+    "before" swaps gather for a loop that makes each call in turn, like the endpoint used to, "after" is parallel.gather.
+    The principal and the names are cached after the first request, so each request still reads the post and its page of
+    comments, the two lookups gather runs together.
+
+    mongomock answers instantly, so without --mongo every call that would be a round trip waits --latency-ms first
+    (time.sleep releases the GIL the same way pymongo does waiting on the socket).
+    Each case is run with one thread, where the request is only waiting, and with --clients threads sending requests at
+    once like the threads of one gunicorn worker, where the CPU can be busy enough that overlapping the waits gains little
+
+    python -m benchmarks.view_post_gather [--mongo] [--seconds 2] [--latency-ms 2] [--clients 8]
+'''
+
+### --- IMPORTS --- ###
+import datetime, threading
+from benchmarks import harness
+
+
+def _load(app, url, headers, clients, seconds):
+    ''' clients threads, each with its own test client, returns (requests per second, list of each requests milliseconds) '''
+    timings = []
+
+    def client():
+        testClient = app.test_client()
+        def view():
+            response = testClient.get(url, headers=headers)
+            assert response.status_code == 200, response.get_data()
+        perSecond, mine = harness.run_for(seconds, view)
+        timings.extend(mine)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return len(timings) / seconds, timings
+
+
+def main():
+    args = harness.arguments(__doc__, latency_ms=2.0, clients=8)
+    app, client, db = harness.build_app(args.mongo)
+
+    import parallel
+    group_id = str(db.groups.insert_one({"group_name": "Bench group", "group_access": "Public", "requests": []}).inserted_id)
+    user_id = harness.make_user(db, "bench-user", memberOf=[group_id])
+    now = datetime.datetime(2025, 1, 1)
+    post_id = str(db.posts.insert_one({"group_id": group_id, "creator": user_id, "post_title": "Bench", "post_message": "Hello",
+                                       "event_button": "No", "date_posted": now, "comment_count": 20}).inserted_id)
+    db.comments.insert_many([{"post_id": post_id, "user_id": user_id, "comment": "Comment " + str(i),
+                              "date_posted": now + datetime.timedelta(minutes=i)} for i in range(20)])
+    headers = {"x-access-token": harness.token_for(user_id, "bench-user")}
+    url = "/api/groups/" + group_id + "/" + post_id
+
+    if not args.mongo:
+        harness.add_latency(args.latency_ms)
+
+    gather = parallel.gather
+    rows = []
+    for clients in sorted({1, args.clients}):
+        for case, gatherWith in (("in turn (before)", lambda *calls: [call() for call in calls]), ("gather (after)", gather)):
+            parallel.gather = gatherWith
+            _load(app, url, headers, 1, 0.2) # warm up the caches
+            perSecond, timings = _load(app, url, headers, clients, args.seconds)
+            rows.append((str(clients) + " thread" + ("s, " if clients > 1 else ", ") + case,
+                         {"req/s": perSecond, "p50 ms": harness.percentile(timings, 50), "p99 ms": harness.percentile(timings, 99)}))
+    parallel.gather = gather
+
+    latency = "real mongoDB" if args.mongo else str(args.latency_ms) + " ms per round trip"
+    harness.report("GET /api/groups/<group_id>/<post_id>, " + latency, rows)
+
+
+if __name__ == "__main__":
+    main()
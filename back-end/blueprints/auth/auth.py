@@ -8,9 +8,13 @@
 '''
 ### --- IMPORTS --- ###
 from flask import Blueprint, request, jsonify, make_response, g
-import datetime, globals, bcrypt, jwt
+import datetime, globals, jwt
 from decorators import jwt_required, admin_required
 from bson import ObjectId
+from health import mongo_required
+import revocation, health, hashing, indexes, identity_cache, jobs, principal, mongo_pool
+import cascades # the delete_account job (registered with jobs.py) and delete_user
+import log_writer # control logs (the logs collection) are queued and written in the background
 
 ### --- BLUEPRINT SETUP --- ###
 auth_bp = Blueprint("auth_bp", __name__)
@@ -18,9 +22,15 @@ auth_bp = Blueprint("auth_bp", __name__)
 ### --- COLLECTION DETAILS --- ###
 users = globals.db.users # where the user details are stored of course :)
 blacklist = globals.db.blacklist # for storing old session tokens when a user logs out
-controlLogs = globals.db.logs # for storing detials of what each user did, i.e. user logged in at (time)
 auditLogs = globals.db.audit # for storing any issues that happen, i.e. user failed login, giving the exact detail of why
 
+### --- INDEXES --- ###
+indexes.register("users", [("username", 1)]) # login and register
+indexes.register("users", [("email", 1)]) # register and edit profile
+indexes.register_query("login", "users", {"username": "user-1"},
+                       seed=[{"username": "user-" + str(i), "email": "user" + str(i) + "@example.com", "memberOf": [], "ownerOf": []} for i in range(50)])
+indexes.register_query("email in use", "users", {"email": "user1@example.com"})
+
 
 ### --- GLOBAL VARIABLES --- ###
 '''
@@ -40,6 +50,7 @@ deleteAccountUnableToFindAccountMessage = "Can not find account"
 deleteAccountUnableToDelete = "Error, unable to delete account"
 missingFormData = "All required form data must be entered"
 oldPasswordIncorrectMessage = "Change password fail, current password incorrect"
+serverBusyMessage = "Server is busy, please try again shortly"
 
 
 # Success
@@ -51,41 +62,51 @@ databaseHealthyMessage = "Database is ok"
 logoutSuccessMessage = "Logout successful"
 
 
+### --- PASSWORD HASHING BUSY --- ###
+''' Returned when the password hashing pool (hashing.py) is full, rather than making the user wait in a queue '''
+def hashing_busy():
+    response = make_response(jsonify({"error": serverBusyMessage}), 503)
+    response.headers["Retry-After"] = str(hashing.retryAfterSeconds)
+    return response
+
+
 ### --- CONNECTION TEST --- ###
-## TODO - This could be done through a blueprint, for the test I won't do it
-''' This will check if mongoDB is available before running the rest of the program, this will:
-        1) Return True if Mongo is reacable
-        2) Return False if there is an error
+''' The database check itself lives in health.py, a background thread pings mongoDB so endpoints don't have to.
+
+    These endpoints just report what the health monitor last saw, they never ping mongoDB themselves:
+        1) Liveness - the API process is up and answering
+        2) Readiness - mongoDB is reachable, so requests can be served (503 if not)
+        3) Details - the breaker state, the control log queue and the cache counters, admins only
+
+    Liveness and readiness are public (load balancers and uptime checks call them), so they only say whether it is up.
+    /api/database_health is kept as the readiness check so nothing that already calls it breaks
+
+    EXAMPLE URL: http://localhost:5000/api/health/live
+    EXAMPLE URL: http://localhost:5000/api/health/ready
+    EXAMPLE URL: http://localhost:5000/api/health/details
 '''
-def mongo_required():
-    try:
-        globals.client.admin.command("ping")
-        return True, None
+@auth_bp.route("/api/health/live", methods = ['GET'])
+def liveness():
+    return (jsonify({"OK": True}), 200)
 
-    except Exception as e:
-        return False, (jsonify({"error": str(e)}), 503)
-    
+@auth_bp.route("/api/health/ready", methods = ['GET'])
 @auth_bp.route("/api/database_health", methods = ['GET'])
 def database_health():
-    ok, err = mongo_required()
-    if not ok:
-        logsMessage = {
-            "Date/Time" : datetime.datetime.now(datetime.UTC),
-            "Action" : "Database Health Check",
-            "Account" : "",
-            "Message" : databaseNotHealthyMessage
-        }
-        result = controlLogs.insert_one(logsMessage)
-        return err
-    
-    logsMessage = {
-        "Date/Time" : datetime.datetime.now(datetime.UTC),
-        "Action" : "Database Health Check",
-        "Account" : "",
-        "Message" : databaseHealthyMessage
-    }
-    result = controlLogs.insert_one(logsMessage)
-    return (jsonify({"OK": True}), 200)
+    if not health.is_available():
+        return (jsonify({"OK": False, "message": databaseNotHealthyMessage}), 503)
+
+    return (jsonify({"OK": True, "message": databaseHealthyMessage}), 200)
+
+@auth_bp.route("/api/health/details", methods = ['GET'])
+@admin_required
+def health_details():
+    return (jsonify({
+        "OK": health.is_available(),
+        "database": health.status(),
+        "connection_pool": {**mongo_pool.stats(), "settings": globals.client_options()}, # checkout waits show the pool is too small
+        "control_logs": log_writer.stats(), # shows if the control log queue is backing up or dropping logs
+        "identity_cache": {**identity_cache.stats(), "principals": principal.stats()}
+    }), 200)
 
 
 ### --- ACCOUNT CREATION --- ###
@@ -131,7 +152,7 @@ def register():
                 "Account" : "",
                 "Message" : passwordsDontMatchMessage
             }
-            result = controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             # Return Result
             return make_response(jsonify({"error": "Passwords do not match, please check the passwords entered"}), 409)
@@ -146,7 +167,7 @@ def register():
                 "Account" : "",
                 "Message" : usernameTakenMessage
             }
-            result = controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             # Return Result
             return make_response(jsonify({"error" : "username already taken"}), 409)
@@ -161,16 +182,13 @@ def register():
                 "Account" : "",
                 "Message" : emailInUseMessage
             }
-            result = controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             # Return Result
             return make_response(jsonify({"error" : "Email already in use"}), 409)
         
-        # hash the password
-        hashed_password = bcrypt.hashpw(
-            bytes(password, 'UTF-8'),
-            bcrypt.gensalt()
-        )
+        # hash the password (runs on the hashing pool)
+        hashed_password = hashing.hash_password(password)
 
         # Create the new user document and add it to the users collection
         new_user = {
@@ -194,11 +212,14 @@ def register():
             "Account" : username,
             "Message" : registrationSuccessMessage
         }
-        result = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         # output OK
         return make_response(jsonify({"message" : "User registered successfully", "user_id": new_user_id}), 201)
 
+    except hashing.HashingBusy:
+        return hashing_busy()
+
     except Exception as e:
         return (jsonify({"error": str(e)}), 503)
 
@@ -225,7 +246,7 @@ def login():
 
             # create jwt joken, with a 30 minute session token
             if user is not None:
-                if bcrypt.checkpw(bytes(auth.password, 'UTF-8'), user["password"]):
+                if hashing.check_password(auth.password, user["password"]):
                     user_id = str(user['_id'])
                     token = jwt.encode( {
                         'user_db_id' : user_id,
@@ -244,7 +265,7 @@ def login():
                         "Account" : auth.username,
                         "Message" : loginSuccessMessage
                     }
-                    result = controlLogs.insert_one(logsMessage)
+                    log_writer.enqueue(logsMessage)
 
                     # Return Result
                     return make_response( jsonify( {'token' : token, "user_id" : user_id}), 200)
@@ -259,7 +280,7 @@ def login():
                         "Account" : auth.username,
                         "Message" : loginFailMessage
                     }
-                    result = controlLogs.insert_one(logsMessage)
+                    log_writer.enqueue(logsMessage)
 
                     # Return Result
                     return make_response( jsonify ( {'message' : 'Invalid username or password'}), 401)
@@ -271,10 +292,13 @@ def login():
                 "Account" : auth.username,
                 "Message" : loginFailMessage
             }
-            result = controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             # Return Result
             return make_response( jsonify( {'message' : 'Invalid username or Password'}), 401)
+
+    except hashing.HashingBusy:
+        return hashing_busy()
     
     except Exception as e:
         return (jsonify({"error": str(e)}), 503)
@@ -291,7 +315,10 @@ def login():
 def logout(user_id):
         
     token = request.headers['x-access-token']
-    blacklist.insert_one({"token" : token})
+    claims = g.token_claims # already verified by jwt_required, this is just for the exp
+
+    # Adds the token to the blacklist collection and this workers revoked set
+    revocation.revoke(token, claims)
 
     # Add to logs
     logsMessage = {
@@ -300,7 +327,7 @@ def logout(user_id):
         "Account" : g.current_username,
         "Message" : logoutSuccessMessage
     }
-    result = controlLogs.insert_one(logsMessage)
+    log_writer.enqueue(logsMessage)
 
     # Return Result
     return make_response(jsonify( {'message' : 'Logout successful'} ), 200)
@@ -313,6 +340,10 @@ def logout(user_id):
     The user will need to be logged in to delete their account
     
     A user can not delete another users account
+
+    The user document is deleted straight away, everything else they own or are referenced in (groups, posts, comments,
+    memberships, RSVPs) is deleted by a background job (see cascades.py), so a busy account doesn't hold up the request.
+    The response is a 202 with status_url, which shows how far the job has got
     
     EXAMPLE URL: http://localhost:5000/api/delete_account
 '''
@@ -333,27 +364,22 @@ def delete_account(user_id):
     
     ## -- DELETE USER -- ##
     try:
-        # get the groups owned by the user
-        owned_groups = globals.db.groups.find({"group_owner": user_str_id})
-        owned_group_ids = [str(g['_id']) for g in owned_groups]
-
-        # Delete all posts belonging to those groups
-        if owned_group_ids:
-            globals.db.posts.delete_many({"group_id": {"$in": owned_group_ids}})
+        # What the job will need once the user document has gone
+        userDetails = users.find_one({"_id" : user_object_id}, {"memberOf" : 1})
+        found = userDetails is not None
 
-        # Delete the groups themselves
-        globals.db.groups.delete_many({"group_owner": user_str_id})
-
-        # Delete all individual posts
-        globals.db.posts.delete_many({"creator": user_str_id})
-
-        # Delete any comments
-        globals.db.comments.delete_many({"user_id": user_str_id})
-
-        # Delete the user
-        result = users.delete_one({"_id" : user_object_id})
+        if found:
+            owned_group_ids = [str(group["_id"]) for group in globals.db.groups.find({"group_owner": user_str_id}, {"_id" : 1})]
 
+            # The job first, so whatever happens next it gets finished (it starts by deleting the user document too)
+            job_id = jobs.create("delete_account", {
+                "user_id" : user_str_id,
+                "owned_group_ids" : owned_group_ids,
+                "member_of" : userDetails.get("memberOf", [])
+            }, owner=user_str_id)
 
+            # Delete the user and tombstone their groups now, everything else in the background
+            cascades.delete_user(user_str_id, owned_group_ids)
 
     except:
         logsMessage = {
@@ -362,11 +388,11 @@ def delete_account(user_id):
                 "Account": g.current_username, 
                 "Message": deleteAccountUnableToDelete
             }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error" : "Invalid ID format"}), 400)
     
-    if result.deleted_count == 1:
+    if found:
 
         logsMessage = {
                 "Date/Time": datetime.datetime.now(datetime.UTC),
@@ -374,9 +400,11 @@ def delete_account(user_id):
                 "Account": g.current_username, 
                 "Message": deleteAccountMessage
             }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
-        return make_response(jsonify({"message" : "User was deleted"}), 200)
+        response = make_response(jsonify({"message" : "User was deleted", "job_id" : job_id, "status_url" : jobs.status_url(job_id)}), 202)
+        response.headers["Location"] = jobs.status_url(job_id)
+        return response
     else:
 
         logsMessage = {
@@ -385,7 +413,7 @@ def delete_account(user_id):
                 "Account": g.current_username, 
                 "Message": deleteAccountUnableToFindAccountMessage
             }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"message" : "Can not find the user"}), 404)
     
@@ -431,7 +459,7 @@ def edit_profile(user_id):
                 "Account": g.current_username,
                 "Message": missingFormData
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             return make_response(jsonify({"error": "Missing form data"}), 400)
         
@@ -444,7 +472,7 @@ def edit_profile(user_id):
                 "Account": g.current_username,
                 "Message": emailInUseMessage
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
             return make_response(jsonify({"error": emailInUseMessage}), 409)
         
         # Perform update
@@ -465,7 +493,7 @@ def edit_profile(user_id):
                 "Account": g.current_username,
                 "Message": accountChangesMadeMessage
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
             return make_response(jsonify({"message": accountChangesMadeMessage}), 200)
         
         return make_response(jsonify({"error": "Unable to update profile"}), 404)
@@ -480,7 +508,7 @@ def edit_profile(user_id):
             "Account" : g.current_username,
             "Message" : str(e)
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error": str(e)}), 503)
 
@@ -512,7 +540,7 @@ def change_password(user_id):
             return make_response(jsonify({"error": "User not found"}), 404)
         
         # Verify the old password
-        if not bcrypt.checkpw(bytes(old_password, 'UTF-8'), user["password"]):
+        if not hashing.check_password(old_password, user["password"]):
             # Log failure
             logsMessage = {
                 "Date/Time": datetime.datetime.now(datetime.UTC),
@@ -520,7 +548,7 @@ def change_password(user_id):
                 "Account": g.current_username,
                 "Message": oldPasswordIncorrectMessage
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
             return make_response(jsonify({"error": oldPasswordIncorrectMessage}), 401)
         
         # Check if the passwords match
@@ -528,10 +556,7 @@ def change_password(user_id):
             return make_response(jsonify({"error": passwordsDontMatchMessage}), 409)
         
         # Hash and Update
-        hashed_password = bcrypt.hashpw(
-            bytes(new_password, 'UTF-8'),
-            bcrypt.gensalt()
-        )
+        hashed_password = hashing.hash_password(new_password)
 
         users.update_one(
             {"_id": ObjectId(user_id)},
@@ -545,10 +570,12 @@ def change_password(user_id):
             "Account": g.current_username,
             "Message": "Password updated successfully"
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"message": "Password updated successfully"}), 200)
 
+    except hashing.HashingBusy:
+        return hashing_busy()
     
     except Exception as e:
         
@@ -559,6 +586,6 @@ def change_password(user_id):
             "Account" : g.current_username,
             "Message" : str(e)
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error": str(e)}), 503)
@@ -3,16 +3,24 @@ from flask import Blueprint, request, jsonify, make_response, g
 from bson.objectid import ObjectId
 import globals, datetime
 from decorators import jwt_required
+from health import mongo_required
+import log_writer, indexes, identity_cache, etags, parallel, tombstones
 
 calendar_bp = Blueprint('calendar', __name__)
 
 ### --- COLLECTION DETAILS --- ###
 users = globals.db.users
 groups = globals.db.groups
-controlLogs = globals.db.logs 
 groupPosts = globals.db.posts
 postComments = globals.db.comments
 
+### --- INDEXES --- ###
+indexes.register("posts", [("event_date", 1)]) # upcoming events
+indexes.register_query("upcoming events", "posts",
+                       {"event_date": {"$gte": datetime.datetime(2025, 6, 1)}}, [("event_date", 1)],
+                       seed=[{"group_id": "group-1", "creator": "user-1", "event_button": "Yes",
+                              "event_date": datetime.datetime(2025, 1, 1) + datetime.timedelta(days=i)} for i in range(50)])
+
 ### --- GLOBAL VARIABLES --- ###
 mongoError = "Service Unavailable: Database connection failed"
 alreadyRSVPd = "User has already RSVP'd to this event"
@@ -21,13 +29,6 @@ postNotFound = "Unable to find the post"
 notAnEvent = "RSVP failed: This post is not marked as an event"
 userIsNotCreator = "Unable to do action, user is not a creator"
 
-### --- CONNECTION TEST --- ###
-def mongo_required():
-    try:
-        globals.client.admin.command("ping")
-        return True, None
-    except Exception as e:
-        return False, (jsonify({"error": str(e)}), 503)
 
 ### --- RSVP EVENT --- ###
 ''' 
@@ -48,7 +49,7 @@ def rsvp_event(user_id, group_id, post_id):
         p_id = ObjectId(post_id)
         u_id = ObjectId(user_id)
 
-        post = groupPosts.find_one({"_id": p_id, "group_id" : group_id})
+        post = groupPosts.find_one({"_id": p_id, "group_id" : group_id}) if group_id not in tombstones.deleted_groups() else None
 
         if not post:
             return make_response(jsonify({"error": postNotFound}), 404)
@@ -71,6 +72,7 @@ def rsvp_event(user_id, group_id, post_id):
             {"_id": ObjectId(u_id)},
             {"$addToSet": {"my_events": post_id}}
         )
+        etags.bump_post(post_id)
 
         logsMessage = {
             "Date/Time": datetime.datetime.now(datetime.UTC),
@@ -78,7 +80,7 @@ def rsvp_event(user_id, group_id, post_id):
             "Account": g.current_username,
             "Message": f"User {g.current_username} RSVP'd to post {post_id}"
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"success": rsvpSuccess}), 200)
 
@@ -90,7 +92,7 @@ def rsvp_event(user_id, group_id, post_id):
             "Account": g.current_username,
             "Message": str(e)
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
         return make_response(jsonify({"error": str(e)}), 503)
     
 ### --- SEE ATTENDEES --- ###
@@ -146,7 +148,7 @@ def view_attendees(user_id, group_id, post_id):
             "Account": g.current_username,
             "Message": str(e)
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
         return make_response(jsonify({"error": str(e)}), 503)
     
 
@@ -156,6 +158,8 @@ def view_attendees(user_id, group_id, post_id):
     
     If an event occurred before the current date, it will not be returned
 
+    The response has an ETag built from the versions of the events (see etags.py), a poll with nothing new gets a 304
+
     EXAMPLE URL: http://localhost:5000/api/my_calendar
 '''
 @calendar_bp.route("/api/my_calendar", methods=['GET'])
@@ -180,32 +184,33 @@ def view_my_calendar(user_id):
         now = datetime.datetime.now(datetime.UTC)
         start_of_today = datetime.datetime(now.year, now.month, now.day)
 
+        # Nothing has changed since the last poll (past events drop off at midnight, so the day is part of it)
+        deletedGroups = sorted(tombstones.deleted_groups()) # their events are on their way out
+        etag = etags.make(user_id, start_of_today, etags.post_versions(user.get("my_events", [])), deletedGroups)
+        notModified = etags.not_modified(etag)
+        if notModified:
+            return notModified
+
         # Find posts that are in the user's list and are scheduled for today or later
         calendar_cursor = groupPosts.find({
             "_id": {"$in": event_ids},
-            "event_date": {"$gte": start_of_today}
+            "event_date": {"$gte": start_of_today},
+            "group_id": {"$nin": deletedGroups}
         }).sort("event_date", 1)
 
-        my_calendar = []
-        for event in calendar_cursor:
-            event["_id"] = str(event["_id"])
-
-            # Get the creator and group name
-            creator = users.find_one({"_id": ObjectId(event["creator"])}, {"username": 1})
-            group = groups.find_one({"_id": ObjectId(event["group_id"])}, {"group_name": 1})
-            
-            event["creator_username"] = creator["username"] if creator else "Unknown"
-            event["group_name"] = group["group_name"] if group else "Deleted Group"
+        my_calendar = list(calendar_cursor)
 
-            # Format dates to ISO strings
-            if event.get("event_date"):
-                event["event_date"] = event["event_date"].isoformat()
-            if event.get("date_posted"):
-                event["date_posted"] = event["date_posted"].isoformat()
+        # Get the creator and group names for every event at once
+        creatorNames, groupNames = parallel.gather(
+            lambda: identity_cache.usernames.get_many([event.get("creator") for event in my_calendar]),
+            lambda: identity_cache.groupNames.get_many([event.get("group_id") for event in my_calendar])
+        )
 
-            my_calendar.append(event)
+        for event in my_calendar:
+            event["creator_username"] = creatorNames.get(str(event.get("creator"))) or "Unknown"
+            event["group_name"] = groupNames.get(str(event.get("group_id"))) or "Deleted Group"
 
-        return make_response(jsonify({"calendar": my_calendar}), 200)
+        return etags.tag(make_response(jsonify({"calendar": my_calendar}), 200), etag)
 
     
     except Exception as e:
@@ -215,5 +220,5 @@ def view_my_calendar(user_id):
             "Account": g.current_username,
             "Message": str(e)
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
         return make_response(jsonify({"error": str(e)}), 503)
\ No newline at end of file
@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify, make_response, g
 import datetime, globals
 from decorators import jwt_required, admin_required
+from health import mongo_required
+import log_writer, indexes, etags
 from bson import ObjectId
 
 ### --- BLUEPRINT SETUP --- ###
@@ -9,10 +11,17 @@ comments_bp = Blueprint("comments_bp", __name__)
 ### --- COLLECTION DETAILS --- ###
 users = globals.db.users
 groups = globals.db.groups
-controlLogs = globals.db.logs 
 groupPosts = globals.db.posts
 postComments = globals.db.comments
 
+### --- INDEXES --- ###
+indexes.register("comments", [("post_id", 1), ("date_posted", -1), ("_id", -1)]) # comments under a post
+indexes.register("comments", [("user_id", 1)]) # deleting an account removes the users comments
+indexes.register_query("comments on a post", "comments",
+                       {"post_id": "post-1"}, [("date_posted", -1), ("_id", -1)],
+                       seed=[{"post_id": "post-" + str(i % 5), "user_id": "user-" + str(i % 7), "comment_text": "Seed comment",
+                              "date_posted": datetime.datetime(2025, 1, 1) + datetime.timedelta(minutes=i)} for i in range(50)])
+
 ### --- GLOBAL VARIABLES --- ###
 missingFormData = "Missing form data, please check that all the fields have been added successfully"
 userNotInGroup = "User is not in the group"
@@ -24,15 +33,29 @@ commentAddedToPostSuccessfully = "Successfully added comment to post"
 commentEditedSuccessfully = "Successfully edited comment"
 commentDeletedSuccessfully = "Comment Deleted Successfully"
 
-### --- CONNECTION TEST --- ###
-def mongo_required():
-    try:
-        globals.client.admin.command("ping")
-        return True, None
-    except Exception as e:
-        return False, (jsonify({"error": str(e)}), 503)
     
 
+### --- COMMENT COUNT --- ###
+''' Each post keeps a comment_count so feeds can show it without counting the comments collection.
+
+    Posts from before comment_count was added don't have it yet, so the first change counts them properly instead of starting from 0.
+    Returns False if the post doesn't exist
+'''
+def adjust_comment_count(post_id, amount):
+    result = groupPosts.update_one(
+        {"_id" : ObjectId(post_id), "comment_count" : {"$exists" : True}},
+        {"$inc" : {"comment_count" : amount}}
+    )
+
+    if result.matched_count == 0:
+        result = groupPosts.update_one(
+            {"_id" : ObjectId(post_id)},
+            {"$set" : {"comment_count" : postComments.count_documents({"post_id" : post_id})}}
+        )
+
+    return result.matched_count == 1
+
+
 ### --- CREATE COMMENT --- ###
 '''
     This will allow a user to add a comment to a post.
@@ -50,15 +73,7 @@ def create_comment(user_id, group_id, post_id):
     
     try:
         # Verify the user is in the group
-        userDetails = users.find_one(
-            {"_id" : ObjectId(user_id)},
-            {"memberOf" : 1, "ownerOf" : 1}
-        )
-
-        userGroups = userDetails.get("memberOf", [])
-        ownerGroups = userDetails.get("ownerOf", [])
-
-        if group_id not in userGroups and group_id not in ownerGroups:
+        if not g.principal.member_now(group_id):
             return make_response(jsonify({"error": userNotInGroup}), 403)
         
         # Get the form data
@@ -77,6 +92,12 @@ def create_comment(user_id, group_id, post_id):
 
         result = postComments.insert_one(new_comment)
 
+        # Update the posts comment count
+        if not adjust_comment_count(post_id, 1):
+            postComments.delete_one({"_id" : result.inserted_id})
+            return make_response(jsonify({"error": postNotFound}), 404)
+        etags.bump_post(post_id)
+
         # Add to logs
         logsMessage = {
             "Date/Time": datetime.datetime.now(datetime.UTC),
@@ -84,7 +105,7 @@ def create_comment(user_id, group_id, post_id):
             "Account": g.current_username,
             "Message": commentAddedToPostSuccessfully
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"success": "Comment added", "comment_id": str(result.inserted_id)}), 201)
 
@@ -96,7 +117,7 @@ def create_comment(user_id, group_id, post_id):
             "Account" : g.current_username,
             "Message" : str(e)
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
 
 ### --- EDIT COMMENT --- ###
@@ -143,7 +164,7 @@ def edit_comment(user_id, group_id, post_id, comment_id):
             "Account" : g.current_username,
             "Message" : commentEditedSuccessfully
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"success": "Comment updated successfully"}), 200)
     
@@ -155,7 +176,7 @@ def edit_comment(user_id, group_id, post_id, comment_id):
             "Account" : g.current_username,
             "Message" : str(e)
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
 
 ### --- DELETE COMMENT --- ###
@@ -184,7 +205,12 @@ def delete_comment(user_id, group_id, post_id, comment_id):
         if str(comment.get("user_id")) != str(user_id):
             return make_response(jsonify({"error": userIsNotCreator}), 403)
         
-        postComments.delete_one({"_id": ObjectId(comment_id)})
+        deleted = postComments.delete_one({"_id": ObjectId(comment_id)})
+
+        # Update the posts comment count
+        if deleted.deleted_count == 1:
+            adjust_comment_count(comment.get("post_id"), -1)
+            etags.bump_post(comment.get("post_id"))
 
         # Log the deletion
         logsMessage = {
@@ -193,7 +219,7 @@ def delete_comment(user_id, group_id, post_id, comment_id):
             "Account": g.current_username,
             "Message": commentDeletedSuccessfully
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({}), 204)
 
@@ -206,4 +232,4 @@ def delete_comment(user_id, group_id, post_id, comment_id):
             "Account" : g.current_username,
             "Message" : str(e)
         }
-        controlLogs.insert_one(logsMessage)
\ No newline at end of file
+        log_writer.enqueue(logsMessage)
\ No newline at end of file
@@ -1,6 +1,9 @@
 from flask import Blueprint, request, jsonify, make_response, g
 import datetime, globals
 from decorators import jwt_required, admin_required
+from health import mongo_required
+import log_writer, indexes, identity_cache, timelines, pagination, group_search, group_suggest, etags, streaming, tombstones, jobs, principal, memberships
+import cascades # the delete_group job (registered with jobs.py) and unlist_group
 from bson import ObjectId
 
 ### --- BLUEPRINT SETUP --- ###
@@ -9,9 +12,16 @@ groups_bp = Blueprint("groups_bp", __name__)
 ### --- COLLECTION DETAILS --- ###
 users = globals.db.users
 groups = globals.db.groups
-controlLogs = globals.db.logs 
 groupPosts = globals.db.posts 
 
+### --- INDEXES --- ###
+indexes.register("users", [("memberOf", 1)]) # members of a group
+indexes.register("groups", [("group_owner", 1)]) # groups a user owns
+indexes.register_query("group members", "users", {"memberOf": "group-1"},
+                       seed=[{"username": "member-" + str(i), "memberOf": ["group-" + str(i % 5)], "ownerOf": []} for i in range(50)])
+indexes.register_query("owned groups", "groups", {"group_owner": "user-1"},
+                       seed=[{"group_name": "Seed group " + str(i), "group_owner": "user-" + str(i % 7), "requests": []} for i in range(50)])
+
 ### --- GLOBAL VARIABLES --- ###
 databaseNotHealthyMessage = "Database is not responding"
 missingFormData = "Missing form data, please check that all the fields have been added successfully"
@@ -21,10 +31,13 @@ userAlreadySentRequestToJoin = "Failed to send request, user has already sent a
 joinGroupFail = "Unable to join group"
 requestToJoinAcceptedFail = "Failed to accept request to join"
 requestToJoinRejectedFail = "Failed to reject"
+requestToJoinNotFound = "Unable to find the request to join"
 leaveGroupFail = "Unable to leave group"
 userNotInGroup = "User is not in the group"
 groupNotFound = "Unable to find the group"
 userIsNotCreator = "Unable to do action, user is not a creator"
+invalidCursor = "Invalid page cursor"
+searchGroupsFail = "Unable to search for groups"
 
 
 databaseHealthyMessage = "Database is ok"
@@ -37,35 +50,6 @@ leaveGroupSuccessfully = "Successfully left group"
 groupUpdatedSuccessfully = "Successfully updates group"
 groupDeletedSuccessfully = "Successfully deleted group and all related documents"
 
-### --- CONNECTION TEST --- ###
-def mongo_required():
-    try:
-        globals.client.admin.command("ping")
-        return True, None
-    except Exception as e:
-        return False, (jsonify({"error": str(e)}), 503)
-    
-@groups_bp.route("/api/database_health", methods = ['GET'])
-def database_health():
-    ok, err = mongo_required()
-    if not ok:
-        logsMessage = {
-            "Date/Time" : datetime.datetime.now(datetime.UTC),
-            "Action" : "Database Health Check",
-            "Account" : "",
-            "Message" : databaseNotHealthyMessage
-        }
-        result = controlLogs.insert_one(logsMessage)
-        return err
-    
-    logsMessage = {
-        "Date/Time" : datetime.datetime.now(datetime.UTC),
-        "Action" : "Database Health Check",
-        "Account" : "",
-        "Message" : databaseHealthyMessage
-    }
-    result = controlLogs.insert_one(logsMessage)
-    return (jsonify({"OK": True}), 200)
 
 ### --- CREATE GROUP --- ###
 ''' This will be used to allow the user to create their own group.
@@ -102,7 +86,7 @@ def create_group(user_id):
                 "Account" : g.current_username,
                 "Message" : missingFormData
             }
-            result = controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             return make_response(jsonify({"error" : "Missing form data"}), 404)
         
@@ -114,7 +98,8 @@ def create_group(user_id):
             "location" : groupLocation,
             "group_access" : groupAccess,
             "group_owner" : user_id,
-            "requests" : []
+            "requests" : [],
+            **group_search.search_document(groupName, groupCategory)
         }
 
         # Add group to group collection
@@ -125,6 +110,9 @@ def create_group(user_id):
             {"_id" : ObjectId(user_id)},
             {"$push" : {"ownerOf" : str(new_group_id.inserted_id)}}
         )
+        memberships.add(user_id, new_group_id.inserted_id, "owner")
+        principal.invalidate(user_id)
+        group_suggest.add_group(new_group_id.inserted_id, groupName, groupCategory)
 
         # NOTE - This will only work once the "view group" endpoint is added
         new_group_url = "http://localhost:5000/api/groups/" + str(new_group_id.inserted_id)
@@ -135,7 +123,7 @@ def create_group(user_id):
            "Account": g.current_username, 
             "Message": groupCreatedSuccessfully
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"message" : "Group was created " + new_group_url}), 201)
          
@@ -148,6 +136,12 @@ def create_group(user_id):
 ### --- JOIN GROUP --- ###
 ''' THis will allow users to join a group
 
+    Joining is one conditional update, so two joins (or a join and a leave) at the same time can't overwrite each other:
+        - Public groups add the group to the users memberOf with $addToSet, only if it isn't there already
+        - Private groups add the user to the groups requests with $addToSet, only if they aren't there already
+    Whether it worked, or the user was already in, comes from the update result (or the memberships, see memberships.py) instead of reading the arrays first
+    A join that worked adds the membership as well, a leave that worked takes it away
+
     EXAMPLE URL: http://localhost:5000/api/groups/<group_id>/join
 '''
 @groups_bp.route("/api/<string:group_id>/join", methods=['PUT'])
@@ -162,80 +156,50 @@ def join_group(user_id, group_id):
     try:
         # Get groups "group_access"
         group_access = groups.find_one(
-            {'_id':ObjectId(group_id)}, # Filter (what to find)
+            {'_id':ObjectId(group_id), **tombstones.notDeleted}, # Filter (what to find)
             {'group_access': 1} # Projection (what to return)
             )
         
-        # Get groups "requests" NOTE - I know this is an added step, but it just makes it easier
-        groupRequests = groups.find_one(
-            {'_id':ObjectId(group_id)}, # Filter (what to find)
-            {'requests': 1, "_id" : 0} # Projection (what to return)
-            )
-        
-        # Find the current user
-        current_user = users.find_one(
-            {'username':g.current_username},
-            {"memberOf" : 1, '_id' : 1}
-        )
-
-        # Get the users current groups so we can update the list
-        userGroups = current_user.get('memberOf', [])
-
-        # Check if the user is already apart of the group
-        if group_id not in userGroups:
+        # Check if group is public or private
+        if group_access.get("group_access") == "Public":
 
-            # Check if group is public or private
-            if group_access.get("group_access") == "Public":
-                
-
-                userGroups.append(group_id)
-
-                # Add user to the group
-                result = users.update_one(
-                    {"_id" : ObjectId(user_id)}, {
-                        "$set" : {"memberOf" : userGroups}
-                    }
-                )
+            # Add user to the group, unless they are already apart of it
+            result = users.update_one(
+                {"_id" : ObjectId(user_id), "memberOf" : {"$ne" : group_id}}, {
+                    "$addToSet" : {"memberOf" : group_id}
+                }
+            )
 
-                if result.matched_count == 1:
+            if result.modified_count == 1:
+                memberships.add(user_id, group_id)
+                principal.invalidate(user_id)
 
-                    # Add to logs
-                    logsMessage = {
-                        "Date/Time" : datetime.datetime.now(datetime.UTC),
-                        "Action" : "Join Group",
-                        "Account" : g.current_username,
-                        "Message" : joinedGroupSuccessfully
-                    }
-                    logResult = controlLogs.insert_one(logsMessage)
+                # Copy the groups recent posts into the users timeline
+                timelines.backfill(user_id, group_id)
+                etags.bump_groups(group_id)
 
-                    return make_response ( jsonify( { "Success" : "Joined Group"} ), 200)
-            
-            # If the group is private
-            else:
-                userRequest = groupRequests.get('requests')
-
-                # Check fi the user has already sent a request
-                if user_id not in userRequest:
-                    userRequest.append(user_id)
-                
-                else:
-                    # Add to logs
-                    logsMessage = {
-                        "Date/Time" : datetime.datetime.now(datetime.UTC),
-                        "Action" : "Join Group",
-                        "Account" : g.current_username,
-                        "Message" : userAlreadySentRequestToJoin
-                    }
-                    logResult = controlLogs.insert_one(logsMessage)
+                # Add to logs
+                logsMessage = {
+                    "Date/Time" : datetime.datetime.now(datetime.UTC),
+                    "Action" : "Join Group",
+                    "Account" : g.current_username,
+                    "Message" : joinedGroupSuccessfully
+                }
+                log_writer.enqueue(logsMessage)
 
-                    return make_response ( jsonify( { "error" : "User has already sent a join request" } ), 404)
+                return make_response ( jsonify( { "Success" : "Joined Group"} ), 200)
+        
+        # If the group is private, and the user isn't in it (read fresh, the cached principal can be a few seconds behind an accept)
+        elif not memberships.is_member(user_id, group_id):
 
+            # Add the request, unless the user has already sent one
+            result = groups.update_one(
+                {"_id" : ObjectId(group_id), **tombstones.notDeleted, "requests" : {"$ne" : user_id}}, {
+                    "$addToSet" : {"requests" : user_id}
+                }
+            )
 
-                result = groups.update_one(
-                    {"_id" : ObjectId(group_id)}, {
-                        "$set" : {"requests" : userRequest}
-                    }
-                )
+            if result.modified_count == 1:
 
                 # Add to logs
                 logsMessage = {
@@ -244,23 +208,31 @@ def join_group(user_id, group_id):
                     "Account" : g.current_username,
                     "Message" : requestToJoinSuccessfullySent
                 }
-                logResult = controlLogs.insert_one(logsMessage)
+                log_writer.enqueue(logsMessage)
 
                 return make_response ( jsonify( { "Success" : "Requested to join group"} ), 200)
-
-          
-        else:
-
+            
             # Add to logs
             logsMessage = {
                 "Date/Time" : datetime.datetime.now(datetime.UTC),
                 "Action" : "Join Group",
                 "Account" : g.current_username,
-                "Message" : userAlreadyInGroup
+                "Message" : userAlreadySentRequestToJoin
             }
-            logResult = controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
+
+            return make_response ( jsonify( { "error" : "User has already sent a join request" } ), 404)
+
+        # Add to logs
+        logsMessage = {
+            "Date/Time" : datetime.datetime.now(datetime.UTC),
+            "Action" : "Join Group",
+            "Account" : g.current_username,
+            "Message" : userAlreadyInGroup
+        }
+        log_writer.enqueue(logsMessage)
 
-            return make_response ( jsonify( { "error" : "User is already apart of this group" } ), 404)
+        return make_response ( jsonify( { "error" : "User is already apart of this group" } ), 404)
         
         
     except:
@@ -272,7 +244,7 @@ def join_group(user_id, group_id):
             "Account" : g.current_username,
             "Message" : joinGroupFail
         }
-        result = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error" : "Can not find/join the group"}), 404)
     
@@ -291,7 +263,7 @@ def requests_to_join(user_id, group_id):
 
     # Find out who the group owner is
     groupDetails = groups.find_one(
-        {'_id':ObjectId(group_id)}, # Filter (what to find)
+        {'_id':ObjectId(group_id), **tombstones.notDeleted}, # Filter (what to find)
         {'group_owner': 1, "requests" : 1, "_id" : 0} # Projection (what to return)    
     )
 
@@ -333,6 +305,9 @@ def requests_to_join(user_id, group_id):
 
     If rejected, the request will be removed
 
+    Either way the request is taken off with a $pull that only matches while it is still there, so only one accept or reject
+    can win it (the other gets a 404), and a user is only added to the group by the accept that won
+
     This will have two endpoints, I just don't wanna type another whole header and description
 
     EXAMPLE URL ACCEPTED: http://localhost:5000/api/groups/<group_id>/requests_to_join/<request_id>/accepted
@@ -349,13 +324,10 @@ def join_request_accepted(user_id, group_id, request_id):
     if not ok:
         return err
     
-    # Variables
-    selectedUser = None
-    
      # Find out who the group owner is
     groupDetails = groups.find_one(
-        {'_id':ObjectId(group_id)}, # Filter (what to find)
-        {'group_owner': 1, "requests" : 1, "_id" : 0} # Projection (what to return)    
+        {'_id':ObjectId(group_id), **tombstones.notDeleted}, # Filter (what to find)
+        {'group_owner': 1, "_id" : 0} # Projection (what to return)    
     )
 
     groupOwnerId = groupDetails.get("group_owner")
@@ -366,32 +338,39 @@ def join_request_accepted(user_id, group_id, request_id):
     
     try:
 
-        # Get the requests to join the group
-        groupRequests = groupDetails.get("requests")
+        # Take the request off the group, only if it is still there
+        groupResult = groups.update_one(
+            {"_id" : ObjectId(group_id), **tombstones.notDeleted, "requests" : request_id}, {
+                "$pull" : {"requests" : request_id}
+            }
+        )
 
-        # Check if request id matches the url
-        for request in groupRequests:
-            if request == request_id:
-                selectedUser = request
+        # No request (or another accept/reject got to it first)
+        if groupResult.modified_count != 1:
+
+            # Add to logs
+            logsMessage = {
+                "Date/Time" : datetime.datetime.now(datetime.UTC),
+                "Action" : "Join Group",
+                "Account" : g.current_username,
+                "Message" : requestToJoinNotFound
+            }
+            log_writer.enqueue(logsMessage)
+
+            return make_response(jsonify({"error" : "Can not find user request"}), 404)
 
-        #if selectedUser != request_id: 
-        #    return make_response ( jsonify( { "error" : "Can not find user request" } ), 404)
-        
         # Add user to group
         userResult = users.update_one(
-            {"_id" : ObjectId(selectedUser)}, {
-                "$push" : {"memberOf" : group_id}
+            {"_id" : ObjectId(request_id)}, {
+                "$addToSet" : {"memberOf" : group_id}
             }
         )
+        memberships.add(request_id, group_id)
+        principal.invalidate(request_id)
 
-        # Remove request
-        groupRequests.remove(selectedUser)
-        
-        groupResult = groups.update_one(
-            {"_id" : ObjectId(group_id)}, {
-                "$set" : {"requests" : groupRequests}
-            }
-        )
+        # Copy the groups recent posts into the new members timeline
+        timelines.backfill(request_id, group_id)
+        etags.bump_groups(group_id)
 
         # Add to logs
         logsMessage = {
@@ -400,7 +379,7 @@ def join_request_accepted(user_id, group_id, request_id):
             "Account" : g.current_username,
             "Message" : requestToJoinAccepted
         }
-        result = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"Success": "Request to join accepted"}), 201)
 
@@ -414,7 +393,7 @@ def join_request_accepted(user_id, group_id, request_id):
             "Account" : g.current_username,
             "Message" : requestToJoinAcceptedFail
         }
-        result = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error": str(e)}), 503)
     
@@ -427,13 +406,10 @@ def join_request_rejected(user_id, group_id, request_id):
     if not ok:
         return err
     
-    # Variables
-    selectedUser = None
-    
      # Find out who the group owner is
     groupDetails = groups.find_one(
-        {'_id':ObjectId(group_id)}, # Filter (what to find)
-        {'group_owner': 1, "requests" : 1, "_id" : 0} # Projection (what to return)    
+        {'_id':ObjectId(group_id), **tombstones.notDeleted}, # Filter (what to find)
+        {'group_owner': 1, "_id" : 0} # Projection (what to return)    
     )
 
     groupOwnerId = groupDetails.get("group_owner")
@@ -444,23 +420,26 @@ def join_request_rejected(user_id, group_id, request_id):
     
     try:
 
-        # Get the requests to join the group
-        groupRequests = groupDetails.get("requests")
-
-        # Check if request id matches the url
-        for request in groupRequests:
-            if request == request_id:
-                selectedUser = request
-
-        # Remove request
-        groupRequests.remove(selectedUser)
-        
+        # Take the request off the group, only if it is still there
         groupResult = groups.update_one(
-            {"_id" : ObjectId(group_id)}, {
-                "$set" : {"requests" : groupRequests}
+            {"_id" : ObjectId(group_id), **tombstones.notDeleted, "requests" : request_id}, {
+                "$pull" : {"requests" : request_id}
             }
         )
 
+        # No request (or another accept/reject got to it first)
+        if groupResult.modified_count != 1:
+
+            # Add to logs
+            logsMessage = {
+                "Date/Time" : datetime.datetime.now(datetime.UTC),
+                "Action" : "Join Group",
+                "Account" : g.current_username,
+                "Message" : requestToJoinNotFound
+            }
+            log_writer.enqueue(logsMessage)
+
+            return make_response(jsonify({"error" : "Can not find user request"}), 404)
 
         ## TODO FIX
         # Add to logs
@@ -470,7 +449,7 @@ def join_request_rejected(user_id, group_id, request_id):
             "Account" : g.current_username,
             "Message" : requestToJoinRejected
         }
-        result = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"Success": "User has been rejected"}), 201)
 
@@ -484,7 +463,7 @@ def join_request_rejected(user_id, group_id, request_id):
             "Account" : g.current_username,
             "Message" : requestToJoinRejectedFail
         }
-        result = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error": str(e)}), 503)
     
@@ -493,6 +472,8 @@ def join_request_rejected(user_id, group_id, request_id):
 
     To keep things simple (mostly just to avoid bugs where owners accept a user right as the user removes their request), users will not be allowed to remove their request to join
 
+    Leaving is a single $pull that only matches if the user is in the group, so it can't undo a join that happened at the same time
+
     EXAMPLE URL: http://localhost:5000/api/groups/<group_id>/leave
 '''
 @groups_bp.route("/api/groups/<group_id>/leave", methods = ['PUT'])
@@ -505,36 +486,30 @@ def leave_group(user_id, group_id):
     
     try:
     
-        # Find the user
-        userDetails = users.find_one(
-            {'_id':ObjectId(user_id)}, # Filter (what to find)
-            {'memberOf' : 1, "_id" : 0} # Projection (what to return)    
-        )
-
-        # Grab the memberOf data
-        userGroups = userDetails.get("memberOf")
-
-        for group in userGroups:
-            if group == group_id:
-                # Remove group
+        # Remove group, if the user is in it
+        result = users.update_one(
+            {"_id" : ObjectId(user_id), "memberOf" : group_id}, {
+                "$pull" : {"memberOf" : group_id}
+            })
 
-                result = userGroups.remove(group)
+        if result.modified_count == 1:
+            memberships.remove(user_id, group_id)
+            principal.invalidate(user_id)
 
-                groupResult = users.update_one(
-                {"_id" : ObjectId(user_id)}, {
-                    "$set" : {"memberOf" : userGroups}
-                })
+            # Take the groups posts out of the users timeline
+            timelines.trim(user_id, group_id)
+            etags.bump_groups(group_id)
 
-                # Add to logs
-                logsMessage = {
-                    "Date/Time" : datetime.datetime.now(datetime.UTC),
-                    "Action" : "Leave Group",
-                    "Account" : g.current_username,
-                    "Message" : leaveGroupSuccessfully
-                }
-                result = controlLogs.insert_one(logsMessage)
+            # Add to logs
+            logsMessage = {
+                "Date/Time" : datetime.datetime.now(datetime.UTC),
+                "Action" : "Leave Group",
+                "Account" : g.current_username,
+                "Message" : leaveGroupSuccessfully
+            }
+            log_writer.enqueue(logsMessage)
 
-                return make_response(jsonify({"Success": "Successfully left group"}), 201)
+            return make_response(jsonify({"Success": "Successfully left group"}), 201)
         
 
         # Add to logs
@@ -544,7 +519,7 @@ def leave_group(user_id, group_id):
             "Account" : g.current_username,
             "Message" : leaveGroupFail
         }
-        result = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
         return make_response(jsonify({"Error": "Can not find the group"}), 404)
 
 
@@ -559,7 +534,7 @@ def leave_group(user_id, group_id):
             "Account" : g.current_username,
             "Message" : leaveGroupFail
         }
-        result = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error": str(e)}), 503)
     
@@ -574,6 +549,8 @@ def leave_group(user_id, group_id):
     EXAMPLE URL SUBMIT: http://localhost:5000/api/get_user_groups
     
     EXAMPLE URL SUBMIT: http://localhost:5000/api/create_post
+
+    get_user_groups sends an ETag (see etags.py), built from the users groups and their versions
 '''
 
 ## GET GROUPS THE USER IS IN ##
@@ -586,6 +563,11 @@ def get_user_groups(user_id):
         return err
     
     try:
+        # Nothing has changed since the last poll
+        etag = etags.make(user_id, g.principal.member_of, g.principal.owner_of, etags.group_versions(g.principal.groups()))
+        notModified = etags.not_modified(etag)
+        if notModified:
+            return notModified
 
         # Pipeline
         pipeline = [
@@ -605,7 +587,8 @@ def get_user_groups(user_id):
                                         {"$toString" : "$_id"}, # converts Group ID to string
                                         "$$user_member_list" # Check if it's in your list
                                     ]
-                                }
+                                },
+                                **tombstones.notDeleted # not being deleted
                             }
                         }
                     ],
@@ -619,7 +602,7 @@ def get_user_groups(user_id):
                     "from" : "groups",
                     "let" : {"owner_list" : "$ownerOf"},
                     "pipeline" : [
-                        {"$match" : {"$expr" : {"$in" : [{"$toString" : "$_id"}, "$$owner_list"]}}}
+                        {"$match" : {"$expr" : {"$in" : [{"$toString" : "$_id"}, "$$owner_list"]}, **tombstones.notDeleted}}
                     ],
                     "as" : "owner_group_details"
                 }
@@ -663,7 +646,7 @@ def get_user_groups(user_id):
         else:
             output = {"joined": [], "owned": []}
 
-        return make_response(jsonify(output), 200)
+        return etags.tag(make_response(jsonify(output), 200), etag)
         
     except Exception as e:
         return make_response(jsonify({"error": str(e)}), 503)
@@ -672,10 +655,24 @@ def get_user_groups(user_id):
 ### --- GROUP HOME PAGE (SEE ALL POSTS THAT THE GROUP HAS UPLOADED) --- ###
 ''' This endpoint will pratically act as the groups home page, showing all posts from the group in reverse chronological order
 
+    Everything comes back from one aggregation on the group document, so a busy group costs the same single round trip:
+        1) The group details
+        2) One page of the feed with the creators usernames, paginated with a cursor like /api/home (?limit= and ?cursor=)
+        3) The total number of posts and members
+
+    Whether the current user is a member or the owner comes from g.principal (see principal.py), usually without a query
+
+    The feed and counts are each a $lookup with their own pipeline rather than branches of a $facet,
+    as a $facet can't use indexes and would sort every post in the group in memory
+
+    The response has an ETag built from the groups version (see etags.py), a poll with nothing new gets a 304 without the aggregation
+
+    With ?stream=1 the feed is left out of the aggregation and streamed from its own cursor instead (see streaming.py)
+
     EXAMPLE URL: http://localhost:5000/api/groups/<group_id>
+    EXAMPLE URL: http://localhost:5000/api/groups/<group_id>?limit=20&cursor=<next_cursor>
+    EXAMPLE URL: http://localhost:5000/api/groups/<group_id>?limit=500&stream=1
 '''
-
-# TODO - PAGINATION NEEDS ADDED
 @groups_bp.route("/api/groups/<group_id>")
 @jwt_required
 def group_page(user_id, group_id):
@@ -685,13 +682,8 @@ def group_page(user_id, group_id):
         return err
     
     try:
-        # Get the user details
-        userDetails = users.find_one({"_id" : ObjectId(user_id)}, {"memberOf" : 1, "ownerOf" : 1})
-
-        userGroups = userDetails.get("memberOf", []) # What the member is in
-        ownerGroups = userDetails.get("ownerOf", []) # What the user owns
-
-        if group_id not in userGroups and group_id not in ownerGroups:
+        # Is the current user in the group (see principal.py), before any of the work below
+        if not g.principal.in_group(group_id):
 
             # Add to logs
             logsMessage = {
@@ -700,48 +692,48 @@ def group_page(user_id, group_id):
                 "Account" : g.current_username,
                 "Message" : userNotInGroup
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             return make_response(jsonify({"error": "User is not a part of this group"}), 404)
 
+        # Nothing has changed since the last poll
+        etag = etags.make(user_id, etags.group_versions([group_id]))
+        notModified = etags.not_modified(etag)
+        if notModified:
+            return notModified
 
-        # Find the post and sort them in reverse chronological order
-        feedCursor = groupPosts.find(
-            {"group_id" : group_id}
-        ).sort("date_posted", -1)
+        # Pagination
+        stream = streaming.requested(request.args)
+        limit = streaming.page_limit(request.args)
+        try:
+            afterCursor = pagination.keyset_filter("date_posted", request.args.get("cursor"))
+        except pagination.InvalidCursor:
+            return make_response(jsonify({"error": invalidCursor}), 400)
 
-        # Convert the cursor to a list, and format IDs for JSON
-        feedPosts = []
-        for post in feedCursor:
-            post["_id"] = str(post["_id"])
+        pipeline, feedPipeline = group_page_pipelines(group_id, afterCursor, limit, stream)
 
-            # Get post creator names
-            creator_details = users.find_one({"_id": ObjectId(post["creator"])}, {"username": 1})
-            post["creator_username"] = creator_details["username"] if creator_details else "Unknown"
+        result = list(groups.aggregate(pipeline))
 
-            # Convert dates to strings
-            if "date_posted" in post:
-                post["date_posted"] = post["date_posted"].isoformat()
-            if "event_date" in post and post["event_date"]:
-                post["event_date"] = post["event_date"].isoformat()
+        if not result:
+            return make_response(jsonify({"error" : groupNotFound}), 404)
+        
+        groupDetails = result[0]
 
-            feedPosts.append(post)
+        groupDetails["post_count"] = groupDetails["post_count"][0]["count"] if groupDetails["post_count"] else 0
+        groupDetails["member_count"] = (groupDetails["member_count"][0]["count"] if groupDetails["member_count"] else 0) + 1 # + the owner
 
-        
-        # Get the group details
-        groupDetails = groups.find_one({"_id" : ObjectId(group_id)}, {"group_name": 1, "description": 1, "category": 1, "location": 1, "group_owner" : 1})
+        if stream:
+            # The group details first, then the feed as it is read
+            page = streaming.FeedPage(groupPosts.aggregate(feedPipeline), "date_posted", limit)
+            return etags.tag(streaming.object_response(groupDetails, "feed", page, lambda: {"next_cursor" : page.next_cursor}), etag)
 
-        if not groupDetails:
-            return make_response(jsonify({"error" : groupNotFound}), 404)
-        
-        # set the _id to a string
-        groupDetails["_id"] = str(groupDetails["_id"])
+        feedPosts, nextCursor = pagination.next_page(groupDetails["feed"], "date_posted", limit)
 
         # Combine feed and group details
         groupDetails["feed"] = feedPosts
+        groupDetails["next_cursor"] = nextCursor
 
-
-        return make_response(jsonify(groupDetails), 200)
+        return etags.tag(make_response(jsonify(groupDetails), 200), etag)
 
     
     except Exception as e:
@@ -753,10 +745,60 @@ def group_page(user_id, group_id):
             "Account" : g.current_username,
             "Message" : str(e)
         }
-        result = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error": str(e)}), 503)
 
+
+def group_page_pipelines(group_id, afterCursor, limit, stream=False):
+    ''' The group page aggregation on the groups collection, returns (pipeline, feedPipeline).
+        feedPipeline is the page of the feed (one extra post to see if there is another page), run on the posts collection
+        when streaming, otherwise it is a $lookup inside pipeline
+    '''
+    # One page of the feed, newest first, one extra to see if there is another page
+    feedPipeline = [
+        {"$match" : {"group_id" : group_id, **afterCursor}},
+        {"$sort" : dict(pagination.keyset_sort("date_posted"))},
+        {"$limit" : limit + 1},
+
+        # Creators username
+        {"$lookup" : {
+            "from" : "users",
+            "let" : {"creator_id" : {"$convert" : {"input" : "$creator", "to" : "objectId", "onError" : None, "onNull" : None}}},
+            "pipeline" : [
+                {"$match" : {"$expr" : {"$eq" : ["$_id", "$$creator_id"]}}},
+                {"$project" : {"username" : 1}}
+            ],
+            "as" : "creator_details"
+        }},
+        {"$addFields" : {"creator_username" : {"$ifNull" : [{"$arrayElemAt" : ["$creator_details.username", 0]}, "Unknown"]}}},
+        {"$project" : {"creator_details" : 0}}
+    ]
+
+    pipeline = [
+        # Find the group
+        {"$match" : {"_id" : ObjectId(group_id), **tombstones.notDeleted}},
+        {"$project" : {"group_name": 1, "description": 1, "category": 1, "location": 1, "group_owner" : 1}},
+
+        # The feed
+        *([] if stream else [{"$lookup" : {"from" : "posts", "pipeline" : feedPipeline, "as" : "feed"}}]),
+
+        # Counts
+        {"$lookup" : {
+            "from" : "posts",
+            "pipeline" : [{"$match" : {"group_id" : group_id}}, {"$count" : "count"}],
+            "as" : "post_count"
+        }},
+        {"$lookup" : {
+            "from" : "users",
+            "pipeline" : [{"$match" : {"memberOf" : group_id}}, {"$count" : "count"}],
+            "as" : "member_count"
+        }}
+    ]
+
+    return pipeline, feedPipeline
+
+
 ### --- EDIT GROUP --- ###
 ''' This will allow a user to edit the post they created
 
@@ -772,7 +814,7 @@ def edit_group(user_id, group_id):
     
     try:
         # Find the groups details
-        groupDetails = groups.find_one({"_id" : ObjectId(group_id)})
+        groupDetails = groups.find_one({"_id" : ObjectId(group_id), **tombstones.notDeleted})
 
         if not groupDetails:
             return make_response(jsonify({"error" : groupNotFound}), 404)
@@ -786,7 +828,7 @@ def edit_group(user_id, group_id):
                 "Account": g.current_username,
                 "Message": userIsNotCreator
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
             return make_response(jsonify({"error": "Unauthorized: Only the owner can edit the group"}), 403)
         
         # Grab the form data with the updates
@@ -808,11 +850,17 @@ def edit_group(user_id, group_id):
                     "location" : groupLocation,
                     "category" : groupCategory,
                     "description" : groupDescription,
-                    "group_access" : groupAccess
+                    "group_access" : groupAccess,
+                    **group_search.search_document(groupName, groupCategory)
                 }
             }
         )
 
+        # The group name may have changed
+        identity_cache.groupNames.invalidate(group_id)
+        group_suggest.update_group(group_id, groupName, groupCategory)
+        etags.bump_groups(group_id)
+
         # Add to logs
         logsMessage = {
             "Date/Time": datetime.datetime.now(datetime.UTC),
@@ -820,7 +868,7 @@ def edit_group(user_id, group_id):
             "Account": g.current_username,
             "Message": groupUpdatedSuccessfully
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"success": "Group updated successfully"}), 200)
 
@@ -833,7 +881,7 @@ def edit_group(user_id, group_id):
             "Account" : g.current_username,
             "Message" : str(e)
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
 
         return make_response(jsonify({"error": str(e)}), 503) 
@@ -843,11 +891,14 @@ def edit_group(user_id, group_id):
 ### --- DELETE GROUP --- ###
 ''' This allows a group owner to delete their group.
 
-    To do this, firstly each user will need to be removed from the group to ensure no one can upload while the group is being deleted
+    The group is tombstoned straight away (see tombstones.py), from then on it can't be found, joined or posted in.
 
-    Secondly all posts need to be removed doesn't matter who posted it
+    Everything else is done by a background job (see cascades.py), a batch at a time so a big group doesn't hold up the request:
+        1) each user is removed from the group
+        2) all posts are removed, doesn't matter who posted it, with their comments and RSVPs
+        3) lastly, the group is removed
 
-    Lastly, the group need to be removed
+    The response is a 202 with status_url, which shows how far the job has got
 
     EXAMPLE URL: http://localhost:5000/api/groups/<group_id>/settings/delete_group
 '''
@@ -860,7 +911,7 @@ def delete_group(user_id, group_id):
     
     try:
         # Get the group details
-        groupDetails = groups.find_one({"_id" : ObjectId(group_id)})
+        groupDetails = groups.find_one({"_id" : ObjectId(group_id), **tombstones.notDeleted}, {"group_owner" : 1})
         if not groupDetails:
             return make_response(jsonify({"error": "Group not found"}), 404)
         
@@ -868,23 +919,12 @@ def delete_group(user_id, group_id):
         if str(groupDetails.get("group_owner")) != str(user_id):
             return make_response(jsonify({"error": "Unauthorized Access"}), 403)
         
-        # Remove the users from the group by removing the group_id from each user
-        users.update_many(
-            {"memberOf" : group_id},
-            {"$pull" : {"memberOf" : group_id}}
-        )
+        # The job first, so whatever happens next it gets finished (it starts by tombstoning the group too)
+        job_id = jobs.create("delete_group", {"group_id" : group_id}, owner=str(user_id))
 
-        # Remove the group id from the owners 'ownerOf' array in the users collection
-        users.update_one(
-            {"_id" : ObjectId(user_id)},
-            {"$pull" : {"ownerOf" : group_id}}
-        )
-
-        # Remove all posts associated with this group
-        groupPosts.delete_many({"group_id" : group_id})
-
-        # Delete group - FINAL STEP
-        groups.delete_one({"_id" : ObjectId(group_id)})
+        # Tombstone the group and remove it from the owners 'ownerOf' now, so it disappears straight away.
+        # Members, posts and the group itself in the background
+        cascades.unlist_group(group_id)
 
         # Add to logs
         logsMessage = {
@@ -893,9 +933,12 @@ def delete_group(user_id, group_id):
             "Account": g.current_username,
             "Message": groupDeletedSuccessfully
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
-        return make_response(jsonify({"success": "Group and all associated data deleted successfully"}), 200)
+        response = make_response(jsonify({"success": "Group deleted, its posts and members are being removed",
+                                          "job_id" : job_id, "status_url" : jobs.status_url(job_id)}), 202)
+        response.headers["Location"] = jobs.status_url(job_id)
+        return response
 
     
     except Exception as e:
@@ -906,14 +949,41 @@ def delete_group(user_id, group_id):
             "Account" : g.current_username,
             "Message" : str(e)
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error": str(e)}), 503)
     
+### --- SEARCH SUGGESTIONS --- ###
+''' This is the typeahead for the search box, called as the user types
+
+    Answered from memory by group_suggest, groups whose name, category or a word of the name starts with ?q=, most popular first.
+    Returns a list (empty if nothing matches), ?limit= is up to 20
+
+    EXAMPLE URL: http://localhost:5000/api/search_for_groups/suggest?q=sim
+'''
+@groups_bp.route("/api/search_for_groups/suggest")
+@jwt_required
+def search_suggestions(user_id):
+
+    # Only the first call in each process reads the database
+    if not group_suggest.is_built():
+        ok, err = mongo_required()
+        if not ok:
+            return err
+
+    suggestions = group_suggest.suggest(request.args.get("q", ""), pagination.page_limit(request.args, default=10, maximum=20))
+
+    data_to_return = [{**suggestion, "url" : "http://localhost:5000/api/groups/" + suggestion["_id"]} for suggestion in suggestions]
+    return make_response(jsonify(data_to_return), 200)
+
+
 ### --- SEARCH FOR GROUP (BY NAME)--- ###
 ''' This will allow a user to search for a group
 
-    Users will have to pass the group_name in the <group_name> field
+    Users will have to pass the group_name in the <group_name> field, the search is done by group_search.
+    Groups whose name starts with the search come first, then groups where every word of the search starts a word in the name.
+
+    Returns up to ?limit= groups, if there are more the X-Next-Cursor header has the cursor for the next page (send it back as ?cursor=)
 
     EXAMPLE URL: http://localhost:5000/api/search_for_groups/group_name/<group_name>
 '''
@@ -921,49 +991,17 @@ def delete_group(user_id, group_id):
 @jwt_required
 def search_by_name(user_id, group_name):
 
-    ## -- PAGINATION SETUP -- ##
-    page_num, page_size = 1, 10
-    if request.args.get('pn'):
-        page_num = int(request.args.get('pn'))
-    if request.args.get('ps'):
-        page_size = int(request.args.get('ps'))
-    page_start = (page_size * (page_num -1))
-    
-    # Regex check
-    '''        
-        In matching_recipes we find:
-            1) $regex - This is mongoDBs' operator for regular expression matching, it calls regex_pattern to get that.
-            2) $options : 'i' - This makes the match case sensitive, so chr, CHR, and Chr all match say "Christmas".        
-    '''
-    regex_pattern = group_name
-
-    # Projection
-    projection = {'group_name' : 1,
-                  'category' : 1,
-                  'description' : 1,
-                  'location' : 1,
-                  'group_access' : 1}
-    
-    matching_groups = groups.find( { 'group_name' : { '$regex' : regex_pattern, '$options' : 'i'}}, projection)
-
-    data_to_return = []
+    ok, err = mongo_required()
+    if not ok:
+        return err
 
-    for group in matching_groups.skip(page_start).limit(page_size):
-        group['_id'] = str(group['_id'])
-        group['url'] = "http://localhost:5000/api/groups/" + group['_id']
+    return search_groups("name", group_name, f"No groups found with the name: {group_name}")
 
-        data_to_return.append(group)
 
-    if data_to_return:
-        return make_response (jsonify (data_to_return), 200)
-    else:
-        return make_response (jsonify ( {"error" : f"No groups found with the name: {group_name}"}), 404)
-    
-    
 ### --- SEARCH FOR GROUP (BY CATEGORY)--- ###
 ''' This will allow a user to search for a group by category
 
-    Users will have to pass the category in the <category> field
+    Users will have to pass the category in the <category> field, works the same as the search by name
 
     EXAMPLE URL: http://localhost:5000/api/search_for_groups/category/<category>
 '''
@@ -971,21 +1009,15 @@ def search_by_name(user_id, group_name):
 @jwt_required
 def search_by_category(user_id, category):
 
-    ## -- PAGINATION SETUP -- ##
-    page_num, page_size = 1, 10
-    if request.args.get('pn'):
-        page_num = int(request.args.get('pn'))
-    if request.args.get('ps'):
-        page_size = int(request.args.get('ps'))
-    page_start = (page_size * (page_num -1))
-    
-    # Regex check
-    '''        
-        In matching_recipes we find:
-            1) $regex - This is mongoDBs' operator for regular expression matching, it calls regex_pattern to get that.
-            2) $options : 'i' - This makes the match case sensitive, so chr, CHR, and Chr all match say "Christmas".        
-    '''
-    regex_pattern = category
+    ok, err = mongo_required()
+    if not ok:
+        return err
+
+    return search_groups("category", category, f"No groups found with the category: {category}")
+
+
+def search_groups(kind, text, notFoundMessage):
+    ''' Shared by both searches, returns the page of groups with the next cursor in the X-Next-Cursor header '''
 
     # Projection
     projection = {'group_name' : 1,
@@ -993,19 +1025,38 @@ def search_by_category(user_id, category):
                   'description' : 1,
                   'location' : 1,
                   'group_access' : 1}
-    
-    matching_groups = groups.find( { 'category' : { '$regex' : regex_pattern, '$options' : 'i'}}, projection)
 
-    data_to_return = []
+    try:
+        matching_groups, next_cursor = group_search.search(kind, text, pagination.page_limit(request.args),
+                                                           request.args.get("cursor"), projection)
+
+        data_to_return = []
 
-    for group in matching_groups.skip(page_start).limit(page_size):
-        group['_id'] = str(group['_id'])
-        group['url'] = "http://localhost:5000/api/groups/" + group['_id']
+        for group in matching_groups:
+            group['url'] = "http://localhost:5000/api/groups/" + str(group['_id'])
 
-        data_to_return.append(group)
+            data_to_return.append(group)
+
+        if data_to_return:
+            response = make_response (jsonify (data_to_return), 200)
+            if next_cursor:
+                response.headers["X-Next-Cursor"] = next_cursor
+            return response
+        else:
+            return make_response (jsonify ( {"error" : notFoundMessage}), 404)
 
-    if data_to_return:
-        return make_response (jsonify (data_to_return), 200)
-    else:
-        return make_response (jsonify ( {"error" : f"No groups found with the category: {category}"}), 404)
-    
\ No newline at end of file
+    except pagination.InvalidCursor:
+        return make_response(jsonify({"error" : invalidCursor}), 400)
+
+    except Exception as e:
+
+        # Add to logs
+        logsMessage = {
+            "Date/Time" : datetime.datetime.now(datetime.UTC),
+            "Action" : "Search Groups",
+            "Account" : g.current_username,
+            "Message" : searchGroupsFail
+        }
+        log_writer.enqueue(logsMessage)
+
+        return make_response(jsonify({"error": str(e)}), 503)
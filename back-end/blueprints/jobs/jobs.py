@@ -0,0 +1,45 @@
+from flask import Blueprint, jsonify, make_response
+from decorators import jwt_required
+from health import mongo_required
+import jobs
+
+### --- BLUEPRINT SETUP --- ###
+jobs_bp = Blueprint("jobs_bp", __name__)
+
+### --- GLOBAL VARIABLES --- ###
+jobNotFound = "Unable to find the job"
+
+
+### --- JOB STATUS --- ###
+''' This lets a user check on a background job they started (deleting their account or a group), see jobs.py
+
+    status is pending, running, done or failed, progress is how many documents each step has got through so far.
+    Only the user who started the job can see it, it still works after their account has been deleted as long as the token is valid
+
+    EXAMPLE URL: http://localhost:5000/api/jobs/<job_id>
+'''
+@jobs_bp.route("/api/jobs/<job_id>", methods=['GET'])
+@jwt_required
+def job_status(user_id, job_id):
+
+    ok, err = mongo_required()
+    if not ok:
+        return err
+
+    job = jobs.get(job_id)
+
+    if not job or str(job.get("owner")) != str(user_id):
+        return make_response(jsonify({"error": jobNotFound}), 404)
+
+    return make_response(jsonify({
+        "job_id" : str(job["_id"]),
+        "kind" : job.get("kind"),
+        "status" : job.get("status"),
+        "step" : job.get("step"),
+        "progress" : job.get("progress", {}),
+        "attempts" : job.get("attempts", 0),
+        "error" : job.get("error"),
+        "created_at" : job.get("created_at"),
+        "updated_at" : job.get("updated_at"),
+        "finished_at" : job.get("finished_at")
+    }), 200)
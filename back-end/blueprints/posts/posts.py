@@ -1,6 +1,8 @@
 from flask import Blueprint, request, jsonify, make_response, g
 import datetime, globals
 from decorators import jwt_required, admin_required
+from health import mongo_required
+import log_writer, pagination, indexes, identity_cache, timelines, etags, streaming, parallel
 from bson import ObjectId
 
 ### --- BLUEPRINT SETUP --- ###
@@ -9,10 +11,17 @@ posts_bp = Blueprint("posts_bp", __name__)
 ### --- COLLECTION DETAILS --- ###
 users = globals.db.users
 groups = globals.db.groups
-controlLogs = globals.db.logs 
 groupPosts = globals.db.posts
 postComments = globals.db.comments
 
+### --- INDEXES --- ###
+indexes.register("posts", [("group_id", 1), ("date_posted", -1), ("_id", -1)]) # home feed and group page
+indexes.register("posts", [("creator", 1)]) # deleting an account removes the users posts
+indexes.register_query("home feed", "posts",
+                       {"group_id": {"$in": ["group-1", "group-2"]}}, pagination.keyset_sort("date_posted"),
+                       seed=[{"group_id": "group-" + str(i % 5), "creator": "user-" + str(i % 7), "post_title": "Seed post",
+                              "date_posted": datetime.datetime(2025, 1, 1) + datetime.timedelta(minutes=i)} for i in range(50)])
+
 ### --- GLOBAL VARIABLES --- ###
 missingFormData = "Missing form data, please check that all the fields have been added successfully"
 unableToCreatePost = "Unable to create post"
@@ -22,26 +31,45 @@ postNotFound = "Can not find the post, please try again"
 userIsNotCreator = "Unable to do action, user is not a creator"
 canNotFindPost = "Unable to find the post"
 unableToDeletePost = "Unable to delete post"
+invalidCursor = "Invalid page cursor"
 
 postCreatedSuccessfully = "Successfully created the post"
 postEditedSuccessfully = "Successfully edited the post"
 successfullyDeletedPost = "Post deleted successfully"
 
-### --- CONNECTION TEST --- ###
-def mongo_required():
-    try:
-        globals.client.admin.command("ping")
-        return True, None
-    except Exception as e:
-        return False, (jsonify({"error": str(e)}), 503)
+### --- CREATOR AND GROUP NAMES --- ###
+''' Adds creator_username and group_name to each post.
+
+    The names come from identity_cache, anything not cached is looked up with one $in query per collection,
+    so a feed costs at most two extra queries no matter how many posts are in it (and they run at the same time)
+'''
+def add_creator_and_group_names(posts):
+    usernames, groupNames = parallel.gather(
+        lambda: identity_cache.usernames.get_many([post.get("creator") for post in posts]),
+        lambda: identity_cache.groupNames.get_many([post.get("group_id") for post in posts])
+    )
+
+    for post in posts:
+        post["creator_username"] = usernames.get(str(post.get("creator"))) or "Unknown User"
+        post["group_name"] = groupNames.get(str(post.get("group_id"))) or "Deleted Group"
+
+    return posts
 
 ### --- USER HOME PAGE (VIEW ALL POSTS THAT USER IS A PART OF) --- ###
 ''' This endpoint will pratically act as the users home page, showing all posts from the groups they are in reverse chronological order
 
+    The feed is paginated with a cursor (see pagination.py), sorted on date_posted then _id:
+        1) ?limit= is how many posts to return (default 20, max 100)
+        2) next_cursor is returned with the feed, send it back as ?cursor= to get the next page (None means no more posts)
+
+    The response has an ETag built from the versions of the users groups (see etags.py), a poll with nothing new gets a 304
+
+    With ?stream=1 the feed is sent as it is read from mongoDB instead of all at once (see streaming.py).
+    Timeline mode already reads a page at a time, so it ignores ?stream=
+
     EXAMPLE URL: http://localhost:5000/api/home
+    EXAMPLE URL: http://localhost:5000/api/home?limit=20&cursor=<next_cursor>
 '''
-
-# TODO - PAGINATION NEEDS ADDED
 @posts_bp.route("/api/home")
 @jwt_required
 def user_home_page(user_id):
@@ -51,43 +79,43 @@ def user_home_page(user_id):
         return err
     
     try:
-        # Get the user details
-        userDetails = users.find_one({"_id" : ObjectId(user_id)}, {"memberOf" : 1, "ownerOf" : 1, "username" : 1})
-
-        userGroups = userDetails.get("memberOf", []) # What the member is in
-        ownerGroups = userDetails.get("ownerOf", []) # What the user owns
-        
-
-        allGroups = list(set(userGroups + ownerGroups))
-
-        # Find the post and sort them in reverse chronological order
-        feedCursor = groupPosts.find(
-            {"group_id" : {"$in" : allGroups}}
-        ).sort("date_posted", -1)
-
-        # Convert the cursor to a list, and format IDs for JSON
-        feedPosts = []
-        for post in feedCursor:
-            post["_id"] = str(post["_id"])
-
-            # Get creators username
-            creator_details = users.find_one({"_id": ObjectId(post["creator"])}, {"username": 1})
-            post["creator_username"] = creator_details["username"] if creator_details else "Unknown User"
+        # What the member is in and what the user owns (not the groups being deleted)
+        allGroups = g.principal.groups()
+
+        # Nothing has changed since the last poll
+        etag = etags.make(user_id, etags.group_versions(allGroups))
+        notModified = etags.not_modified(etag)
+        if notModified:
+            return notModified
+
+        # Pagination, timeline mode doesn't stream so it keeps the normal maximum
+        limit = pagination.page_limit(request.args) if timelines.enabled() else streaming.page_limit(request.args)
+        try:
+            afterCursor = pagination.keyset_filter("date_posted", request.args.get("cursor"))
+        except pagination.InvalidCursor:
+            return make_response(jsonify({"error": invalidCursor}), 400)
+
+        if timelines.enabled():
+            # Read from the users own timeline (see timelines.py)
+            feedPosts, nextCursor = timelines.read_feed(user_id, allGroups, limit, request.args.get("cursor"))
 
+        else:
+            # Find the posts and sort them in reverse chronological order, one extra to see if there is another page
+            feedCursor = groupPosts.find(
+                {"group_id" : {"$in" : allGroups}, **afterCursor}
+            ).sort(pagination.keyset_sort("date_posted")).limit(limit + 1)
 
-            # Get group name
-            group_details = groups.find_one({"_id": ObjectId(post["group_id"])}, {"group_name": 1})
-            post["group_name"] = group_details["group_name"] if group_details else "Deleted Group"
+            if streaming.requested(request.args):
+                page = streaming.FeedPage(feedCursor, "date_posted", limit, add_creator_and_group_names)
+                return etags.tag(streaming.object_response({}, "feed", page, lambda: {"next_cursor" : page.next_cursor}), etag)
 
-            # Convert dates to strings
-            if "date_posted" in post:
-                post["date_posted"] = post["date_posted"].isoformat()
-            if "event_date" in post and post["event_date"]:
-                post["event_date"] = post["event_date"].isoformat()
+            feedPosts, nextCursor = pagination.next_page(list(feedCursor), "date_posted", limit)
 
-            feedPosts.append(post)
+        # Get the creator usernames and group names for the whole feed at once
+        add_creator_and_group_names(feedPosts)
 
-        return make_response(jsonify({"feed" : feedPosts}), 200)
+        # IDs and dates are converted by the JSON provider (json_provider.py)
+        return etags.tag(make_response(jsonify({"feed" : feedPosts, "next_cursor" : nextCursor}), 200), etag)
 
     except Exception as e:
         # Add to logs
@@ -97,7 +125,7 @@ def user_home_page(user_id):
             "Account" : g.current_username,
             "Message" : str(e)
         }
-        result = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error": str(e)}), 503)
 
@@ -112,16 +140,6 @@ def create_post(user_id):
     
     try:
 
-        # Find the user and see what groups 
-        userDetails = users.find_one(
-            {'_id':ObjectId(user_id)}, # Filter (what to find)
-            {'memberOf' : 1, 'ownerOf' : 1, "_id" : 0} # Projection (what to return)    
-        )
-
-        userGroups = userDetails.get('memberOf', [])
-        ownerGroups = userDetails.get('ownerOf', [])
-
-
         # Grab the form data
         groupId = request.form.get("group_id")
         postTitle = request.form.get("post_title")
@@ -133,7 +151,7 @@ def create_post(user_id):
 
 
         # Check if the user is in the group
-        if groupId not in userGroups and groupId not in ownerGroups:
+        if not g.principal.member_now(groupId):
 
             # Add to logs
             logsMessage = {
@@ -142,7 +160,7 @@ def create_post(user_id):
                 "Account" : g.current_username,
                 "Message" : userNotInGroup
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             return make_response(jsonify({"error": userNotInGroup}), 404)
 
@@ -157,7 +175,7 @@ def create_post(user_id):
                 "Account" : g.current_username,
                 "Message" : missingFormData
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             return make_response(jsonify({"error": "A group must be selected"}), 404)
         
@@ -171,7 +189,7 @@ def create_post(user_id):
                     "Account" : g.current_username,
                     "Message" : missingFormData
                 }
-                controlLogs.insert_one(logsMessage)
+                log_writer.enqueue(logsMessage)
 
                 return make_response(jsonify({"error": "Event date must be provided"}), 404)
             
@@ -186,7 +204,7 @@ def create_post(user_id):
                     "Account" : g.current_username,
                     "Message" : invalidDateFormat
                 }
-                controlLogs.insert_one(logsMessage)
+                log_writer.enqueue(logsMessage)
 
                 return make_response(jsonify({"error" : invalidDateFormat}), 400)
             
@@ -200,11 +218,16 @@ def create_post(user_id):
             "event_date" : formattedEventDate,
             "post_message" : postMessage,
             "creator" : user_id,
-            "date_posted" : datetime.datetime.now(datetime.UTC)
+            "date_posted" : datetime.datetime.now(datetime.UTC),
+            "comment_count" : 0
         }
 
         postResult = groupPosts.insert_one(finalPost)
 
+        # Add the post to the members timelines (does nothing unless timeline mode is on)
+        timelines.fan_out(finalPost)
+        etags.bump_groups(groupId)
+
         # Add to logs
         logsMessage = {
             "Date/Time" : datetime.datetime.now(datetime.UTC),
@@ -212,7 +235,7 @@ def create_post(user_id):
             "Account" : g.current_username,
             "Message" : postCreatedSuccessfully
         }
-        postLogResult = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
 
         return make_response(jsonify({"success": "Post has been uploaded successfully"}), 201)
@@ -226,13 +249,17 @@ def create_post(user_id):
             "Account" : g.current_username,
             "Message" : unableToCreatePost
         }
-        result = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error": str(e)}), 503)
 
 ### --- VIEW ONE POST --- ###
 ''' This endpoint will allow a user to view one post, that's really it
 
+    The comments are paginated with a cursor, newest first, like /api/home (?limit= and ?cursor=, comments_next_cursor is the next page)
+    comment_count is the total number of comments, kept on the post by the comments blueprint
+
+    The user, the post and the page of comments don't depend on each other, so they are read at the same time (see parallel.py)
 
     EXAMPLE URL: http://localhost:5000/api/groups/<group_id>/<post_id>
 '''
@@ -244,51 +271,41 @@ def view_one_post(user_id, group_id, post_id):
         return err
     
     try:
-        # Get user details
-        userDetails = users.find_one({"_id" : ObjectId(user_id)}, {"memberOf" : 1, "ownerOf" : 1})
-
-        userGroups = userDetails.get("memberOf", [])
-        ownerGroups = userDetails.get("ownerOf", [])
+        # Comment pagination
+        limit = pagination.page_limit(request.args)
+        try:
+            afterCursor = pagination.keyset_filter("date_posted", request.args.get("cursor"))
+        except pagination.InvalidCursor:
+            return make_response(jsonify({"error": invalidCursor}), 400)
+
+        # Get the users groups, the post and one page of comments (one extra to see if there is another page) together
+        principal = g.principal
+        userGroups, post, comments_list = parallel.gather(
+            principal.groups,
+            lambda: groupPosts.find_one({"_id" : ObjectId(post_id)}),
+            lambda: list(postComments.find(
+                {"post_id" : post_id, **afterCursor}
+            ).sort(pagination.keyset_sort("date_posted")).limit(limit + 1))
+        )
 
-        if group_id not in userGroups and group_id not in ownerGroups:
+        if group_id not in userGroups:
             return make_response(jsonify({"error": userNotInGroup}), 403)
-        
-        # Find post
-        post = groupPosts.find_one({
-            "_id" : ObjectId(post_id)
-        })
 
         if not post:
             return make_response(jsonify({"error": postNotFound}), 404)
         
-        # Get the creator name
-        creator_id = post.get("creator")
-        creator_details = users.find_one({"_id": ObjectId(post["creator"])}, {"username": 1})
-        post["creator_username"] = creator_details["username"] if creator_details else "Unknown User"
-
-        # Get group details
-        group_details = groups.find_one({"_id": ObjectId(post["group_id"])}, {"group_name": 1})
-        post["group_name"] = group_details["group_name"] if group_details else "Deleted Group"
-
-        # Get comments
-        comments_cursor = postComments.find({"post_id" : post_id}).sort("date_posted", -1)
-
-        comments_list = []
-        for comment in comments_cursor:
-            comment["_id"] = str(comment["_id"])
-            if "date_posted" in comment:
-                comment["date_posted"] = comment["date_posted"].isoformat()
-            comments_list.append(comment)
-
-            post["comments"] = comments_list
-        
-        # Format for JSON
-        post["_id"] = str(post["_id"])
-        
-        if "date_posted" in post:
-            post["date_posted"] = post["date_posted"].isoformat()
-        if "event_date" in post and post["event_date"]:
-            post["event_date"] = post["event_date"].isoformat()
+        # Get the creator name and group name
+        add_creator_and_group_names([post])
+
+        comments_list, commentsNextCursor = pagination.next_page(comments_list, "date_posted", limit)
+
+        post["comments"] = comments_list
+        post["comments_next_cursor"] = commentsNextCursor
+
+        # Posts from before comment_count was added get counted once
+        if "comment_count" not in post:
+            post["comment_count"] = postComments.count_documents({"post_id" : post_id})
+            groupPosts.update_one({"_id" : post["_id"], "comment_count" : {"$exists" : False}}, {"$set" : {"comment_count" : post["comment_count"]}})
 
         return make_response(jsonify(post), 200)
             
@@ -301,7 +318,7 @@ def view_one_post(user_id, group_id, post_id):
             "Account" : g.current_username,
             "Message" : str(e)
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error": str(e)}), 503)
 
@@ -318,11 +335,6 @@ def edit_post(user_id, group_id, post_id):
         return err
     
     try:
-        userDetails = users.find_one({"_id" : ObjectId(user_id)}, {"memberOf" : 1, "ownerOf" : 1})
-
-        userGroups = userDetails.get("memberOf", [])
-        ownerGroups = userDetails.get("ownerOf", [])
-        
         # Find post
         post = groupPosts.find_one({
             "_id" : ObjectId(post_id),
@@ -336,7 +348,7 @@ def edit_post(user_id, group_id, post_id):
                 "Account" : g.current_username,
                 "Message" : canNotFindPost
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             return make_response(jsonify({"error": postNotFound}), 404)
 
@@ -344,7 +356,7 @@ def edit_post(user_id, group_id, post_id):
 
 
          # Check if the user is in the group
-        if group_id not in userGroups and group_id not in ownerGroups:
+        if not g.principal.member_now(group_id):
 
             # Add to logs
             logsMessage = {
@@ -353,7 +365,7 @@ def edit_post(user_id, group_id, post_id):
                 "Account" : g.current_username,
                 "Message" : userNotInGroup
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             return make_response(jsonify({"error": "User is not a part of this group"}), 404)
 
@@ -368,7 +380,7 @@ def edit_post(user_id, group_id, post_id):
                 "Account" : g.current_username,
                 "Message" : userIsNotCreator
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
             
             return make_response(jsonify({"error": userIsNotCreator}), 403)
         
@@ -391,7 +403,7 @@ def edit_post(user_id, group_id, post_id):
                     "Account" : g.current_username,
                     "Message" : missingFormData
                 }
-                controlLogs.insert_one(logsMessage)
+                log_writer.enqueue(logsMessage)
 
                 return make_response(jsonify({"error": "Event date must be provided"}), 404)
             
@@ -406,7 +418,7 @@ def edit_post(user_id, group_id, post_id):
                     "Account" : g.current_username,
                     "Message" : invalidDateFormat
                 }
-                controlLogs.insert_one(logsMessage)
+                log_writer.enqueue(logsMessage)
 
                 return make_response(jsonify({"error" : invalidDateFormat}))
             
@@ -421,6 +433,7 @@ def edit_post(user_id, group_id, post_id):
             "event_date" : formattedEventDate,
             "post_message" : postMessage,
           }})
+        etags.bump_post(post_id)
 
         # Add to logs
         logsMessage = {
@@ -429,7 +442,7 @@ def edit_post(user_id, group_id, post_id):
             "Account" : g.current_username,
             "Message" : postEditedSuccessfully
         }
-        postLogResult = controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
 
         return make_response(jsonify({"success": "Post has been updated successfully"}), 201)
@@ -444,7 +457,7 @@ def edit_post(user_id, group_id, post_id):
             "Account" : g.current_username,
             "Message" : str(e)
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error": str(e)}), 503) 
 
@@ -462,11 +475,6 @@ def delete_post(user_id, group_id, post_id):
     
 
     try:
-        userDetails = users.find_one({"_id" : ObjectId(user_id)}, {"memberOf" : 1, "ownerOf" : 1})
-
-        userGroups = userDetails.get("memberOf", [])
-        ownerGroups = userDetails.get("ownerOf", [])
-        
         # Find post
         post = groupPosts.find_one({
             "_id" : ObjectId(post_id),
@@ -480,7 +488,7 @@ def delete_post(user_id, group_id, post_id):
                 "Account" : g.current_username,
                 "Message" : canNotFindPost
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             return make_response(jsonify({"error": postNotFound}), 404)
 
@@ -488,7 +496,7 @@ def delete_post(user_id, group_id, post_id):
 
 
          # Check if the user is in the group
-        if group_id not in userGroups and group_id not in ownerGroups:
+        if not g.principal.member_now(group_id):
 
             # Add to logs
             logsMessage = {
@@ -497,7 +505,7 @@ def delete_post(user_id, group_id, post_id):
                 "Account" : g.current_username,
                 "Message" : userNotInGroup
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             return make_response(jsonify({"error": "User is not a part of this group"}), 404)
 
@@ -512,12 +520,14 @@ def delete_post(user_id, group_id, post_id):
                 "Account" : g.current_username,
                 "Message" : userIsNotCreator
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
             
             return make_response(jsonify({"error": userIsNotCreator}), 403)
         
         # Delete the post
         result = groupPosts.delete_one({"_id" : ObjectId(post_id)})
+        timelines.remove_post(post_id)
+        etags.bump_groups(group_id)
         
         if result.deleted_count == 1:
 
@@ -528,7 +538,7 @@ def delete_post(user_id, group_id, post_id):
                 "Account" : g.current_username,
                 "Message" : successfullyDeletedPost
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
             return make_response( jsonify( { } ), 204 )
         
@@ -541,7 +551,7 @@ def delete_post(user_id, group_id, post_id):
                 "Account" : g.current_username,
                 "Message" : unableToDeletePost
             }
-            controlLogs.insert_one(logsMessage)
+            log_writer.enqueue(logsMessage)
 
 
             return make_response( jsonify( { "error" : "Invalid business ID" } ), 404)
@@ -555,6 +565,6 @@ def delete_post(user_id, group_id, post_id):
             "Account" : g.current_username,
             "Message" : str(e)
         }
-        controlLogs.insert_one(logsMessage)
+        log_writer.enqueue(logsMessage)
 
         return make_response(jsonify({"error": str(e)}), 503)
\ No newline at end of file
@@ -0,0 +1,163 @@
+''' These are the background jobs that clean up after a delete (see jobs.py for how they are run)
+
+    delete_group
+        The endpoint creates the job, then tombstones the group (see tombstones.py) so it disappears straight away, and leaves the rest here:
+            0) the tombstone again, in case the endpoint didn't get that far
+            1) its members memberships (memberOf, and the memberships collection)
+            2) its posts, with the comments under them, the RSVPs to them in users my_events and their timeline entries
+            3) the group document itself, which also ends the tombstone
+
+    delete_account
+        The endpoint creates the job, then deletes the user document straight away (so they can't log in and the username is free)
+        and tombstones the groups they owned, and leaves the rest here:
+            0) the user document and the tombstones again, in case the endpoint didn't get that far
+            1) their comments, taking them off each posts comment_count
+            2) the posts in the groups they owned, and their own posts in other groups
+               (with the comments under those posts and the RSVPs to them in other users my_events)
+            3) other users memberships of the groups they owned (their own memberships go with the user document)
+            4) their requests to join other groups, and their RSVPs on other users events
+            5) the groups they owned (tombstoned by the endpoint, same steps as delete_group), and their timeline
+
+    Every step works in batches, with bulk_write, until nothing matching is left, so a crashed job carries on where it was.
+    The job is always saved before anything is deleted, so a request that dies half way never leaves a tombstone with no job to finish it
+'''
+
+### --- IMPORTS --- ###
+from pymongo import DeleteMany, DeleteOne, UpdateMany, UpdateOne
+from bson import ObjectId
+from collections import Counter
+import globals, indexes, jobs, identity_cache, timelines, etags, group_suggest, principal, tombstones, memberships
+
+### --- INDEXES --- ###
+indexes.register("users", [("my_events", 1)]) # RSVPs to a deleted post
+indexes.register("posts", [("attendees", 1)]) # a deleted users RSVPs
+indexes.register("groups", [("requests", 1)]) # a deleted users requests to join
+
+
+### --- SHARED STEPS --- ###
+def delete_posts(job, filter):
+    ''' Deletes the posts matching filter a batch at a time, with their comments, RSVPs and timeline entries '''
+    for batch in job.batches("posts", filter):
+        postIds = [post["_id"] for post in batch]
+        postIdStrings = [str(post_id) for post_id in postIds]
+
+        globals.db.comments.bulk_write([DeleteMany({"post_id": {"$in": postIdStrings}})])
+        globals.db.users.bulk_write([UpdateMany({"my_events": {"$in": postIdStrings}}, {"$pull": {"my_events": {"$in": postIdStrings}}})])
+        timelines.remove_posts(postIdStrings)
+        globals.db.posts.bulk_write([DeleteOne({"_id": post_id}) for post_id in postIds], ordered=False)
+
+def remove_members(job, group_ids):
+    ''' Takes the groups out of every members memberOf, then deletes the groups memberships (see memberships.py) '''
+    for batch in job.batches("users", {"memberOf": {"$in": group_ids}}):
+        globals.db.users.bulk_write([UpdateOne({"_id": user["_id"]}, {"$pull": {"memberOf": {"$in": group_ids}}}) for user in batch],
+                                    ordered=False)
+        principal.invalidate(*[user["_id"] for user in batch])
+    memberships.remove_groups(*group_ids)
+
+def remove_groups(job, group_ids):
+    ''' Deletes the group documents (once their members and posts have gone) and forgets them everywhere they are cached '''
+    if group_ids:
+        globals.db.groups.delete_many({"_id": {"$in": [ObjectId(group_id) for group_id in group_ids]}})
+
+    identity_cache.groupNames.invalidate(*group_ids)
+    for group_id in group_ids:
+        group_suggest.remove_group(group_id)
+        timelines.remove_group(group_id)
+    job.checkpoint(len(group_ids))
+
+
+### --- DELETE GROUP --- ###
+def unlist_group(group_id):
+    ''' Tombstones the group and takes it out of its owners ownerOf '''
+    tombstones.tombstone(group_id)
+
+    owner = globals.db.users.find_one_and_update({"ownerOf": group_id}, {"$pull": {"ownerOf": group_id}}, {"_id": 1})
+    if owner:
+        principal.invalidate(str(owner["_id"]))
+
+    identity_cache.groupNames.invalidate(group_id)
+    group_suggest.remove_group(group_id)
+
+def _group_tombstone(job, group_id):
+    unlist_group(group_id)
+
+def _group_members(job, group_id):
+    remove_members(job, [group_id])
+
+def _group_posts(job, group_id):
+    delete_posts(job, {"group_id": group_id})
+
+def _group_document(job, group_id):
+    remove_groups(job, [group_id])
+
+jobs.register("delete_group", [
+    ("tombstone", _group_tombstone),
+    ("members", _group_members),
+    ("posts", _group_posts),
+    ("group", _group_document)
+])
+
+
+### --- DELETE ACCOUNT --- ###
+def delete_user(user_id, owned_group_ids):
+    ''' Deletes the user document and tombstones the groups they owned, returns False if the user had already gone '''
+    result = globals.db.users.delete_one({"_id": ObjectId(user_id)})
+    memberships.remove_user(user_id)
+    identity_cache.usernames.invalidate(user_id)
+    principal.invalidate(user_id)
+
+    # Their groups disappear now, the job deletes them the same way as delete_group
+    tombstones.tombstone(*owned_group_ids)
+    identity_cache.groupNames.invalidate(*owned_group_ids)
+    for group_id in owned_group_ids:
+        group_suggest.remove_group(group_id)
+    return result.deleted_count == 1
+
+def _account_document(job, user_id, owned_group_ids, member_of):
+    delete_user(user_id, owned_group_ids)
+
+def _account_comments(job, user_id, owned_group_ids, member_of):
+    for batch in job.batches("comments", {"user_id": user_id}, {"post_id": 1}):
+        globals.db.comments.bulk_write([DeleteOne({"_id": comment["_id"]}) for comment in batch], ordered=False)
+
+        perPost = Counter(comment.get("post_id") for comment in batch)
+        updates = [UpdateOne({"_id": ObjectId(post_id), "comment_count": {"$exists": True}}, {"$inc": {"comment_count": -count}})
+                   for post_id, count in perPost.items() if ObjectId.is_valid(str(post_id))]
+        if updates:
+            globals.db.posts.bulk_write(updates, ordered=False)
+
+def _account_owned_group_posts(job, user_id, owned_group_ids, member_of):
+    if owned_group_ids:
+        delete_posts(job, {"group_id": {"$in": owned_group_ids}})
+
+def _account_posts(job, user_id, owned_group_ids, member_of):
+    delete_posts(job, {"creator": user_id})
+
+def _account_members(job, user_id, owned_group_ids, member_of):
+    if owned_group_ids:
+        remove_members(job, owned_group_ids)
+
+def _account_references(job, user_id, owned_group_ids, member_of):
+    for batch in job.batches("groups", {"requests": user_id}):
+        globals.db.groups.bulk_write([UpdateOne({"_id": group["_id"]}, {"$pull": {"requests": user_id}}) for group in batch], ordered=False)
+
+    for batch in job.batches("posts", {"attendees": user_id}):
+        globals.db.posts.bulk_write([UpdateOne({"_id": post["_id"]}, {"$pull": {"attendees": user_id}}) for post in batch], ordered=False)
+
+def _account_groups(job, user_id, owned_group_ids, member_of):
+    remove_groups(job, owned_group_ids)
+    identity_cache.usernames.invalidate(user_id)
+    timelines.remove_user(user_id)
+
+    # The groups they were in lost posts and comments
+    etags.bump_groups(*member_of)
+
+jobs.register("delete_account", [
+    ("account", _account_document),
+    ("comments", _account_comments),
+    ("owned group posts", _account_owned_group_posts),
+    ("posts", _account_posts),
+    ("members", _account_members),
+    ("references", _account_references),
+    ("groups", _account_groups)
+])
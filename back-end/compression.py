@@ -0,0 +1,134 @@
+''' This is the response compression, every JSON response goes through it on the way out
+
+    The feeds, group page and search results repeat the same keys (post_title, event_button, creator_username...) in every
+    document, so they compress very well:
+        1) The encoding is picked from the Accept-Encoding header, brotli if the client takes it (and the brotli package is
+           installed), otherwise gzip, otherwise the response is left alone
+        2) Responses smaller than ALCHEMAX_COMPRESSION_MIN_BYTES aren't worth it and are sent as they are
+        3) Streamed responses (see streaming.py) are compressed chunk by chunk, each chunk is flushed so it still goes out straight away
+        4) Responses with an ETag (see etags.py) keep their compressed body in a small cache, keyed on the ETag and encoding,
+           so the same 200 isn't compressed again for the next client
+
+    A compressed response's ETag is made weak (W/"..."), as the bytes are no longer the ones the ETag was made for.
+    If-None-Match uses the weak comparison, so a 304 still works
+'''
+
+### --- IMPORTS --- ###
+from collections import OrderedDict
+from flask import request
+import gzip, os, threading, zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None # optional, pip install brotli
+
+### --- SETTINGS --- ###
+minimumSize = int(os.environ.get("ALCHEMAX_COMPRESSION_MIN_BYTES", 1024))
+gzipLevel = int(os.environ.get("ALCHEMAX_COMPRESSION_GZIP_LEVEL", 6))
+brotliQuality = int(os.environ.get("ALCHEMAX_COMPRESSION_BROTLI_QUALITY", 5)) # 11 is far too slow for dynamic responses
+cacheSize = int(os.environ.get("ALCHEMAX_COMPRESSION_CACHE_SIZE", 256)) # compressed bodies kept
+compressibleTypes = ("application/json", "text/")
+
+### --- CACHE --- ###
+_cache = OrderedDict() # (etag, encoding) -> compressed body
+_lock = threading.Lock()
+
+
+def _cached(key):
+    with _lock:
+        body = _cache.get(key)
+        if body is not None:
+            _cache.move_to_end(key)
+        return body
+
+def _store(key, body):
+    with _lock:
+        _cache[key] = body
+        _cache.move_to_end(key)
+        while len(_cache) > cacheSize:
+            _cache.popitem(last=False)
+
+
+### --- ENCODING --- ###
+def _choose_encoding():
+    ''' The encoding to use for this request, or None '''
+    accepted = request.accept_encodings
+    brQuality = accepted["br"] if brotli is not None else 0
+    gzipQuality = accepted["gzip"]
+
+    if brQuality and brQuality >= gzipQuality:
+        return "br"
+    if gzipQuality:
+        return "gzip"
+    return None
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=brotliQuality)
+    return gzip.compress(body, compresslevel=gzipLevel, mtime=0)
+
+def _compress_stream(chunks, encoding):
+    ''' Compresses a streamed response as it goes, flushing after every chunk '''
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=brotliQuality)
+        for chunk in chunks:
+            data = compressor.process(chunk.encode("UTF-8") if isinstance(chunk, str) else chunk) + compressor.flush()
+            if data:
+                yield data
+        yield compressor.finish()
+
+    else:
+        compressor = zlib.compressobj(gzipLevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS) # 16 + for the gzip header
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode("UTF-8") if isinstance(chunk, str) else chunk) + compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+        yield compressor.flush()
+
+
+### --- AFTER REQUEST --- ###
+def compress_response(response):
+    if request.method == "HEAD" or response.status_code < 200 or response.status_code in (204, 206, 304):
+        return response
+    if response.direct_passthrough or "Content-Encoding" in response.headers:
+        return response
+    if not (response.mimetype or "").startswith(compressibleTypes):
+        return response
+
+    response.vary.add("Accept-Encoding")
+    encoding = _choose_encoding()
+    if encoding is None:
+        return response
+
+    etag, weak = response.get_etag()
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.headers.pop("Content-Length", None)
+
+    else:
+        body = response.get_data()
+        if len(body) < minimumSize:
+            return response
+
+        key = (etag, encoding) if etag else None
+        compressed = _cached(key) if key else None
+        if compressed is None:
+            compressed = compress(body, encoding)
+            if key:
+                _store(key, compressed)
+
+        response.set_data(compressed)
+
+    response.headers["Content-Encoding"] = encoding
+    if etag and not weak:
+        response.set_etag(etag, weak=True)
+    return response
+
+def init_app(app):
+    app.after_request(compress_response)
+
+def stats():
+    with _lock:
+        return {"cached_bodies": len(_cache), "brotli": brotli is not None}
@@ -4,9 +4,61 @@
 from flask import request, jsonify, make_response, g
 import jwt
 from functools import wraps
-import globals
+from collections import OrderedDict
+import datetime, os, threading
+import globals, revocation, principal
 
-blacklist = globals.db.blacklist 
+### --- VERIFIED CLAIMS CACHE --- ###
+'''
+    Decoding the token on every request is wasted work, the same token gets sent over and over until it expires.
+
+    This keeps the claims of tokens we have already verified, keyed by the token fingerprint (sha256), in a small LRU.
+    An entry is thrown away once the tokens exp passes, so an expired token still gets rejected by jwt.decode
+'''
+claimsCacheSize = int(os.environ.get("ALCHEMAX_CLAIMS_CACHE_SIZE", 4096))
+
+_claimsCache = OrderedDict() # fingerprint -> claims
+_claimsLock = threading.Lock()
+
+def _cached_claims(tokenFingerprint):
+    with _claimsLock:
+        claims = _claimsCache.get(tokenFingerprint)
+        if claims is None:
+            return None
+
+        # Evict once the token has expired
+        if claims.get("exp", 0) <= datetime.datetime.now(datetime.UTC).timestamp():
+            del _claimsCache[tokenFingerprint]
+            return None
+
+        _claimsCache.move_to_end(tokenFingerprint)
+        return claims
+
+def _store_claims(tokenFingerprint, claims):
+    with _claimsLock:
+        _claimsCache[tokenFingerprint] = claims
+        _claimsCache.move_to_end(tokenFingerprint)
+        while len(_claimsCache) > claimsCacheSize:
+            _claimsCache.popitem(last=False)
+
+def verify_token(token):
+    ''' Returns the verified claims for the token, raises jwt.InvalidTokenError if it isn't valid.
+
+        The claims are put on g (g.token_claims) so any other decorator on the same request can reuse them
+    '''
+    if getattr(g, "token_claims", None) is not None and g.get("token") == token:
+        return g.token_claims
+
+    tokenFingerprint = revocation.fingerprint(token)
+    claims = _cached_claims(tokenFingerprint)
+
+    if claims is None:
+        claims = jwt.decode(token, globals.secret_key, algorithms="HS256")
+        _store_claims(tokenFingerprint, claims)
+
+    g.token = token
+    g.token_claims = claims
+    return claims
 
 ### --- JWT REQUIRED DECORATOR --- ###
 def jwt_required(func):
@@ -20,13 +72,12 @@ def jwt_required(func):
         if 'x-access-token' in request.headers:
             token = request.headers['x-access-token']
 
-        if blacklist.find_one({"token": token}):
+        # Checked against this workers copy of the blacklist, no database call needed
+        if token and revocation.is_revoked(token):
             return make_response(jsonify({'message': 'Token has been revoked. Please log in again.'}), 401)
         
         try:
-            data = jwt.decode(token,
-                              globals.secret_key,
-                              algorithms="HS256")
+            data = verify_token(token)
             
             # grab username for log reasons (possibly more who knows, early development, watch me forget to remove this)
             g.current_username = data['user']
@@ -41,6 +92,9 @@ def jwt_required(func):
             return make_response(jsonify({"message" : "Token missing user ID"}), 401)
         kwargs["user_id"] = user_id_str
 
+        # The current user, their memberships are only loaded if the endpoint asks (see principal.py)
+        g.principal = principal.Principal(user_id_str, g.current_username)
+
         return func(*args, **kwargs)
     
     return jwt_required_wrapper
@@ -49,9 +103,21 @@ def jwt_required(func):
 def admin_required(func):
     @wraps(func)
     def admin_required_wrapper(*args, **kwargs):
-        token = request.headers['x-access-token']
-        data = jwt.decode( token, globals.secret_key, algorithms="HS256")
-        if data["admin"]:
+        token = request.headers.get('x-access-token')
+
+        if not token:
+            return make_response(jsonify({'message' : 'Token is missing'}), 401)
+
+        if revocation.is_revoked(token):
+            return make_response(jsonify({'message': 'Token has been revoked. Please log in again.'}), 401)
+
+        # Reuses the claims jwt_required already verified if it ran first
+        try:
+            data = verify_token(token)
+        except:
+            return make_response(jsonify({'message' : 'Token is invalid'}), 401)
+
+        if data.get("admin"):
             return func(*args, **kwargs)
         else:
             return make_response(jsonify ( { 'message' : 'Admin access required'}), 401)
@@ -0,0 +1,72 @@
+''' This is used for conditional GETs (ETags) on the endpoints the front end polls: /api/home, /api/groups/<id>,
+    /api/get_user_groups and /api/my_calendar
+
+    Rebuilding those responses means running the feed queries and name lookups again, even when nothing has changed. Instead:
+        1) Groups and posts have a version counter, bumped by every write that changes what those endpoints return
+           (posts, comments, RSVPs, edits, members joining or leaving)
+        2) An endpoint first reads only the versions it depends on (one small indexed query) and hashes them into an ETag
+        3) If the client sent that ETag back in If-None-Match the answer is a 304 with no body, before any of the expensive queries
+        4) Otherwise the response is built as normal and sent with the ETag, the browser sends it back on the next poll by itself
+
+    Documents from before this was added have no version, they count as 0 until their first bump
+'''
+
+### --- IMPORTS --- ###
+from flask import request, make_response
+from bson import ObjectId
+import hashlib, json
+import globals
+
+
+### --- BUMPING --- ###
+def bump_groups(*group_ids):
+    ''' Called after a write that changes what a group shows (its feed, details or members) '''
+    objectIds = [ObjectId(gid) for gid in group_ids if gid and ObjectId.is_valid(str(gid))]
+    if objectIds:
+        globals.db.groups.update_many({"_id": {"$in": objectIds}}, {"$inc": {"version": 1}})
+
+def bump_post(post_id):
+    ''' Called after a write to a post (edit, comment, RSVP), the post and the group it is in both change '''
+    if not ObjectId.is_valid(str(post_id)):
+        return
+    post = globals.db.posts.find_one_and_update({"_id": ObjectId(post_id)}, {"$inc": {"version": 1}}, {"group_id": 1})
+    if post:
+        bump_groups(post.get("group_id"))
+
+
+### --- VERSIONS --- ###
+def _versions(collection, ids):
+    ''' [(id, version)] for the ids that exist, sorted so the order they were given in doesn't matter '''
+    objectIds = [ObjectId(i) for i in ids if i and ObjectId.is_valid(str(i))]
+    if not objectIds:
+        return []
+    found = globals.db[collection].find({"_id": {"$in": objectIds}}, {"version": 1, "group_id": 1})
+    return sorted((str(doc["_id"]), doc.get("version", 0), doc.get("group_id")) for doc in found)
+
+def group_versions(group_ids):
+    return [(gid, version) for gid, version, _ in _versions("groups", group_ids)]
+
+def post_versions(post_ids):
+    ''' The posts versions, and the versions of the groups they are in (for the group names) '''
+    posts = _versions("posts", post_ids)
+    return [(pid, version) for pid, version, _ in posts] + group_versions({gid for _, _, gid in posts})
+
+
+### --- ETAGS --- ###
+def make(*parts):
+    ''' A strong ETag from anything the response depends on, the query string is always included (pages, limits) '''
+    payload = json.dumps([request.path, sorted(request.args.items(multi=True)), parts], default=str, separators=(",", ":"))
+    return hashlib.sha1(payload.encode("UTF-8")).hexdigest()
+
+def not_modified(etag):
+    ''' The 304 to return if the client already has this version, otherwise None '''
+    # Weak comparison, compression.py makes the ETag of a compressed response weak
+    if request.if_none_match.contains_weak(etag):
+        return tag(make_response("", 304), etag)
+    return None
+
+def tag(response, etag):
+    ''' Adds the ETag to a response, no-cache makes the browser check every time instead of guessing how long it is fresh '''
+    response.set_etag(etag)
+    response.headers["Cache-Control"] = "private, no-cache"
+    return response
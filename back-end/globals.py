@@ -1,19 +1,150 @@
 ''' This will be used to store information on
     1) The PYKWT secret_key
     2) Connection details for mongoDB
+
+    The mongoDB client is made the first time it is used in each process, not when this file is imported.
+    A MongoClient isn't safe to share across a fork, so with a pre-fork server (gunicorn, see gunicorn.conf.py) every worker
+    gets its own client after it has forked, even if the app was loaded in the parent first.
+
+    client and db work the same as before (globals.db.users, globals.db["posts"], globals.client.admin...),
+    they just look up the real client for the current process each time they are used
+
+    Importing this does nothing else either, the .env file is read by the entry points (app.py, wsgi.py, gunicorn.conf.py,
+    and the flask command reads it itself) and the settings below are read from the environment when they are first needed
+
+    The client's pool, timeouts and wire compression come from the environment as well (see client_options), anything not set
+    keeps pymongo's default. mongo_pool.py watches the pool, see benchmarks/pool_size.py for picking a pool size
 '''
 
 ### --- IMPORTS --- ###
 from pymongo import MongoClient
-import os
-from dotenv import load_dotenv # used to read the .env file
-
-### --- GET SECRET KEY --- ###
-load_dotenv()
+from pymongo.database import Database
+from pymongo import compression_support
+import os, threading
+import mongo_pool
 
 ### --- SECRET KEY --- ###
 #secret_key = 'hellothere'
-secret_key = os.environ.get("ALCHEMAX_SECRET_KEY")
+def get_secret_key():
+    return os.environ.get("ALCHEMAX_SECRET_KEY")
+
+def __getattr__(name):
+    # globals.secret_key is read when it is used, not when this is imported, so the .env file can be loaded after
+    if name == "secret_key":
+        return get_secret_key()
+    raise AttributeError("module 'globals' has no attribute " + repr(name))
 
 ### --- DB CONNECTION --- ###
-client = MongoClient("mongodb://127.0.0.1:27017"); db = client.Project_Alchemax
\ No newline at end of file
+def mongo_uri():
+    return os.environ.get("ALCHEMAX_MONGO_URI", "mongodb://127.0.0.1:27017")
+
+def database_name():
+    return os.environ.get("ALCHEMAX_MONGO_DB", "Project_Alchemax")
+
+# Setting -> the MongoClient option it sets, all whole numbers
+clientSettings = {
+    "ALCHEMAX_MONGO_MAX_POOL_SIZE" : "maxPoolSize", # connections per server for each process (pymongo's default is 100)
+    "ALCHEMAX_MONGO_MIN_POOL_SIZE" : "minPoolSize", # kept open even when idle, so a quiet worker doesn't reconnect on the next burst
+    "ALCHEMAX_MONGO_WAIT_QUEUE_TIMEOUT_MS" : "waitQueueTimeoutMS", # how long a request waits for a free connection before failing
+    "ALCHEMAX_MONGO_SERVER_SELECTION_TIMEOUT_MS" : "serverSelectionTimeoutMS" # how long a request waits for a server to be reachable
+}
+
+# Wire compressors and whether pymongo can use them here, asked of pymongo itself as the library zstd needs depends on the
+# python version (backports.zstd before 3.14), snappy needs python-snappy and zlib is always there
+compressorsAvailable = {
+    "zstd" : compression_support._have_zstd,
+    "snappy" : compression_support._have_snappy,
+    "zlib" : compression_support._have_zlib
+}
+
+def client_options():
+    ''' The MongoClient options from the environment.
+        ALCHEMAX_MONGO_COMPRESSORS is a comma separated list in order of preference, e.g. "zstd,snappy,zlib", the server
+        uses the first one it also has. Any that aren't installed here are left out, so the same .env works everywhere
+    '''
+    options = {}
+    for setting, option in clientSettings.items():
+        value = os.environ.get(setting)
+        if value:
+            options[option] = int(value)
+
+    compressors = [name.strip() for name in os.environ.get("ALCHEMAX_MONGO_COMPRESSORS", "").split(",") if name.strip()]
+    compressors = [name for name in compressors if name in compressorsAvailable and compressorsAvailable[name]()]
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+    return options
+
+_lock = threading.Lock()
+_client = None
+_clientPid = None
+
+
+def get_client():
+    ''' The MongoClient for this process, made on first use (and again in a forked child) '''
+    global _client, _clientPid
+    if _clientPid != os.getpid():
+        with _lock:
+            if _clientPid != os.getpid():
+                # connect=False, the connection is opened by the first query rather than straight away
+                mongo_pool.reset()
+                _client = MongoClient(mongo_uri(), connect=False, event_listeners=[mongo_pool.listener], **client_options())
+                _clientPid = os.getpid()
+    return _client
+
+def get_db():
+    return get_client()[database_name()]
+
+
+class _LazyClient:
+    ''' Stands in for the MongoClient, so it can be imported before the client exists '''
+
+    def __getattr__(self, name):
+        return getattr(get_client(), name)
+
+    def __getitem__(self, name):
+        return get_client()[name]
+
+
+class _LazyCollection:
+    ''' Stands in for a collection, the blueprints keep these at module level (users = globals.db.users) '''
+
+    def __init__(self, name):
+        self._name = name
+        self._collection = None
+        self._client = None
+
+    def _get(self):
+        client = get_client()
+        if self._client is not client:
+            self._collection = client[database_name()][self._name]
+            self._client = client
+        return self._collection
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __repr__(self):
+        return "<lazy collection " + self._name + ">"
+
+
+class _LazyDatabase:
+    ''' Stands in for the database, any collection taken from it is a _LazyCollection '''
+
+    @property
+    def name(self):
+        return database_name()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        # Database methods (command, list_collection_names...) go to the real database, anything else is a collection
+        if hasattr(Database, name):
+            return getattr(get_db(), name)
+        return _LazyCollection(name)
+
+    def __getitem__(self, name):
+        return _LazyCollection(name)
+
+
+client = _LazyClient()
+db = _LazyDatabase()
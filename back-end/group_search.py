@@ -0,0 +1,137 @@
+''' This is the group search, used by search_by_name and search_by_category in the groups blueprint
+
+    The old search passed the URL straight into an unanchored, case insensitive $regex, which can't use an index (every search
+    read the whole groups collection) and let users send any regex they liked. Now:
+        1) Each group stores a normalised copy of its name and category (lowercase, no accents or punctuation) and their words,
+           set by create_group and edit_group
+        2) A search is normalised the same way and any regex characters are escaped
+        3) Results come back in order of relevance:
+            - names that start with the search (an exact match comes first)
+            - then names where every word of the search starts a word in the name, i.e. "racing" finds "Sim Racing Club"
+        4) Every query is an anchored regex on an indexed field, and the results are paginated with a cursor instead of skip
+
+    Groups created before this was added need their search fields filled in once:
+        flask --app app index-group-search
+'''
+
+### --- IMPORTS --- ###
+import re, unicodedata
+import click
+import globals, indexes, pagination
+
+### --- FIELDS --- ###
+''' The searchable fields, "name" and "category" are the two searches the API offers '''
+searchFields = {
+    "name" : ("search_name", "search_name_tokens"),
+    "category" : ("search_category", "search_category_tokens")
+}
+
+### --- INDEXES --- ###
+for field, tokenField in searchFields.values():
+    indexes.register("groups", [(field, 1), ("_id", 1)]) # prefix search, already in result order
+    indexes.register("groups", [(tokenField, 1)]) # word search
+indexes.register_query("group search by name", "groups",
+                       {"search_name": {"$regex": "^sim"}}, [("search_name", 1), ("_id", 1)],
+                       seed=[{"group_name": "Seed group " + str(i), "search_name": "seed group " + str(i),
+                              "search_name_tokens": ["seed", "group", str(i)], "search_category": "sim racing",
+                              "search_category_tokens": ["sim", "racing"]} for i in range(50)])
+indexes.register_query("group search by category word", "groups", {"search_category_tokens": {"$regex": "^rac"}})
+
+
+### --- NORMALISING --- ###
+def normalise(text):
+    ''' Lowercase, accents removed, anything that isn't a letter or number becomes a single space '''
+    text = unicodedata.normalize("NFKD", str(text or ""))
+    text = "".join(c for c in text if not unicodedata.combining(c)).lower()
+    return " ".join(re.split(r"[\W_]+", text)).strip()
+
+def tokenise(text):
+    return sorted(set(normalise(text).split()))
+
+def search_document(groupName, groupCategory):
+    ''' The search fields to store on a group document, used by create_group and edit_group '''
+    return {
+        "search_name" : normalise(groupName),
+        "search_name_tokens" : tokenise(groupName),
+        "search_category" : normalise(groupCategory),
+        "search_category_tokens" : tokenise(groupCategory)
+    }
+
+
+### --- SEARCH --- ###
+def _encode(tier, doc, field):
+    return str(tier) + "." + pagination.encode_cursor(doc, field)
+
+def _decode(cursor):
+    ''' Returns (tier, cursor for that tier) '''
+    tier, _, rest = cursor.partition(".")
+    if tier not in ("1", "2") or not rest:
+        raise pagination.InvalidCursor("Invalid cursor")
+    return int(tier), rest
+
+def search(kind, text, limit, cursor=None, projection=None):
+    ''' Searches the groups by "name" or "category", returns (groups, next_cursor) '''
+    field, tokenField = searchFields[kind]
+    query = normalise(text)
+    if not query:
+        return [], None
+
+    prefix = {"$regex": "^" + re.escape(query)}
+    tiers = {
+        # Starts with the whole search
+        1 : {field: prefix},
+        # Every word of the search starts a word in the field, and it wasn't in tier 1
+        2 : {"$and": [{tokenField: {"$regex": "^" + re.escape(token)}} for token in query.split()] + [{field: {"$not": prefix}}]}
+    }
+
+    startTier, tierCursor = _decode(cursor) if cursor else (1, None)
+
+    # The cursor needs the search field, it is taken back out of the results if the caller didn't ask for it
+    hideField = projection is not None and field not in projection
+    if projection is not None:
+        projection = {**projection, field: 1}
+
+    results = []
+    for tier in (1, 2):
+        if tier < startTier:
+            continue
+
+        remaining = limit + 1 - len(results)
+        after = pagination.keyset_filter(field, tierCursor if tier == startTier else None, descending=False)
+
+        found = list(globals.db.groups.find({**tiers[tier], **after}, projection)
+                     .sort(pagination.keyset_sort(field, descending=False)).limit(remaining))
+
+        results += [(tier, doc) for doc in found]
+        if len(results) > limit:
+            break
+
+    nextCursor = None
+    if len(results) > limit:
+        results = results[:limit]
+        lastTier, lastDoc = results[-1]
+        nextCursor = _encode(lastTier, lastDoc, field)
+
+    groups = [doc for tier, doc in results]
+    if hideField:
+        for doc in groups:
+            doc.pop(field, None)
+
+    return groups, nextCursor
+
+
+### --- BACKFILL --- ###
+def backfill():
+    ''' Fills in the search fields on groups that don't have them yet, returns how many were updated '''
+    updated = 0
+    for group in globals.db.groups.find({"search_name": {"$exists": False}}, {"group_name": 1, "category": 1}):
+        globals.db.groups.update_one({"_id": group["_id"]}, {"$set": search_document(group.get("group_name"), group.get("category"))})
+        updated += 1
+    return updated
+
+def init_app(app):
+    ''' Adds the index-group-search command to the flask cli '''
+
+    @app.cli.command("index-group-search")
+    def index_group_search_command():
+        click.echo(str(backfill()) + " groups updated")
@@ -0,0 +1,263 @@
+''' This is the typeahead for the group search box, used by /api/search_for_groups/suggest?q=
+
+    The search box used to call the full search on every key press. Suggestions are answered from memory instead:
+        1) Each process keeps a sorted list of (key, group_id), the keys are the normalised name, the normalised category
+           and every word of the name (see group_search.normalise), so "rac" finds "Sim Racing Club"
+        2) A prefix is two bisects into that list, every key between them starts with the prefix
+        3) The matching groups are ranked by popularity (members + the owner) and the top few returned
+        4) Short prefixes ("s", "si") can match most of the list, so any prefix matching more than ALCHEMAX_SUGGEST_SCAN_LIMIT
+           keys has its top groups worked out when the list is built, instead of ranking the whole range on every key press
+        5) The answer for each prefix is kept until the list changes, so typing the same thing again costs a dict lookup
+
+    The list is built on the first suggestion in each process, by one background thread. Requests that arrive while it is
+    being built wait up to ALCHEMAX_SUGGEST_FIRST_BUILD_WAIT_SECONDS for it and get no suggestions if it isn't ready,
+    so a burst of first key presses doesn't run the full build once each. create_group, edit_group and delete_group update it straight away.
+    Changes made by other workers (and members joining or leaving) are picked up when it is rebuilt, every
+    ALCHEMAX_SUGGEST_REBUILD_SECONDS, in the background so no request waits on it
+'''
+
+### --- IMPORTS --- ###
+from bisect import bisect_left, insort
+import heapq, os, threading, time
+import globals, group_search, tombstones
+
+### --- SETTINGS --- ###
+rebuildInterval = float(os.environ.get("ALCHEMAX_SUGGEST_REBUILD_SECONDS", 300))
+memoSize = int(os.environ.get("ALCHEMAX_SUGGEST_MEMO_SIZE", 5000)) # prefixes remembered before the memo is cleared
+scanLimit = int(os.environ.get("ALCHEMAX_SUGGEST_SCAN_LIMIT", 1000)) # keys a prefix can match before its top groups are precomputed
+firstBuildWait = float(os.environ.get("ALCHEMAX_SUGGEST_FIRST_BUILD_WAIT_SECONDS", 2))
+maximumSuggestions = 20
+
+### --- STATE --- ###
+_lock = threading.Lock()
+_keys = [] # sorted (key, group_id)
+_groups = {} # group_id -> {"group_name", "category", "members", "keys"}
+_dense = {} # prefix -> top group ids (twice as many as can be asked for, so a delete rarely has to rework it), for prefixes matching more than scanLimit keys
+_memo = {} # (prefix, limit) -> suggestions
+_builtAt = None
+_builtPid = None
+_rebuilding = False
+_firstBuildPid = None # the process whose first build has been started
+_firstBuild = threading.Event() # set when that build has finished (or failed)
+
+
+def _group_keys(groupName, groupCategory):
+    keys = {group_search.normalise(groupName), group_search.normalise(groupCategory)}
+    keys.update(group_search.tokenise(groupName))
+    keys.discard("")
+    return sorted(keys)
+
+def _add(group_id, groupName, groupCategory, members):
+    ''' Needs _lock '''
+    keys = _group_keys(groupName, groupCategory)
+    _groups[group_id] = {"group_name": groupName, "category": groupCategory, "members": members, "keys": keys}
+    for key in keys:
+        insort(_keys, (key, group_id))
+
+def _remove(group_id):
+    ''' Needs _lock, returns the removed group or None '''
+    group = _groups.pop(group_id, None)
+    if group is None:
+        return None
+    for key in group["keys"]:
+        i = bisect_left(_keys, (key, group_id))
+        if i < len(_keys) and _keys[i] == (key, group_id):
+            del _keys[i]
+    return group
+
+
+### --- RANKING --- ###
+def _rank(groups, group_id):
+    group = groups[group_id]
+    return (-group["members"], group["group_name"] or "", group_id)
+
+def _range(keys, prefix):
+    return bisect_left(keys, (prefix,)), bisect_left(keys, (prefix + "\uffff",))
+
+def _top(keys, groups, start, end, limit):
+    matching = {group_id for key, group_id in keys[start:end]}
+    return heapq.nsmallest(limit, matching, key=lambda gid: _rank(groups, gid))
+
+def _find_dense(keys, groups):
+    ''' Walks the sorted keys one character at a time, every prefix matching more than scanLimit keys gets its top groups stored '''
+    dense = {}
+    pending = [""]
+    while pending:
+        prefix = pending.pop()
+        start, end = _range(keys, prefix) if prefix else (0, len(keys))
+        if end - start <= scanLimit:
+            continue
+        if prefix:
+            dense[prefix] = _top(keys, groups, start, end, maximumSuggestions * 2)
+
+        # The next character of each key in the range, jumping straight past each one
+        i = start
+        while i < end:
+            key = keys[i][0]
+            if len(key) <= len(prefix):
+                i += 1
+                continue
+            child = key[:len(prefix) + 1]
+            pending.append(child)
+            i = bisect_left(keys, (child + "\uffff",), i, end)
+    return dense
+
+def _dense_add(group_id):
+    ''' Needs _lock, puts a new or changed group into the precomputed prefixes it now ranks in '''
+    for key in _groups[group_id]["keys"]:
+        for length in range(1, len(key) + 1):
+            top = _dense.get(key[:length])
+            if top is None or group_id in top:
+                continue
+            top.append(group_id)
+            top.sort(key=lambda gid: _rank(_groups, gid))
+            del top[maximumSuggestions * 2:]
+
+def _dense_remove(group_id):
+    ''' Needs _lock, takes the group out of the precomputed prefixes, only reworking one if it gets too short to answer from '''
+    for prefix, top in _dense.items():
+        if group_id in top:
+            top.remove(group_id)
+            if len(top) < maximumSuggestions:
+                start, end = _range(_keys, prefix)
+                _dense[prefix] = _top(_keys, _groups, start, end, maximumSuggestions * 2)
+
+
+### --- BUILDING --- ###
+def _load():
+    ''' Reads every group and its member count, returns (sorted keys, groups) '''
+    members = {row["_id"]: row["members"] for row in globals.db.users.aggregate([
+        {"$unwind": "$memberOf"},
+        {"$group": {"_id": "$memberOf", "members": {"$sum": 1}}}
+    ])}
+
+    keys = []
+    groups = {}
+    for group in globals.db.groups.find(tombstones.notDeleted, {"group_name": 1, "category": 1}):
+        group_id = str(group["_id"])
+        groupKeys = _group_keys(group.get("group_name"), group.get("category"))
+        groups[group_id] = {"group_name": group.get("group_name"), "category": group.get("category"),
+                            "members": members.get(group_id, 0) + 1, "keys": groupKeys}
+        keys += [(key, group_id) for key in groupKeys]
+
+    keys.sort()
+    return keys, groups
+
+def rebuild():
+    ''' Replaces the list with a fresh copy from the database '''
+    global _keys, _groups, _dense, _memo, _builtAt, _builtPid, _rebuilding
+    try:
+        keys, groups = _load()
+        dense = _find_dense(keys, groups)
+        with _lock:
+            _keys, _groups, _dense, _memo = keys, groups, dense, {}
+            _builtAt = time.monotonic()
+            _builtPid = os.getpid()
+    finally:
+        with _lock:
+            _rebuilding = False
+
+def _first_build():
+    global _firstBuildPid
+    try:
+        rebuild()
+    finally:
+        with _lock:
+            if _builtPid != os.getpid():
+                _firstBuildPid = None # it failed (mongoDB is down), the next suggestion tries again
+            _firstBuild.set()
+
+def _ensure_built():
+    ''' Builds the list the first time in each process (forked workers don't share it), then rebuilds in the background when it is stale '''
+    global _rebuilding, _firstBuildPid, _firstBuild
+    with _lock:
+        if _builtPid != os.getpid():
+            # Only one build per process, everyone else waits for it
+            if _firstBuildPid != os.getpid():
+                _firstBuildPid = os.getpid()
+                _firstBuild = threading.Event()
+                threading.Thread(target=_first_build, name="group-suggest-build", daemon=True).start()
+            firstBuild = _firstBuild
+        elif not _rebuilding and time.monotonic() - _builtAt > rebuildInterval:
+            _rebuilding = True
+            threading.Thread(target=rebuild, name="group-suggest-rebuild", daemon=True).start()
+            return
+        else:
+            return
+
+    firstBuild.wait(firstBuildWait)
+
+def is_built():
+    return _builtPid == os.getpid()
+
+
+### --- UPDATES --- ###
+''' Called by the groups blueprint after the write has gone through. If this process hasn't built the list yet there is
+    nothing to update, the first build will read the change from the database
+'''
+def add_group(group_id, groupName, groupCategory, members=1):
+    global _memo
+    with _lock:
+        if _builtPid == os.getpid():
+            _remove(str(group_id))
+            _add(str(group_id), groupName, groupCategory, members)
+            _dense_add(str(group_id))
+            _memo = {}
+
+def update_group(group_id, groupName, groupCategory):
+    global _memo
+    with _lock:
+        if _builtPid == os.getpid():
+            old = _remove(str(group_id))
+            _dense_remove(str(group_id))
+            _add(str(group_id), groupName, groupCategory, old["members"] if old else 1)
+            _dense_add(str(group_id))
+            _memo = {}
+
+def remove_group(group_id):
+    global _memo
+    with _lock:
+        if _builtPid == os.getpid() and _remove(str(group_id)) is not None:
+            _dense_remove(str(group_id))
+            _memo = {}
+
+
+### --- SUGGEST --- ###
+def suggest(text, limit=10):
+    ''' Returns up to limit groups whose name, category or a word of the name starts with text, most popular first '''
+    global _memo
+    prefix = group_search.normalise(text)
+    limit = min(limit, maximumSuggestions)
+    if not prefix:
+        return []
+
+    _ensure_built()
+    if not is_built():
+        return [] # still building
+
+    with _lock:
+        memoKey = (prefix, limit)
+        if memoKey in _memo:
+            return _memo[memoKey]
+
+        if prefix in _dense:
+            top = _dense[prefix][:limit]
+        else:
+            start, end = _range(_keys, prefix)
+            top = _top(_keys, _groups, start, end, limit)
+
+        suggestions = [{
+            "_id" : gid,
+            "group_name" : _groups[gid]["group_name"],
+            "category" : _groups[gid]["category"],
+            "members" : _groups[gid]["members"]
+        } for gid in top]
+
+        if len(_memo) >= memoSize:
+            _memo = {}
+        _memo[memoKey] = suggestions
+        return suggestions
+
+def stats():
+    with _lock:
+        return {"groups": len(_groups), "keys": len(_keys), "dense_prefixes": len(_dense), "memo": len(_memo)}
@@ -0,0 +1,42 @@
+''' This is the gunicorn config for running the back end in production (the VPS), gunicorn doesn't run on Windows so
+    development still uses py app.py
+
+    From the back-end folder:
+        pip install gunicorn
+        flask --app app ensure-indexes
+        gunicorn -c gunicorn.conf.py wsgi:app
+
+    The app is loaded once in the parent (preload_app) and each worker is forked from it. That is safe as nothing opens a
+    mongoDB connection or starts a thread at import, the client, health check, log writer, revocation list and hashing pool
+    are all made the first time they are used in each worker (see globals.py)
+
+    Comparing against the development server on the same box (any HTTP load tool, e.g. hey):
+        py app.py                                  then  hey -z 30s -c 64 -H "x-access-token: <token>" http://localhost:5000/api/home
+        gunicorn -c gunicorn.conf.py wsgi:app      then  the same command against port 5000
+    ALCHEMAX_WORKERS and ALCHEMAX_THREADS can be changed between runs to find the best mix for the box
+'''
+
+### --- IMPORTS --- ###
+import multiprocessing, os
+from dotenv import load_dotenv
+load_dotenv() # so the settings below (and the app, as it is preloaded) can come from .env
+
+### --- SETTINGS --- ###
+bind = os.environ.get("ALCHEMAX_BIND", "127.0.0.1:5000")
+
+# Workers are processes (one per core, plus one), threads are per worker, most of a request is waiting on mongoDB
+workers = int(os.environ.get("ALCHEMAX_WORKERS", multiprocessing.cpu_count() + 1))
+threads = int(os.environ.get("ALCHEMAX_THREADS", 8))
+worker_class = "gthread"
+
+preload_app = True
+timeout = int(os.environ.get("ALCHEMAX_WORKER_TIMEOUT", 30))
+graceful_timeout = 30
+keepalive = 5
+
+# Restart workers now and then so slow leaks can't build up, the jitter stops them all restarting at once
+max_requests = int(os.environ.get("ALCHEMAX_MAX_REQUESTS", 10000))
+max_requests_jitter = 1000
+
+accesslog = "-"
+errorlog = "-"
@@ -0,0 +1,147 @@
+''' This is used for hashing and checking passwords with bcrypt off the request thread
+
+    bcrypt is slow on purpose, so a burst of logins used to pin every worker thread and starve cheap endpoints like /api/home.
+    Now:
+        1) The hashing runs on a small process pool (ALCHEMAX_HASH_WORKERS processes)
+        2) Only so many hashes can be waiting for the pool at once (ALCHEMAX_HASH_QUEUE_SIZE)
+        3) If the pool and the wait queue are full, HashingBusy is raised straight away so the endpoint can return a 503
+        4) A hash that takes longer than ALCHEMAX_HASH_TIMEOUT_SECONDS also raises HashingBusy, its slot is only given back
+           once the pool has actually finished it, so the pool's backlog can never grow past the workers and the queue
+
+    The pool processes are started with forkserver (spawn on Windows) rather than fork, forking a gthread worker that has
+    pymongo, health and log threads running can leave the child stuck on a lock one of those threads was holding
+
+    The bcrypt cost factor is set with ALCHEMAX_BCRYPT_ROUNDS, to pick one for the server run:
+        python hashing.py --target-ms 250
+'''
+
+### --- IMPORTS --- ###
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+import argparse, multiprocessing, os, threading, time, warnings
+import bcrypt
+
+### --- SETTINGS --- ###
+hashWorkers = int(os.environ.get("ALCHEMAX_HASH_WORKERS", max(1, (os.cpu_count() or 2) // 2)))
+hashQueueSize = int(os.environ.get("ALCHEMAX_HASH_QUEUE_SIZE", hashWorkers * 4)) # hashes allowed to wait on top of the ones running
+hashTimeout = float(os.environ.get("ALCHEMAX_HASH_TIMEOUT_SECONDS", 10))
+bcryptRounds = int(os.environ.get("ALCHEMAX_BCRYPT_ROUNDS", 12)) # 12 is bcrypt.gensalt()'s default
+
+retryAfterSeconds = 1 # sent back with the 503 when the pool is full
+
+### --- STATE --- ###
+_lock = threading.Lock()
+_pool = None
+_poolPid = None
+_slots = threading.BoundedSemaphore(hashWorkers + hashQueueSize)
+
+
+class HashingOverBudget(RuntimeWarning):
+    ''' Warned by calibrate() when even the lowest cost factor it allows is slower than the target '''
+    pass
+
+class HashingBusy(Exception):
+    ''' Raised when the pool and its wait queue are full, or a hash took too long '''
+    pass
+
+
+### --- RUN IN THE POOL --- ###
+''' These run in the pool processes, so they have to be plain module level functions '''
+def _hash(password, rounds):
+    return bcrypt.hashpw(password, bcrypt.gensalt(rounds))
+
+def _check(password, hashed):
+    return bcrypt.checkpw(password, hashed)
+
+
+### --- POOL --- ###
+def _get_pool():
+    ''' Creates the pool the first time it is needed, once per process (a forked worker can't use its parents pool) '''
+    global _pool, _poolPid, _slots
+
+    if _poolPid == os.getpid():
+        return _pool
+
+    with _lock:
+        if _poolPid != os.getpid():
+            startMethod = "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn"
+            _pool = ProcessPoolExecutor(max_workers=hashWorkers, mp_context=multiprocessing.get_context(startMethod))
+            _slots = threading.BoundedSemaphore(hashWorkers + hashQueueSize)
+            _poolPid = os.getpid()
+
+    return _pool
+
+def _run(func, *args):
+    pool = _get_pool()
+
+    # Admission control, if every slot is taken don't wait around
+    if not _slots.acquire(blocking=False):
+        raise HashingBusy()
+
+    try:
+        future = pool.submit(func, *args)
+    except Exception:
+        _slots.release()
+        raise
+
+    # The slot is given back when the pool is done with it, not when we stop waiting
+    slots = _slots
+    future.add_done_callback(lambda finished: slots.release())
+
+    try:
+        return future.result(timeout=hashTimeout)
+    except TimeoutError:
+        future.cancel() # if it hasn't started yet
+        raise HashingBusy("Password hashing timed out")
+
+
+### --- PUBLIC FUNCTIONS --- ###
+def hash_password(password):
+    ''' Returns the bcrypt hash of the password (str), raises HashingBusy if the pool is full '''
+    return _run(_hash, bytes(password, 'UTF-8'), bcryptRounds)
+
+def check_password(password, hashed):
+    ''' Returns True if the password (str) matches the stored hash, raises HashingBusy if the pool is full '''
+    return _run(_check, bytes(password, 'UTF-8'), hashed)
+
+
+### --- COST FACTOR CALIBRATION --- ###
+def calibrate(targetMs, samples=3, minRounds=10, maxRounds=16):
+    ''' Times bcrypt on this machine and returns the highest cost factor that stays under targetMs per hash.
+        minRounds is a floor, on hardware too slow to hash at minRounds within targetMs it is still returned,
+        with a HashingOverBudget warning so the deployment knows every login will take longer than it wanted
+    '''
+    chosen = minRounds
+    timings = {}
+
+    for rounds in range(minRounds, maxRounds + 1):
+        salt = bcrypt.gensalt(rounds)
+        start = time.perf_counter()
+        for _ in range(samples):
+            bcrypt.hashpw(b"calibration-password", salt)
+        timings[rounds] = (time.perf_counter() - start) * 1000 / samples
+
+        if timings[rounds] > targetMs:
+            break
+        chosen = rounds
+
+    if timings[minRounds] > targetMs:
+        warnings.warn(f"bcrypt at the minimum {minRounds} rounds takes {timings[minRounds]:.1f} ms per hash on this machine, "
+                      f"over the {targetMs:g} ms target", HashingOverBudget, stacklevel=2)
+
+    return chosen, timings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pick the bcrypt cost factor for this machine")
+    parser.add_argument("--target-ms", type=float, default=250, help="how long one hash should take at most")
+    parser.add_argument("--samples", type=int, default=3, help="hashes timed per cost factor")
+    args = parser.parse_args()
+
+    with warnings.catch_warnings(record=True) as overBudget:
+        warnings.simplefilter("always", HashingOverBudget)
+        chosen, timings = calibrate(args.target_ms, args.samples)
+
+    for rounds, ms in timings.items():
+        print(f"rounds={rounds}: {ms:.1f} ms per hash")
+    for warning in overBudget:
+        print(f"\nWARNING: {warning.message}, this is the lowest allowed so it is used anyway")
+    print(f"\nALCHEMAX_BCRYPT_ROUNDS={chosen}")
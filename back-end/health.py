@@ -0,0 +1,137 @@
+''' This is the shared database health check, used by every blueprint
+
+    Previously each endpoint pinged mongoDB itself before doing anything, doubling the round trips.
+    Now a background thread pings on an interval and keeps a circuit breaker state:
+        1) closed - mongoDB is fine, requests go through
+        2) open - the ping failed too many times in a row, requests get a 503 straight away
+        3) half-open - the cool down has passed, the next ping decides whether it goes back to closed or open
+
+    Endpoints only read the current state, they never ping themselves
+
+    The pings go through their own small client with short timeouts (ALCHEMAX_HEALTH_TIMEOUT_MS), not the app client.
+    With pymongo's default 30 second server selection a dead server would take about a minute to open the breaker,
+    and every request in that time would be let through to hang
+'''
+
+### --- IMPORTS --- ###
+from flask import jsonify
+from pymongo import MongoClient
+import datetime, os, threading, time
+import globals
+
+### --- SETTINGS --- ###
+pingInterval = float(os.environ.get("ALCHEMAX_HEALTH_INTERVAL_SECONDS", 5))
+failureThreshold = int(os.environ.get("ALCHEMAX_HEALTH_FAILURE_THRESHOLD", 2)) # failed pings in a row before opening
+openCooldown = float(os.environ.get("ALCHEMAX_HEALTH_OPEN_COOLDOWN_SECONDS", 15)) # how long to stay open before trying again
+pingTimeout = int(os.environ.get("ALCHEMAX_HEALTH_TIMEOUT_MS", 2000)) # server selection, connect and socket timeout for a ping
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half-open"
+
+### --- STATE --- ###
+_lock = threading.Lock()
+_state = {
+    "state" : CLOSED,
+    "consecutive_failures" : 0,
+    "last_error" : None,
+    "last_checked" : None,
+    "opened_at" : None
+}
+_startedPid = None
+_monitorClient = None
+_monitorPid = None
+
+
+### --- PINGING --- ###
+def _monitor_client():
+    ''' The client used for pinging, one per process like the app client '''
+    global _monitorClient, _monitorPid
+    if _monitorPid != os.getpid():
+        _monitorClient = MongoClient(globals.mongo_uri(), connect=False, maxPoolSize=1,
+                                     serverSelectionTimeoutMS=pingTimeout, connectTimeoutMS=pingTimeout, socketTimeoutMS=pingTimeout)
+        _monitorPid = os.getpid()
+    return _monitorClient
+
+def _record_success():
+    with _lock:
+        _state["state"] = CLOSED
+        _state["consecutive_failures"] = 0
+        _state["last_error"] = None
+        _state["opened_at"] = None
+        _state["last_checked"] = datetime.datetime.now(datetime.UTC)
+
+def _record_failure(error):
+    with _lock:
+        _state["consecutive_failures"] += 1
+        _state["last_error"] = str(error)
+        _state["last_checked"] = datetime.datetime.now(datetime.UTC)
+
+        # A failed trial ping re-opens straight away
+        if _state["state"] == HALF_OPEN or _state["consecutive_failures"] >= failureThreshold:
+            if _state["state"] != OPEN:
+                _state["opened_at"] = time.monotonic()
+            _state["state"] = OPEN
+
+def check_now():
+    ''' Pings mongoDB once and updates the state '''
+    with _lock:
+        if _state["state"] == OPEN:
+            # Stay open until the cool down is over, then let one trial ping through
+            if time.monotonic() - _state["opened_at"] < openCooldown:
+                return
+            _state["state"] = HALF_OPEN
+
+    try:
+        _monitor_client().admin.command("ping")
+        _record_success()
+    except Exception as e:
+        _record_failure(e)
+
+def _monitor_loop():
+    while True:
+        check_now()
+        time.sleep(pingInterval)
+
+def _ensure_started():
+    ''' Starts the monitor thread once per process, so forked workers get their own '''
+    global _startedPid
+
+    if _startedPid == os.getpid():
+        return
+
+    with _lock:
+        if _startedPid == os.getpid():
+            return
+        _startedPid = os.getpid()
+
+    # Starts closed, the thread does the first ping so a request never waits on a hung server selection
+    threading.Thread(target=_monitor_loop, name="mongo-health-monitor", daemon=True).start()
+
+
+### --- PUBLIC FUNCTIONS --- ###
+def is_available():
+    ''' True if requests should be let through to mongoDB (closed or half-open) '''
+    _ensure_started()
+    return _state["state"] != OPEN
+
+def status():
+    ''' Returns a copy of the current state for the health endpoints '''
+    _ensure_started()
+    with _lock:
+        current = dict(_state)
+
+    current.pop("opened_at")
+    if current["last_checked"]:
+        current["last_checked"] = current["last_checked"].isoformat()
+    return current
+
+def mongo_required():
+    ''' Same return values as the old per blueprint check:
+            1) True, None if mongo is reachable
+            2) False, (error response, 503) if it isn't
+    '''
+    if is_available():
+        return True, None
+
+    return False, (jsonify({"error": "Database is not responding"}), 503) # the error itself is in /api/health/details, admins only
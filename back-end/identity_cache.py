@@ -0,0 +1,96 @@
+''' This is a cache for user_id -> username and group_id -> group_name, shared by every blueprint in the process
+
+    The feeds, group page, single post and calendar all need the creators username and the group name, which almost never change.
+        1) Each cache holds up to ALCHEMAX_IDENTITY_CACHE_SIZE entries, the least recently used is dropped first
+        2) Each entry is only trusted for ALCHEMAX_IDENTITY_CACHE_TTL_SECONDS, so other workers' changes get picked up eventually
+        3) get_many() looks up everything it was given, anything not cached is fetched with a single $in query
+        4) edit_group, delete_group and delete_account invalidate the entries they change
+
+    Ids that don't exist (deleted users or groups) are cached as None, so they don't hit the database every time either
+'''
+
+### --- IMPORTS --- ###
+from collections import OrderedDict
+from bson import ObjectId
+import os, threading, time
+import globals
+
+### --- SETTINGS --- ###
+cacheSize = int(os.environ.get("ALCHEMAX_IDENTITY_CACHE_SIZE", 10000))
+cacheTtl = float(os.environ.get("ALCHEMAX_IDENTITY_CACHE_TTL_SECONDS", 60))
+
+
+class IdentityCache:
+    ''' id (string) -> one field of the document, for one collection '''
+
+    def __init__(self, collection, field):
+        self.collection = collection
+        self.field = field
+        self._entries = OrderedDict() # id -> (value, expires at)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _cached(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None or entry[1] <= now:
+            return False, None
+        self._entries.move_to_end(key)
+        return True, entry[0]
+
+    def get_many(self, ids):
+        ''' Returns {id: value} for every id given, value is None if the document doesn't exist '''
+        now = time.monotonic()
+        found = {}
+        missing = set()
+
+        with self._lock:
+            for key in {str(i) for i in ids if i is not None}:
+                hit, value = self._cached(key, now)
+                if hit:
+                    found[key] = value
+                    self.hits += 1
+                else:
+                    missing.add(key)
+                    self.misses += 1
+
+        if not missing:
+            return found
+
+        # Everything not cached in one query
+        objectIds = [ObjectId(key) for key in missing if ObjectId.is_valid(key)]
+        fetched = {key: None for key in missing}
+        if objectIds:
+            for doc in globals.db[self.collection].find({"_id": {"$in": objectIds}}, {self.field: 1}):
+                fetched[str(doc["_id"])] = doc.get(self.field)
+
+        with self._lock:
+            expiresAt = time.monotonic() + cacheTtl
+            for key, value in fetched.items():
+                self._entries[key] = (value, expiresAt)
+                self._entries.move_to_end(key)
+            while len(self._entries) > cacheSize:
+                self._entries.popitem(last=False)
+
+        found.update(fetched)
+        return found
+
+    def get(self, id):
+        return self.get_many([id]).get(str(id))
+
+    def invalidate(self, *ids):
+        with self._lock:
+            for key in ids:
+                self._entries.pop(str(key), None)
+
+    def stats(self):
+        with self._lock:
+            return {"size": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+### --- CACHES --- ###
+usernames = IdentityCache("users", "username")
+groupNames = IdentityCache("groups", "group_name")
+
+def stats():
+    return {"usernames": usernames.stats(), "group_names": groupNames.stats()}
@@ -0,0 +1,109 @@
+''' This is the index registry, each blueprint registers the indexes its queries need here
+
+    1) register() adds an index to the registry
+    2) register_query() adds the canonical query of an endpoint, used to check the indexes actually get used
+    3) ensure_indexes() creates every registered index, creating an index that already exists does nothing so it is safe to run on every start
+    4) verify_indexes() seeds a scratch database, runs explain() on every canonical query and fails if any of them is a COLLSCAN
+
+    From the command line (in the back-end folder):
+        flask --app app ensure-indexes
+        flask --app app verify-indexes
+'''
+
+### --- IMPORTS --- ###
+import copy
+import click
+import globals
+
+### --- REGISTRY --- ###
+_indexes = [] # (collection, keys, options)
+_queries = [] # (name, collection, filter, sort, seed documents)
+
+
+def register(collection, keys, **options):
+    ''' Registers an index, keys is a list of (field, direction) like pymongo's create_index.
+        Any extra options (unique, expireAfterSeconds, ...) are passed straight to create_index
+    '''
+    entry = (collection, list(keys), options)
+    if entry not in _indexes:
+        _indexes.append(entry)
+
+def register_query(name, collection, filter, sort=None, seed=None):
+    ''' Registers the canonical query of an endpoint for verify_indexes.
+        seed is a list of example documents, inserted into the scratch database so the planner has something to plan against
+    '''
+    _queries.append((name, collection, filter, sort, seed or []))
+
+
+### --- APPLY --- ###
+def ensure_indexes(db=None):
+    ''' Creates all the registered indexes, returns the names that were created/already existed '''
+    db = db if db is not None else globals.db
+
+    created = []
+    for collection, keys, options in _indexes:
+        created.append(collection + "." + db[collection].create_index(keys, **options))
+    return created
+
+
+### --- VERIFY --- ###
+def _plan_stages(plan):
+    ''' Every stage name in an explain plan (plans nest their input stages) '''
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            yield plan["stage"]
+        for value in plan.values():
+            yield from _plan_stages(value)
+    elif isinstance(plan, list):
+        for value in plan:
+            yield from _plan_stages(value)
+
+def verify_indexes(scratchName=None):
+    ''' Runs every canonical query against a seeded scratch database.
+        Returns a list of (query name, stages, ok), ok is False if the winning plan used a COLLSCAN
+    '''
+    scratchName = scratchName or globals.db.name + "_index_check"
+    scratch = globals.client[scratchName]
+    globals.client.drop_database(scratchName)
+
+    try:
+        ensure_indexes(scratch)
+
+        for name, collection, filter, sort, seed in _queries:
+            if seed:
+                scratch[collection].insert_many(copy.deepcopy(seed))
+
+        results = []
+        for name, collection, filter, sort, seed in _queries:
+            cursor = scratch[collection].find(filter)
+            if sort:
+                cursor = cursor.sort(sort)
+
+            winningPlan = cursor.explain()["queryPlanner"]["winningPlan"]
+            stages = list(_plan_stages(winningPlan))
+            results.append((name, stages, "COLLSCAN" not in stages))
+
+        return results
+
+    finally:
+        globals.client.drop_database(scratchName)
+
+
+### --- FLASK COMMANDS --- ###
+def init_app(app):
+    ''' Adds the ensure-indexes and verify-indexes commands to the flask cli '''
+
+    @app.cli.command("ensure-indexes")
+    def ensure_indexes_command():
+        for name in ensure_indexes():
+            click.echo("ok  " + name)
+
+    @app.cli.command("verify-indexes")
+    def verify_indexes_command():
+        failed = False
+        for name, stages, ok in verify_indexes():
+            click.echo(("ok    " if ok else "FAIL  ") + name + "  " + " > ".join(stages))
+            failed = failed or not ok
+
+        if failed:
+            raise click.ClickException("At least one query is doing a collection scan")
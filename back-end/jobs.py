@@ -0,0 +1,209 @@
+''' This is the background job runner, for work that is too big to do inside a request (deleting an account, deleting a group)
+
+    1) An endpoint calls create(), which saves the job in the jobs collection and returns its id straight away
+       (the endpoint answers 202 with /api/jobs/<job_id> so the front end can check on it)
+    2) Each worker process has a runner thread that claims pending jobs one at a time
+    3) A job is a list of steps, each step works through the documents it has to change in batches of ALCHEMAX_JOB_BATCH,
+       saving its progress (and a heartbeat) after every batch and pausing ALCHEMAX_JOB_PAUSE_SECONDS so it can't flood the primary
+    4) If a worker dies mid job the heartbeat goes stale, after ALCHEMAX_JOB_STALE_SECONDS another worker claims it and carries on
+       from the step it had reached. Every step only ever looks for what is left to do, so doing a batch twice is harmless
+
+    Job documents:
+        {kind, owner, params, status (pending, running, done or failed), step, progress {step: documents}, attempts, error,
+         created_at, updated_at, heartbeat, retry_at, finished_at}
+'''
+
+### --- IMPORTS --- ###
+from flask import url_for
+from pymongo import ReturnDocument
+from bson import ObjectId
+import datetime, os, threading, time, traceback
+import globals, indexes
+
+### --- SETTINGS --- ###
+batchSize = int(os.environ.get("ALCHEMAX_JOB_BATCH", 500))
+pauseSeconds = float(os.environ.get("ALCHEMAX_JOB_PAUSE_SECONDS", 0.05)) # between batches
+pollSeconds = float(os.environ.get("ALCHEMAX_JOB_POLL_SECONDS", 5))
+staleSeconds = float(os.environ.get("ALCHEMAX_JOB_STALE_SECONDS", 120)) # no heartbeat for this long and the job is taken over
+maxAttempts = int(os.environ.get("ALCHEMAX_JOB_MAX_ATTEMPTS", 5))
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+### --- INDEXES --- ###
+indexes.register("jobs", [("status", 1), ("created_at", 1)]) # claiming the next job
+indexes.register("jobs", [("finished_at", 1)], expireAfterSeconds=7 * 24 * 60 * 60) # finished jobs are kept for a week
+
+### --- STATE --- ###
+_handlers = {} # kind -> list of (step name, function)
+_lock = threading.Lock()
+_wake = threading.Event()
+_startedPid = None
+
+
+def _now():
+    return datetime.datetime.now(datetime.UTC)
+
+def _jobs():
+    return globals.db.jobs
+
+
+### --- REGISTERING --- ###
+def register(kind, steps):
+    ''' Registers a kind of job, steps is a list of (name, function), each function is called with the Job and its params '''
+    _handlers[kind] = list(steps)
+
+
+class Job:
+    ''' Handed to each step, used to save progress as it goes '''
+
+    def __init__(self, doc):
+        self.id = doc["_id"]
+        self.kind = doc["kind"]
+        self.params = doc.get("params", {})
+        self.progress = doc.get("progress", {})
+        self.step = None
+
+    def checkpoint(self, done=0):
+        ''' Adds done to this steps count, saves it with a heartbeat, then pauses so the job is throttled '''
+        self.progress[self.step] = self.progress.get(self.step, 0) + done
+        _jobs().update_one({"_id": self.id}, {"$set": {
+            "step": self.step,
+            "progress": self.progress,
+            "heartbeat": _now(),
+            "updated_at": _now()
+        }})
+        if done and pauseSeconds:
+            time.sleep(pauseSeconds)
+
+    def batches(self, collection, filter, projection=None):
+        ''' Yields batches of documents matching filter until there are none left.
+            The caller has to change each batch so it no longer matches (delete it, pull the reference...), then it is checkpointed
+        '''
+        while True:
+            batch = list(globals.db[collection].find(filter, projection or {"_id": 1}).limit(batchSize))
+            if not batch:
+                return
+            yield batch
+            self.checkpoint(len(batch))
+
+
+### --- CREATING --- ###
+def create(kind, params, owner=None):
+    ''' Saves a new job and wakes the runner, returns the job id as a string '''
+    if kind not in _handlers:
+        raise ValueError("Unknown job kind: " + kind)
+
+    result = _jobs().insert_one({
+        "kind" : kind,
+        "owner" : owner,
+        "params" : params,
+        "status" : PENDING,
+        "step" : None,
+        "progress" : {},
+        "attempts" : 0,
+        "error" : None,
+        "created_at" : _now(),
+        "updated_at" : _now(),
+        "heartbeat" : None,
+        "retry_at" : _now(),
+        "finished_at" : None
+    })
+
+    _ensure_started()
+    _wake.set()
+    return str(result.inserted_id)
+
+def get(job_id):
+    if not ObjectId.is_valid(job_id):
+        return None
+    return _jobs().find_one({"_id": ObjectId(job_id)})
+
+def status_url(job_id):
+    ''' Where the front end checks on the job, on whichever host the request came in on (needs a request context) '''
+    return url_for("jobs_bp.job_status", job_id=str(job_id), _external=True)
+
+
+### --- RUNNING --- ###
+def _claim():
+    ''' Takes the oldest pending job, or a running job whose worker has stopped sending heartbeats '''
+    stale = _now() - datetime.timedelta(seconds=staleSeconds)
+    return _jobs().find_one_and_update(
+        {"kind": {"$in": list(_handlers)}, "$or": [
+            {"status": PENDING, "retry_at": {"$lte": _now()}},
+            {"status": RUNNING, "heartbeat": {"$lt": stale}}
+        ]},
+        {"$set": {"status": RUNNING, "heartbeat": _now(), "updated_at": _now()}, "$inc": {"attempts": 1}},
+        sort=[("created_at", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+def _run(doc):
+    job = Job(doc)
+    steps = _handlers[job.kind]
+    names = [name for name, function in steps]
+
+    # Carry on from the step it had reached
+    start = names.index(doc["step"]) if doc.get("step") in names else 0
+
+    try:
+        for name, function in steps[start:]:
+            job.step = name
+            job.checkpoint()
+            function(job, **job.params)
+
+        _jobs().update_one({"_id": job.id}, {"$set": {"status": DONE, "step": None, "error": None, "finished_at": _now(), "updated_at": _now()}})
+
+    except Exception as e:
+        # Tried again later (waiting longer each time), unless it keeps failing
+        attempts = doc.get("attempts", 1)
+        failed = attempts >= maxAttempts
+        _jobs().update_one({"_id": job.id}, {"$set": {
+            "status": FAILED if failed else PENDING,
+            "error": str(e),
+            "traceback": traceback.format_exc(),
+            "retry_at": _now() + datetime.timedelta(seconds=pollSeconds * 2 ** attempts),
+            "finished_at": _now() if failed else None,
+            "updated_at": _now()
+        }})
+
+def run_pending():
+    ''' Runs jobs until there are none left to claim, returns how many were run '''
+    count = 0
+    while True:
+        doc = _claim()
+        if doc is None:
+            return count
+        _run(doc)
+        count += 1
+
+def _runner_loop():
+    while True:
+        _wake.clear()
+        try:
+            run_pending()
+        except Exception:
+            pass # mongoDB is down, try again on the next poll
+        _wake.wait(pollSeconds)
+
+def _ensure_started():
+    ''' Starts the runner thread once per process, forked workers start their own '''
+    global _startedPid
+    if _startedPid == os.getpid():
+        return
+
+    with _lock:
+        if _startedPid == os.getpid():
+            return
+        _startedPid = os.getpid()
+
+    threading.Thread(target=_runner_loop, name="job-runner", daemon=True).start()
+
+def init_app(app):
+    ''' Starts the runner with the first request, so jobs left by a crashed worker are picked up without waiting for a new one '''
+
+    @app.before_request
+    def start_job_runner():
+        _ensure_started()
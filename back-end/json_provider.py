@@ -0,0 +1,62 @@
+''' This is the JSON provider for the flask app, jsonify (and request.get_json) go through it
+
+    The endpoints used to walk every document they returned, turning _id into a string and dates into isoformat() strings,
+    before the standard library encoder ran. Now the provider does it as part of encoding:
+        1) ObjectId becomes its string
+        2) datetime and date become isoformat() strings, the same as the old loops (not flask's default HTTP date format)
+        3) bytes become base64
+        4) If orjson is installed it does the encoding (much faster), otherwise the standard library is used with the same rules
+
+    Benchmark (a 1000 post feed, old loop + standard library vs this provider):
+        python -m benchmarks.json_feed
+'''
+
+### --- IMPORTS --- ###
+from flask.json.provider import DefaultJSONProvider
+from bson import ObjectId
+import base64, datetime, json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None # optional, pip install orjson
+
+
+### --- TYPES --- ###
+def default(value):
+    ''' How the types JSON doesn't have are encoded, anything else is left to flask (Decimal, UUID, dataclasses) '''
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        return base64.b64encode(bytes(value)).decode("ascii")
+    return DefaultJSONProvider.default(value)
+
+
+class AlchemaxJSONProvider(DefaultJSONProvider):
+    ''' DefaultJSONProvider with the types above, encoded with orjson when it's available '''
+
+    default = staticmethod(default)
+
+    def dumps(self, obj, **kwargs):
+        # jsonify only ever passes indent or separators, anything else goes to the standard library
+        if orjson is None or set(kwargs) - {"indent", "separators"}:
+            return super().dumps(obj, **kwargs)
+
+        option = orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if kwargs.get("indent"):
+            option |= orjson.OPT_INDENT_2
+
+        return orjson.dumps(obj, default=default, option=option).decode("UTF-8")
+
+    def loads(self, s, **kwargs):
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+
+def init_app(app):
+    app.json = AlchemaxJSONProvider(app)
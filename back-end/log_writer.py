@@ -0,0 +1,164 @@
+''' This is used for writing the control logs (the logs collection) without making the user wait on it
+
+    Handlers used to call controlLogs.insert_one() directly, sometimes several times a request, for logs nobody reads in the request.
+    Now:
+        1) Handlers call enqueue(logsMessage), which just puts it on a bounded in-memory queue
+        2) A writer thread takes them off the queue and writes them with insert_many, once it has a full batch or the flush interval passes
+        3) The writes use a low write concern (w=0 by default), as waiting for an acknowledgement on a log isn't worth it
+        4) When the process shuts down the writer is stopped (it writes the batch it was holding first) and whatever is
+           left on the queue is written
+        5) If the queue is full the log is dropped rather than blocking the request, stats() shows how many were dropped
+'''
+
+### --- IMPORTS --- ###
+from pymongo import WriteConcern
+import atexit, os, queue, threading, time
+import globals
+
+### --- SETTINGS --- ###
+queueSize = int(os.environ.get("ALCHEMAX_LOG_QUEUE_SIZE", 10000))
+batchSize = int(os.environ.get("ALCHEMAX_LOG_BATCH_SIZE", 200))
+flushInterval = float(os.environ.get("ALCHEMAX_LOG_FLUSH_SECONDS", 1))
+writeConcern = int(os.environ.get("ALCHEMAX_LOG_WRITE_CONCERN", 0)) # 0 = unacknowledged, 1 = primary acknowledged
+
+### --- STATE --- ###
+_queue = queue.Queue(maxsize=queueSize)
+_lock = threading.Lock()
+_flushLock = threading.Lock()
+_stats = {
+    "enqueued" : 0,
+    "written" : 0,
+    "dropped" : 0, # queue was full, the log was thrown away
+    "failed" : 0, # insert_many raised, the batch was lost
+    "flushes" : 0,
+    "queue_high_water" : 0 # the most logs sat on the queue at once, shows how close we get to dropping
+}
+_startedPid = None
+_writer = None
+_stop = object() # put on the queue to tell the writer to finish its batch and exit
+
+
+### --- WRITER --- ###
+def _collection():
+    return globals.db.logs.with_options(write_concern=WriteConcern(w=writeConcern))
+
+def _count(key, amount=1):
+    with _lock:
+        _stats[key] += amount
+
+def _write(batch):
+    if not batch:
+        return
+    try:
+        _collection().insert_many(batch, ordered=False)
+        _count("written", len(batch))
+    except Exception:
+        _count("failed", len(batch)) # mongo is down, not worth failing anything else over a log
+    _count("flushes")
+
+def flush():
+    ''' Writes everything that is currently on the queue '''
+    with _flushLock:
+        while True:
+            batch = []
+            while len(batch) < batchSize:
+                try:
+                    logsMessage = _queue.get_nowait()
+                except queue.Empty:
+                    break
+                if logsMessage is not _stop:
+                    batch.append(logsMessage)
+            if not batch:
+                return
+            _write(batch)
+
+def _writer_loop():
+    while True:
+        # Wait for the first log, then keep taking them until the batch is full or the flush interval is up
+        logsMessage = _queue.get()
+        if logsMessage is _stop:
+            return
+        batch = [logsMessage]
+        deadline = time.monotonic() + flushInterval
+        stopping = False
+
+        while len(batch) < batchSize:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                logsMessage = _queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if logsMessage is _stop:
+                stopping = True
+                break
+            batch.append(logsMessage)
+
+        with _flushLock:
+            _write(batch)
+        if stopping:
+            return
+
+def _ensure_started():
+    ''' Starts the writer thread once per process, forked workers start their own '''
+    global _startedPid, _queue, _writer
+
+    if _startedPid == os.getpid():
+        return
+
+    with _lock:
+        if _startedPid == os.getpid():
+            return
+        if _startedPid is not None:
+            _queue = queue.Queue(maxsize=queueSize) # the parents logs are the parents problem
+        _startedPid = os.getpid()
+
+    _writer = threading.Thread(target=_writer_loop, name="control-log-writer", daemon=True)
+    _writer.start()
+
+
+### --- PUBLIC FUNCTIONS --- ###
+def enqueue(logsMessage):
+    ''' Queues a control log to be written, never blocks the request '''
+    _ensure_started()
+
+    try:
+        _queue.put_nowait(logsMessage)
+    except queue.Full:
+        _count("dropped")
+        return False
+
+    _count("enqueued")
+    depth = _queue.qsize()
+    with _lock:
+        if depth > _stats["queue_high_water"]:
+            _stats["queue_high_water"] = depth
+    return True
+
+def stats():
+    ''' Counters for the health endpoint '''
+    with _lock:
+        current = dict(_stats)
+    current["queue_depth"] = _queue.qsize()
+    current["queue_size"] = queueSize
+    return current
+
+def shutdown(timeout=None):
+    ''' Stops the writer, which writes the batch it is holding, then writes whatever is left on the queue '''
+    global _startedPid
+    writer = _writer
+    timeout = flushInterval + 5 if timeout is None else timeout
+
+    if _startedPid == os.getpid() and writer is not None and writer.is_alive():
+        try:
+            _queue.put(_stop, timeout=timeout)
+            writer.join(timeout)
+        except queue.Full:
+            pass # the writer is busy emptying it, flush() below helps
+        _startedPid = None # a log enqueued after this starts a new writer
+
+    flush()
+
+# Drain what is left when the process exits, including the batch the writer was holding
+atexit.register(shutdown)
@@ -0,0 +1,86 @@
+''' This is the memberships collection, one document per user per group: {group_id, user_id, role}
+
+    The users memberOf and ownerOf arrays are still what the principal (see principal.py) caches and what the home feed reads,
+    this is the other way round, for checking one user against one group without reading the user document:
+        1) The unique (group_id, user_id) index answers is_member() on its own, the lookup is covered (no document is read)
+        2) The (user_id) index is for deleting an account
+        3) role is "owner" for the group owner and "member" for everyone else, so is_member() is true for both,
+           the same as principal.in_group()
+
+    Every write to memberOf/ownerOf writes here as well (join, leave, accept, create_group and the delete jobs in cascades.py).
+    Users who joined groups before this was added need their memberships filled in once (safe to run again, it only adds):
+        flask --app app backfill-memberships
+'''
+
+### --- IMPORTS --- ###
+from pymongo import UpdateOne
+from pymongo.errors import DuplicateKeyError
+import click
+import globals, indexes
+
+### --- INDEXES --- ###
+indexes.register("memberships", [("group_id", 1), ("user_id", 1)], unique=True) # is_member, and a groups members
+indexes.register("memberships", [("user_id", 1)]) # a users memberships
+indexes.register_query("membership check", "memberships", {"group_id": "group-1", "user_id": "user-1"},
+                       seed=[{"group_id": "group-" + str(i % 5), "user_id": "user-" + str(i), "role": "member"} for i in range(50)])
+
+### --- GLOBAL VARIABLES --- ###
+_covered = {"_id": 0, "group_id": 1, "user_id": 1} # only fields in the index, so the lookup never reads the document
+
+
+### --- WRITES --- ###
+def add(user_id, group_id, role="member"):
+    ''' Adds the user to the group, adding them again keeps the one membership (an owner stays an owner) '''
+    try:
+        globals.db.memberships.update_one({"group_id": str(group_id), "user_id": str(user_id)},
+                                          {"$setOnInsert": {"role": role}}, upsert=True)
+    except DuplicateKeyError:
+        pass # the same add at the same time, it is there either way
+
+def remove(user_id, group_id):
+    globals.db.memberships.delete_one({"group_id": str(group_id), "user_id": str(user_id)})
+
+def remove_groups(*group_ids):
+    ''' Every membership of the groups, the owners as well '''
+    if group_ids:
+        globals.db.memberships.delete_many({"group_id": {"$in": [str(group_id) for group_id in group_ids]}})
+
+def remove_user(user_id):
+    globals.db.memberships.delete_many({"user_id": str(user_id)})
+
+
+### --- READS --- ###
+def is_member(user_id, group_id):
+    ''' Is the user in the group (as a member or the owner), read fresh, one covered index lookup '''
+    return globals.db.memberships.find_one({"group_id": str(group_id), "user_id": str(user_id)}, _covered) is not None
+
+
+### --- BACKFILL --- ###
+def backfill(batchSize=500):
+    ''' Adds a membership for every group in a users memberOf and ownerOf, returns how many were added '''
+    added = 0
+    batch = []
+
+    def flush():
+        nonlocal added
+        if batch:
+            added += globals.db.memberships.bulk_write(batch, ordered=False).upserted_count
+            batch.clear()
+
+    for user in globals.db.users.find({"$or": [{"memberOf.0": {"$exists": True}}, {"ownerOf.0": {"$exists": True}}]},
+                                      {"memberOf": 1, "ownerOf": 1}):
+        user_id = str(user["_id"])
+        for role, field in (("owner", "ownerOf"), ("member", "memberOf")):
+            for group_id in user.get(field, []):
+                batch.append(UpdateOne({"group_id": str(group_id), "user_id": user_id}, {"$setOnInsert": {"role": role}}, upsert=True))
+        if len(batch) >= batchSize:
+            flush()
+    flush()
+    return added
+
+def init_app(app):
+    ''' Adds the backfill-memberships command to the flask cli '''
+
+    @app.cli.command("backfill-memberships")
+    def backfill_memberships_command():
+        click.echo(str(backfill()) + " memberships added")
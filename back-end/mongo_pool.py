@@ -0,0 +1,113 @@
+''' This is the connection pool monitoring for the app client (see globals.get_client)
+
+    pymongo keeps a pool of connections per server, a request that needs one while they are all in use waits in a queue
+    (up to ALCHEMAX_MONGO_WAIT_QUEUE_TIMEOUT_MS). None of that shows anywhere by default, so this listens to the pool events and keeps:
+        1) How long each checkout waited for a connection, p50/p99/max over the last ALCHEMAX_MONGO_POOL_STATS_WINDOW checkouts
+        2) The pool size, connections open and how many of them are in use right now, and how many requests are waiting for one
+        3) Checkouts that failed, by reason (timeout is the pool being too small or the server too slow, connectionError is the network)
+
+    stats() is shown on /api/health/details, and benchmarks/pool_size.py uses it to compare pool sizes
+'''
+
+### --- IMPORTS --- ###
+from collections import Counter, deque
+from pymongo import monitoring
+import os, threading
+
+### --- SETTINGS --- ###
+window = int(os.environ.get("ALCHEMAX_MONGO_POOL_STATS_WINDOW", 1000)) # checkout waits kept for the percentiles
+
+### --- STATE --- ###
+_lock = threading.Lock()
+
+
+def _empty():
+    return {
+        "checkouts" : 0,
+        "failures" : Counter(),
+        "waits" : deque(maxlen=window), # milliseconds
+        "max_wait" : 0.0,
+        "open" : 0,
+        "in_use" : 0,
+        "waiting" : 0,
+        "cleared" : 0
+    }
+
+_stats = _empty()
+
+
+def reset():
+    ''' Starts counting again, for a new client (a forked worker) or a new benchmark run '''
+    global _stats
+    with _lock:
+        _stats = _empty()
+
+def _percentile(ordered, p):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))] if ordered else 0.0
+
+def stats():
+    with _lock:
+        waits = sorted(_stats["waits"])
+        return {
+            "connections_open" : _stats["open"],
+            "connections_in_use" : _stats["in_use"],
+            "waiting_for_connection" : _stats["waiting"],
+            "checkouts" : _stats["checkouts"],
+            "checkout_wait_ms" : {"p50" : _percentile(waits, 50), "p99" : _percentile(waits, 99), "max" : _stats["max_wait"]},
+            "checkout_failures" : sum(_stats["failures"].values()),
+            "checkout_failures_by_reason" : dict(_stats["failures"]),
+            "pool_cleared" : _stats["cleared"]
+        }
+
+
+### --- LISTENER --- ###
+class PoolListener(monitoring.ConnectionPoolListener):
+    ''' Passed to the MongoClient as an event listener, every method is called on the thread doing the checkout so it stays cheap '''
+
+    def connection_check_out_started(self, event):
+        with _lock:
+            _stats["waiting"] += 1
+
+    def connection_checked_out(self, event):
+        waited = (event.duration or 0) * 1000
+        with _lock:
+            _stats["waiting"] -= 1
+            _stats["in_use"] += 1
+            _stats["checkouts"] += 1
+            _stats["waits"].append(waited)
+            _stats["max_wait"] = max(_stats["max_wait"], waited)
+
+    def connection_check_out_failed(self, event):
+        with _lock:
+            _stats["waiting"] -= 1
+            _stats["failures"][event.reason] += 1
+
+    def connection_checked_in(self, event):
+        with _lock:
+            _stats["in_use"] -= 1
+
+    def connection_created(self, event):
+        with _lock:
+            _stats["open"] += 1
+
+    def connection_closed(self, event):
+        with _lock:
+            _stats["open"] -= 1
+
+    def pool_cleared(self, event):
+        with _lock:
+            _stats["cleared"] += 1
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_ready(self, event):
+        pass
+
+listener = PoolListener()
@@ -0,0 +1,92 @@
+''' This is used for keyset (cursor) pagination, shared by any endpoint that returns a long list
+
+    skip/limit gets slower the further you page, as mongoDB still has to walk past every skipped document.
+    Instead the results are sorted on (field, _id) and the next page starts after the last document of the previous page:
+        1) The client asks for a page with ?limit=
+        2) The response has a next_cursor (an opaque string), or None if there are no more pages
+        3) The client sends it back as ?cursor= to get the next page
+
+    Page 10 costs the same as page 1, and new documents being added don't shift the pages that have already been read
+'''
+
+### --- IMPORTS --- ###
+from bson import ObjectId
+import base64, datetime, json
+
+### --- SETTINGS --- ###
+defaultLimit = 20
+maximumLimit = 100
+
+
+class InvalidCursor(ValueError):
+    ''' Raised when the cursor sent by the client can't be read '''
+    pass
+
+
+### --- LIMIT --- ###
+def page_limit(args, default=defaultLimit, maximum=maximumLimit):
+    ''' Reads ?limit= from the request args, clamped between 1 and maximum '''
+    try:
+        limit = int(args.get("limit", default))
+    except (TypeError, ValueError):
+        limit = default
+    return max(1, min(limit, maximum))
+
+
+### --- CURSORS --- ###
+def encode_cursor(doc, field):
+    ''' Builds the cursor that points just after doc, for a list sorted on (field, _id) '''
+    value = doc.get(field)
+
+    if isinstance(value, datetime.datetime):
+        payload = {"t": "date", "v": value.isoformat()}
+    else:
+        payload = {"t": "str", "v": value}
+    payload["i"] = str(doc["_id"])
+
+    return base64.urlsafe_b64encode(json.dumps(payload, separators=(",", ":")).encode("UTF-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor):
+    ''' Returns (value, _id) from a cursor made by encode_cursor, raises InvalidCursor if it has been tampered with '''
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+
+        value = payload["v"]
+        if payload["t"] == "date":
+            value = datetime.datetime.fromisoformat(value)
+        elif payload["t"] != "str":
+            raise ValueError("unknown cursor type")
+
+        return value, ObjectId(payload["i"])
+
+    except Exception as e:
+        raise InvalidCursor("Invalid cursor") from e
+
+def keyset_filter(field, cursor, descending=True, idField="_id"):
+    ''' The extra filter that starts the page after the cursor, empty if this is the first page.
+        idField is the tie breaker field, for collections that hold a reference to the document instead of the document itself
+    '''
+    if not cursor:
+        return {}
+
+    value, lastId = decode_cursor(cursor)
+    op = "$lt" if descending else "$gt"
+
+    return {"$or": [
+        {field: {op: value}},
+        {field: value, idField: {op: lastId}}
+    ]}
+
+def keyset_sort(field, descending=True, idField="_id"):
+    ''' The sort that goes with keyset_filter, _id breaks ties so the order is always the same '''
+    direction = -1 if descending else 1
+    return [(field, direction), (idField, direction)]
+
+def next_page(docs, field, limit):
+    ''' Takes the results of a query run with limit + 1, returns (the page, next_cursor) '''
+    if len(docs) <= limit:
+        return docs, None
+
+    page = docs[:limit]
+    return page, encode_cursor(page[-1], field)
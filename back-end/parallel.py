@@ -0,0 +1,61 @@
+''' This is used to run independent mongoDB lookups at the same time inside one request
+
+    Most endpoints make a few queries one after the other even when none of them needs the others result
+    (the user and the post in view_one_post, the usernames and group names for a feed). gather() runs them together on a
+    small thread pool, so the request waits for the slowest one instead of all of them added up.
+
+    pymongo releases the GIL while it waits on the network, so threads overlap the round trips just like coroutines would,
+    without the blueprints having to change to async
+'''
+
+### --- IMPORTS --- ###
+from concurrent.futures import ThreadPoolExecutor
+import os, threading
+
+### --- SETTINGS --- ###
+poolSize = int(os.environ.get("ALCHEMAX_PARALLEL_THREADS", 8))
+
+### --- POOL --- ###
+_lock = threading.Lock()
+_pool = None
+_poolPid = None
+_local = threading.local()
+
+
+def _get_pool():
+    ''' The pool for this process, made on first use so forked workers get their own '''
+    global _pool, _poolPid
+    if _poolPid != os.getpid():
+        with _lock:
+            if _poolPid != os.getpid():
+                _pool = ThreadPoolExecutor(max_workers=poolSize, thread_name_prefix="parallel")
+                _poolPid = os.getpid()
+    return _pool
+
+def _run(call):
+    _local.inPool = True
+    try:
+        return call()
+    finally:
+        _local.inPool = False
+
+
+def gather(*calls):
+    ''' Runs each call (a function with no arguments) at the same time, returns their results in the same order.
+        If any of them raises, the exception is raised here once they have all finished
+    '''
+    # A gather from inside the pool runs in order, so the pool can't end up waiting on itself
+    if len(calls) < 2 or getattr(_local, "inPool", False):
+        return [call() for call in calls]
+
+    # The first call runs on this thread, it would only be waiting otherwise
+    futures = [_get_pool().submit(_run, call) for call in calls[1:]]
+    try:
+        first = calls[0]()
+    finally:
+        others = [future.exception() for future in futures] # waits for all of them
+
+    for error in others:
+        if error is not None:
+            raise error
+    return [first] + [future.result() for future in futures]
@@ -0,0 +1,108 @@
+''' This is the current user for a request, jwt_required puts one on g (g.principal)
+
+    Most endpoints start by loading the users memberOf and ownerOf to check they are in the group, and some loaded the
+    user again for something else. The principal loads it once, the first time it is asked, and:
+        1) The user document (username, memberOf, ownerOf) is cached per worker for ALCHEMAX_PRINCIPAL_TTL_SECONDS,
+           keyed by user id, so a user clicking around doesn't reload it on every request either
+        2) Anything that changes a users memberships (join, leave, accept, create or delete a group, delete an account)
+           calls invalidate() for that user, other workers pick the change up once their entry expires
+        3) Groups that are being deleted are left out (see tombstones.py)
+
+    The cache is only for deciding what someone can see. Writes (posting, editing, deleting, commenting) check with
+    member_now() instead, which asks the memberships collection (see memberships.py) on every call, so someone who has just
+    left or been removed can't write to the group while their cached entry (here or in another worker) is still fresh
+'''
+
+### --- IMPORTS --- ###
+from collections import OrderedDict
+from bson import ObjectId
+import os, threading, time
+import globals, tombstones, memberships
+
+### --- SETTINGS --- ###
+cacheSize = int(os.environ.get("ALCHEMAX_PRINCIPAL_CACHE_SIZE", 10000))
+cacheTtl = float(os.environ.get("ALCHEMAX_PRINCIPAL_TTL_SECONDS", 5))
+
+### --- CACHE --- ###
+_entries = OrderedDict() # user id -> (user document or None, expires at)
+_lock = threading.Lock()
+_hits = 0
+_misses = 0
+
+
+def _load(user_id):
+    ''' The users membership document, from the cache if it is still fresh '''
+    global _hits, _misses
+    now = time.monotonic()
+
+    with _lock:
+        entry = _entries.get(user_id)
+        if entry is not None and entry[1] > now:
+            _entries.move_to_end(user_id)
+            _hits += 1
+            return entry[0]
+        _misses += 1
+
+    user = None
+    if ObjectId.is_valid(user_id):
+        user = globals.db.users.find_one({"_id": ObjectId(user_id)}, {"username": 1, "memberOf": 1, "ownerOf": 1})
+
+    with _lock:
+        _entries[user_id] = (user, time.monotonic() + cacheTtl)
+        _entries.move_to_end(user_id)
+        while len(_entries) > cacheSize:
+            _entries.popitem(last=False)
+    return user
+
+def invalidate(*user_ids):
+    with _lock:
+        for user_id in user_ids:
+            _entries.pop(str(user_id), None)
+
+def stats():
+    with _lock:
+        return {"size": len(_entries), "hits": _hits, "misses": _misses}
+
+
+### --- PRINCIPAL --- ###
+class Principal:
+    ''' The current user, nothing is read until it is needed '''
+
+    def __init__(self, user_id, username=None):
+        self.user_id = str(user_id)
+        self._username = username
+        self._user = None
+        self._loaded = False
+
+    def _details(self):
+        if not self._loaded:
+            self._user = _load(self.user_id)
+            self._loaded = True
+        return self._user or {}
+
+    @property
+    def exists(self):
+        return bool(self._details())
+
+    @property
+    def username(self):
+        return self._username or self._details().get("username")
+
+    @property
+    def member_of(self):
+        return tombstones.live_groups(self._details().get("memberOf", []))
+
+    @property
+    def owner_of(self):
+        return tombstones.live_groups(self._details().get("ownerOf", []))
+
+    def groups(self):
+        ''' Every group the user is in or owns, no duplicates '''
+        return list(dict.fromkeys(self.member_of + self.owner_of))
+
+    def in_group(self, group_id):
+        return group_id in self.member_of or group_id in self.owner_of
+
+    def member_now(self, group_id):
+        ''' in_group() read fresh, one covered index lookup, for writes '''
+        return bool(tombstones.live_groups([group_id])) and memberships.is_member(self.user_id, group_id)
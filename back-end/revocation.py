@@ -0,0 +1,139 @@
+''' This is used to keep track of revoked (logged out) session tokens without asking mongoDB on every request
+
+    Each worker keeps a set of token fingerprints (sha256 of the token) along with when the token expires.
+        1) The set is loaded from the blacklist collection the first time it is needed
+        2) A background thread then only grabs the blacklist documents added since the last refresh, plus an overlap of
+           ALCHEMAX_REVOCATION_OVERLAP_SECONDS before it. ObjectIds are made by each worker (time, a per process random
+           part and a counter), so two logouts in the same second can be committed in the opposite order to their ids,
+           going from the highest id seen would skip one of them for good
+        3) Logging out adds the fingerprint straight away, so the worker that handled the logout never has to wait
+        4) Once a token's exp has passed it is removed from the set, the TTL index on blacklist does the same in mongoDB
+
+    Checking a token that isn't revoked (pretty much every request) never touches the database
+'''
+
+### --- IMPORTS --- ###
+from bson import ObjectId
+import datetime, hashlib, os, threading, time
+import globals, indexes
+
+### --- SETTINGS --- ###
+refreshInterval = float(os.environ.get("ALCHEMAX_REVOCATION_REFRESH_SECONDS", 5))
+overlapSeconds = float(os.environ.get("ALCHEMAX_REVOCATION_OVERLAP_SECONDS", 60)) # re-read this far back, covers slow commits and clock drift
+
+### --- INDEXES --- ###
+# TTL index so mongoDB removes blacklisted tokens once they have expired
+indexes.register("blacklist", [("expires_at", 1)], expireAfterSeconds=0)
+
+### --- STATE --- ###
+_lock = threading.Lock()
+_revoked = {} # fingerprint -> expiry datetime (UTC)
+_lastRefresh = None # when the last refresh started (UTC), the next one reads from overlapSeconds before it
+_startedPid = None # the pid that loaded the set, so forked workers load their own
+
+
+### --- HELPERS --- ###
+def fingerprint(token):
+    ''' Returns the sha256 hex digest of the token, this is what gets stored rather than the token itself '''
+    if isinstance(token, str):
+        token = token.encode("UTF-8")
+    return hashlib.sha256(token).hexdigest()
+
+def _utcnow():
+    return datetime.datetime.now(datetime.UTC).replace(tzinfo=None) # mongoDB hands back naive UTC datetimes
+
+def _expiry_from_claims(claims):
+    ''' Turns the exp claim into a naive UTC datetime, defaults to 60 mins (the session length) if it is missing '''
+    exp = claims.get("exp") if claims else None
+    if exp is None:
+        return _utcnow() + datetime.timedelta(minutes=60)
+    return datetime.datetime.fromtimestamp(exp, datetime.UTC).replace(tzinfo=None)
+
+
+### --- LOADING FROM THE BLACKLIST --- ###
+def _load(query):
+    ''' Pulls blacklist documents matching query into the local set, loading one twice does no harm '''
+    cursor = globals.db.blacklist.find(query, {"token": 1, "fingerprint": 1, "expires_at": 1})
+
+    for doc in cursor:
+        # Older documents only have the raw token stored
+        tokenFingerprint = doc.get("fingerprint") or fingerprint(doc.get("token", ""))
+        expiresAt = doc.get("expires_at") or (_utcnow() + datetime.timedelta(minutes=60))
+
+        with _lock:
+            _revoked[tokenFingerprint] = expiresAt
+
+def _prune():
+    ''' Removes tokens that have expired, they would fail the jwt exp check anyway '''
+    now = _utcnow()
+    with _lock:
+        for tokenFingerprint in [f for f, expiresAt in _revoked.items() if expiresAt <= now]:
+            del _revoked[tokenFingerprint]
+
+def refresh():
+    ''' Grabs any blacklist documents added since the last refresh (by this worker or any other) '''
+    global _lastRefresh
+    startedAt = _utcnow()
+
+    if _lastRefresh is None:
+        _load({})
+    else:
+        _load({"_id": {"$gte": ObjectId.from_datetime(_lastRefresh - datetime.timedelta(seconds=overlapSeconds))}})
+
+    _lastRefresh = startedAt
+    _prune()
+
+def _refresh_loop():
+    while True:
+        time.sleep(refreshInterval)
+        try:
+            refresh()
+        except Exception:
+            pass # mongo is down, we keep what we have and try again next time
+
+def _ensure_started():
+    ''' Does the initial load and starts the refresh thread, once per process (workers forked after loading get their own) '''
+    global _startedPid, _revoked, _lastRefresh
+
+    if _startedPid == os.getpid():
+        return
+
+    with _lock:
+        if _startedPid == os.getpid():
+            return
+        if _startedPid is not None:
+            _revoked, _lastRefresh = {}, None # inherited from the parent process, start again
+
+        _startedPid = os.getpid()
+
+    try:
+        refresh()
+    except Exception:
+        pass # the refresh thread will pick it up once mongo is back
+
+    threading.Thread(target=_refresh_loop, name="token-revocation-refresh", daemon=True).start()
+
+
+### --- PUBLIC FUNCTIONS --- ###
+def is_revoked(token):
+    ''' Returns True if the token has been logged out '''
+    _ensure_started()
+
+    expiresAt = _revoked.get(fingerprint(token))
+    return expiresAt is not None and expiresAt > _utcnow()
+
+def revoke(token, claims=None):
+    ''' Used by logout, adds the token to the blacklist collection and to this workers set straight away '''
+    _ensure_started()
+
+    tokenFingerprint = fingerprint(token)
+    expiresAt = _expiry_from_claims(claims)
+
+    with _lock:
+        _revoked[tokenFingerprint] = expiresAt
+
+    # Only the fingerprint is stored, no point keeping usable tokens lying around in the database
+    globals.db.blacklist.insert_one({
+        "fingerprint" : tokenFingerprint,
+        "expires_at" : expiresAt # the TTL index removes the document once this time has passed
+    })
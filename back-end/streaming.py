@@ -0,0 +1,99 @@
+''' This is the streaming mode for the big feeds, /api/home?stream=1 and /api/groups/<group_id>?stream=1
+
+    Normally a feed is read into a list, the names are added and the whole thing is encoded in one go, so a request holds
+    every post (and the full JSON string) in memory at once. In streaming mode:
+        1) The posts are read from the mongoDB cursor a batch at a time (ALCHEMAX_STREAM_BATCH)
+        2) Each batch gets its names added (one cached lookup per batch) and is encoded straight away
+        3) The JSON is sent in chunks as it is encoded, so the first posts reach the client before the last ones are read
+
+    As memory no longer grows with the page, a streamed page can be up to ALCHEMAX_STREAM_MAX_LIMIT posts instead of 100.
+    The JSON is the same shape as the normal response, the feed list is just written out a piece at a time.
+    The values are encoded by the apps JSON provider, so ObjectIds and dates come out the same way
+'''
+
+### --- IMPORTS --- ###
+from flask import Response, current_app, stream_with_context
+import os
+import pagination
+
+### --- SETTINGS --- ###
+batchSize = int(os.environ.get("ALCHEMAX_STREAM_BATCH", 100)) # posts read and encoded together
+chunkSize = 16 * 1024 # bytes of JSON gathered before sending
+maximumLimit = int(os.environ.get("ALCHEMAX_STREAM_MAX_LIMIT", 1000)) # largest ?limit= when streaming
+
+
+def requested(args):
+    ''' Whether the client asked for the streaming mode with ?stream=1 '''
+    return args.get("stream") in ("1", "true")
+
+def page_limit(args):
+    ''' pagination.page_limit, with the bigger maximum if the page is being streamed '''
+    return pagination.page_limit(args, maximum=maximumLimit if requested(args) else pagination.maximumLimit)
+
+
+class FeedPage:
+    ''' One page of a feed read from a cursor run with limit + 1, works out next_cursor once it has been read '''
+
+    def __init__(self, cursor, field, limit, decorate=None):
+        self.cursor = cursor.batch_size(min(batchSize, limit + 1))
+        self.field = field
+        self.limit = limit
+        self.decorate = decorate # called with each batch, e.g. to add the names
+        self.next_cursor = None
+
+    def __iter__(self):
+        batch = []
+        sent = 0
+        last = None
+
+        for doc in self.cursor:
+            if sent + len(batch) == self.limit:
+                # The extra document, so there is another page
+                self.next_cursor = pagination.encode_cursor(last, self.field)
+                break
+
+            batch.append(doc)
+            last = doc
+            if len(batch) == batchSize:
+                yield from self._send(batch)
+                sent += len(batch)
+                batch = []
+
+        yield from self._send(batch)
+        self.cursor.close()
+
+    def _send(self, batch):
+        if batch and self.decorate:
+            self.decorate(batch)
+        return batch
+
+
+def _chunks(head, listKey, docs, tail):
+    dumps = current_app.json.dumps
+    buffer = []
+    size = 0
+
+    opening = dumps(head)[:-1] # the head object without its closing brace
+    buffer.append(opening + ("," if head else "") + dumps(listKey) + ":[")
+
+    first = True
+    for doc in docs:
+        encoded = ("" if first else ",") + dumps(doc)
+        first = False
+        buffer.append(encoded)
+        size += len(encoded)
+
+        if size >= chunkSize:
+            yield "".join(buffer)
+            buffer = []
+            size = 0
+
+    buffer.append("]")
+    for key, value in tail().items():
+        buffer.append("," + dumps(key) + ":" + dumps(value))
+    buffer.append("}\n")
+    yield "".join(buffer)
+
+def object_response(head, listKey, docs, tail=dict, status=200):
+    ''' Streams {**head, listKey: [...docs], **tail()}, tail is called after the last doc has been sent (for next_cursor) '''
+    return Response(stream_with_context(_chunks(head, listKey, docs, tail)), status=status, mimetype=current_app.json.mimetype)
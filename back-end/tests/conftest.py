@@ -0,0 +1,127 @@
+''' Shared fixtures for the back end tests
+
+    Run from the back-end folder:
+        python -m pytest -q
+
+    The tests use mongomock instead of a real mongoDB, globals.get_client() is pointed at it for each test.
+    The health monitor is never started, so the circuit breaker stays closed and nothing tries to reach a real server
+'''
+
+### --- IMPORTS --- ###
+import collections, datetime, os, sys, threading
+import jwt, mongomock, pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("ALCHEMAX_SECRET_KEY", "test-secret-key-at-least-32-bytes-long")
+
+import globals, health, jobs, log_writer
+
+
+### --- MONGOMOCK --- ###
+# pymongo 4.11+ hands sort= to the bulk builder for UpdateOne and ReplaceOne (bulk_write), which mongomock 4.3 doesn't take yet
+def _without_sort(add):
+    def added(*args, sort=None, **kwargs):
+        return add(*args, **kwargs)
+    return added
+
+for _name in ("add_update", "add_replace"):
+    setattr(mongomock.collection.BulkOperationBuilder, _name, _without_sort(getattr(mongomock.collection.BulkOperationBuilder, _name)))
+
+
+### --- COMMAND COUNTING --- ###
+''' mongomock doesn't send command events, so these wrap it and count each call that would be a round trip to mongoDB
+    (the first batch of a find, an aggregate, an update...) by collection and method.
+    mongomock isn't thread safe either, so each of those calls holds one lock, like a server where every command is atomic
+'''
+serverMethods = {"find", "find_one", "aggregate", "count_documents", "estimated_document_count", "distinct",
+                 "insert_one", "insert_many", "update_one", "update_many", "replace_one", "delete_one", "delete_many",
+                 "find_one_and_update", "find_one_and_delete", "bulk_write", "create_index", "command"}
+
+_commandLock = threading.RLock()
+
+class _CountingCollection:
+    def __init__(self, collection, counts):
+        self._collection = collection
+        self._counts = counts
+
+    def __getattr__(self, name):
+        attribute = getattr(self._collection, name)
+        if name not in serverMethods:
+            return attribute
+
+        def counted(*args, **kwargs):
+            with _commandLock:
+                self._counts[self._collection.name + "." + name] += 1
+                return attribute(*args, **kwargs)
+        return counted
+
+    def with_options(self, *args, **kwargs):
+        return _CountingCollection(self._collection.with_options(*args, **kwargs), self._counts)
+
+class _CountingDatabase:
+    def __init__(self, database, counts):
+        self._database = database
+        self._counts = counts
+
+    def __getitem__(self, name):
+        return _CountingCollection(self._database[name], self._counts)
+
+    def __getattr__(self, name):
+        return getattr(self._database, name)
+
+class CountingClient:
+    ''' Wraps a mongomock client, counts is a Counter of "collection.method" '''
+
+    def __init__(self, client):
+        self._client = client
+        self.counts = collections.Counter()
+
+    def __getitem__(self, name):
+        return _CountingDatabase(self._client[name], self.counts)
+
+    def __getattr__(self, name):
+        return getattr(self._client, name)
+
+
+### --- FIXTURES --- ###
+@pytest.fixture
+def mongo(monkeypatch):
+    ''' A fresh mongomock client for the test (wrapped so commands can be counted), returns globals.db '''
+    monkeypatch.setattr(globals, "_client", CountingClient(mongomock.MongoClient()))
+    monkeypatch.setattr(globals, "_clientPid", os.getpid())
+    monkeypatch.setattr(health, "_startedPid", os.getpid()) # no monitor thread, mongo is always "up"
+    monkeypatch.setattr(jobs, "_startedPid", os.getpid()) # no runner thread, a test runs its jobs itself with run_pending
+    yield globals.db
+    log_writer.shutdown(timeout=1) # a writer started by this test would otherwise read the next tests queue
+
+@pytest.fixture
+def commands(mongo):
+    ''' The Counter of commands sent to mongoDB, clear() it before the part being measured '''
+    return globals._client.counts
+
+@pytest.fixture
+def app(mongo):
+    from app import create_app
+    app = create_app()
+    app.config["TESTING"] = True
+    return app
+
+@pytest.fixture
+def client(app):
+    return app.test_client()
+
+
+### --- HELPERS --- ###
+def make_user(db, username, **fields):
+    ''' Inserts a user document, returns its id as a string '''
+    user = {"username": username, "email": username + "@example.com", "admin": False, "memberOf": [], "ownerOf": [], **fields}
+    return str(db.users.insert_one(user).inserted_id)
+
+def token_for(user_id, username, admin=False):
+    ''' A signed session token, the same as /api/login hands out '''
+    return jwt.encode({
+        "user_db_id": user_id,
+        "user": username,
+        "admin": admin,
+        "exp": datetime.datetime.now(datetime.UTC) + datetime.timedelta(minutes=60)
+    }, globals.secret_key, algorithm="HS256")
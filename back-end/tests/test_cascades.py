@@ -0,0 +1,95 @@
+''' cascades.py, the delete_account and delete_group jobs, and the endpoints that start them '''
+
+import os
+import pytest
+from bson import ObjectId
+import cascades, jobs, principal
+from conftest import make_user, token_for
+
+
+@pytest.fixture(autouse=True)
+def no_runner(monkeypatch):
+    ''' Jobs are run by the test with run_pending, not by a runner thread '''
+    monkeypatch.setattr(jobs, "_startedPid", os.getpid())
+    monkeypatch.setattr(jobs, "pauseSeconds", 0)
+    principal._entries.clear()
+
+
+def _owner_with_group(db):
+    owner_id = make_user(db, "owner")
+    group_id = str(db.groups.insert_one({"group_name": "Sim Racing Club", "group_access": "Public", "group_owner": owner_id,
+                                         "requests": []}).inserted_id)
+    db.users.update_one({"_id": ObjectId(owner_id)}, {"$push": {"ownerOf": group_id}})
+    member_id = make_user(db, "member", memberOf=[group_id])
+    db.posts.insert_one({"group_id": group_id, "creator": member_id, "post_title": "Hello"})
+    return owner_id, group_id, member_id
+
+def _crash(*args):
+    raise RuntimeError("the worker died")
+
+
+### --- DELETE ACCOUNT --- ###
+def test_delete_account_answers_with_the_job(client, mongo):
+    owner_id, group_id, member_id = _owner_with_group(mongo)
+
+    response = client.delete("/api/delete_account", headers={"x-access-token": token_for(owner_id, "owner")})
+    assert response.status_code == 202
+    body = response.get_json()
+    assert body["status_url"] == "http://localhost/api/jobs/" + body["job_id"]
+    assert response.headers["Location"] == body["status_url"]
+
+    assert mongo.users.count_documents({"_id": ObjectId(owner_id)}) == 0
+    assert mongo.groups.find_one({"_id": ObjectId(group_id)})["deleted_at"]
+
+    assert jobs.run_pending() == 1
+    assert mongo.groups.count_documents({}) == 0
+    assert mongo.posts.count_documents({}) == 0
+    assert mongo.users.find_one({"_id": ObjectId(member_id)})["memberOf"] == []
+
+def test_delete_account_saves_the_job_before_deleting_anything(client, mongo, monkeypatch):
+    owner_id, group_id, member_id = _owner_with_group(mongo)
+    with monkeypatch.context() as crashing:
+        crashing.setattr(cascades, "delete_user", _crash)
+        response = client.delete("/api/delete_account", headers={"x-access-token": token_for(owner_id, "owner")})
+    assert response.status_code == 400
+    assert mongo.jobs.count_documents({"kind": "delete_account"}) == 1
+    assert mongo.users.count_documents({"_id": ObjectId(owner_id)}) == 1
+
+    # The job finishes what the request didn't
+    assert jobs.run_pending() == 1
+    assert mongo.jobs.find_one({})["status"] == jobs.DONE
+    assert mongo.users.count_documents({"_id": ObjectId(owner_id)}) == 0
+    assert mongo.groups.count_documents({}) == 0
+
+
+### --- DELETE GROUP --- ###
+def test_delete_group_saves_the_job_before_the_tombstone(client, mongo, monkeypatch):
+    owner_id, group_id, member_id = _owner_with_group(mongo)
+    url = "/api/groups/" + group_id + "/settings/delete_group"
+    with monkeypatch.context() as crashing:
+        crashing.setattr(cascades.tombstones, "tombstone", _crash)
+        response = client.delete(url, headers={"x-access-token": token_for(owner_id, "owner")})
+    assert response.status_code == 503
+    assert mongo.jobs.count_documents({"kind": "delete_group"}) == 1
+    assert "deleted_at" not in mongo.groups.find_one({"_id": ObjectId(group_id)})
+
+    assert jobs.run_pending() == 1
+    assert mongo.groups.count_documents({}) == 0
+    assert mongo.posts.count_documents({}) == 0
+    assert mongo.users.find_one({"_id": ObjectId(owner_id)})["ownerOf"] == []
+    assert mongo.users.find_one({"_id": ObjectId(member_id)})["memberOf"] == []
+
+def test_delete_group_answers_with_the_job(client, mongo):
+    owner_id, group_id, member_id = _owner_with_group(mongo)
+
+    url = "/api/groups/" + group_id + "/settings/delete_group"
+    response = client.delete(url, headers={"x-access-token": token_for(owner_id, "owner")})
+    assert response.status_code == 202
+    assert response.get_json()["status_url"].startswith("http://localhost/api/jobs/")
+    assert mongo.users.find_one({"_id": ObjectId(owner_id)})["ownerOf"] == []
+
+    # Already being deleted
+    assert client.delete(url, headers={"x-access-token": token_for(owner_id, "owner")}).status_code == 404
+
+    assert jobs.run_pending() == 1
+    assert mongo.groups.count_documents({}) == 0
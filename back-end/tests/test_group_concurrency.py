@@ -0,0 +1,114 @@
+''' Joining, leaving and answering requests to join from many threads at once, the groups stay consistent '''
+
+import threading
+from collections import Counter
+import pytest
+from bson import ObjectId
+import principal
+from conftest import make_user, token_for
+
+
+@pytest.fixture(autouse=True)
+def fresh_principals():
+    principal._entries.clear()
+
+
+def _group(db, owner_id, access):
+    group_id = str(db.groups.insert_one({"group_name": "Sim Racing Club", "group_access": access, "group_owner": owner_id,
+                                         "requests": []}).inserted_id)
+    db.users.update_one({"_id": ObjectId(owner_id)}, {"$push": {"ownerOf": group_id}})
+    return group_id
+
+def _headers(user_id, username):
+    return {"x-access-token": token_for(user_id, username)}
+
+def _together(app, calls):
+    ''' Runs each call(client) on its own thread, all starting at once, returns their results in order '''
+    barrier = threading.Barrier(len(calls))
+    results = [None] * len(calls)
+
+    def run(i, call):
+        client = app.test_client()
+        barrier.wait()
+        results[i] = call(client)
+
+    threads = [threading.Thread(target=run, args=(i, call)) for i, call in enumerate(calls)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    return results
+
+
+def test_joins_and_leaves_match_the_membership(app, mongo):
+    owner_id = make_user(mongo, "owner")
+    group_id = _group(mongo, owner_id, "Public")
+    members = [(make_user(mongo, "member-" + str(i)), "member-" + str(i)) for i in range(8)]
+
+    def join_and_leave(user_id, username):
+        def call(client):
+            outcomes = Counter()
+            for _ in range(10):
+                outcomes["join", client.put("/api/" + group_id + "/join", headers=_headers(user_id, username)).status_code] += 1
+                outcomes["leave", client.put("/api/groups/" + group_id + "/leave", headers=_headers(user_id, username)).status_code] += 1
+            return outcomes
+        return call
+
+    # Two threads per user, so every user races themselves as well as everyone else
+    calls = [join_and_leave(user_id, username) for user_id, username in members for _ in range(2)]
+    results = _together(app, calls)
+
+    for i, (user_id, username) in enumerate(members):
+        outcomes = results[2 * i] + results[2 * i + 1]
+        assert outcomes["join", 503] == outcomes["leave", 503] == 0
+        memberOf = mongo.users.find_one({"_id": ObjectId(user_id)})["memberOf"]
+
+        # Every join that worked was undone by exactly one leave that worked, except possibly the last
+        assert memberOf.count(group_id) == outcomes["join", 200] - outcomes["leave", 201]
+        assert memberOf.count(group_id) in (0, 1)
+
+def test_repeated_requests_to_join_are_kept_once(app, mongo):
+    owner_id = make_user(mongo, "owner")
+    group_id = _group(mongo, owner_id, "Private")
+    user_id = make_user(mongo, "hopeful")
+
+    results = _together(app, [lambda client: client.put("/api/" + group_id + "/join", headers=_headers(user_id, "hopeful")).status_code] * 10)
+
+    assert sorted(results) == [200] + [404] * 9
+    assert mongo.groups.find_one({"_id": ObjectId(group_id)})["requests"] == [user_id]
+
+def test_one_answer_wins_each_request(app, mongo):
+    owner_id = make_user(mongo, "owner")
+    group_id = _group(mongo, owner_id, "Private")
+    requesters = [make_user(mongo, "hopeful-" + str(i)) for i in range(10)]
+    mongo.groups.update_one({"_id": ObjectId(group_id)}, {"$set": {"requests": requesters}})
+
+    owner = _headers(owner_id, "owner")
+    base = "/api/groups/" + group_id + "/requests_to_join/"
+    calls = []
+    for request_id in requesters:
+        calls.append(lambda client, request_id=request_id: ("accepted", request_id, client.put(base + request_id + "/accepted", headers=owner).status_code))
+        calls.append(lambda client, request_id=request_id: ("accepted", request_id, client.put(base + request_id + "/accepted", headers=owner).status_code))
+        calls.append(lambda client, request_id=request_id: ("rejected", request_id, client.put(base + request_id + "/rejected", headers=owner).status_code))
+    results = _together(app, calls)
+
+    assert mongo.groups.find_one({"_id": ObjectId(group_id)})["requests"] == []
+    for request_id in requesters:
+        answers = [(answer, status) for answer, answered, status in results if answered == request_id]
+        winners = [answer for answer, status in answers if status == 201]
+        assert len(winners) == 1, answers
+        assert sorted(status for answer, status in answers) == [201, 404, 404]
+
+        # Only the accept that won adds the member
+        memberOf = mongo.users.find_one({"_id": ObjectId(request_id)})["memberOf"]
+        assert memberOf == ([group_id] if winners == ["accepted"] else [])
+
+def test_answering_a_missing_request_is_not_found(client, mongo):
+    owner_id = make_user(mongo, "owner")
+    group_id = _group(mongo, owner_id, "Private")
+    stranger_id = make_user(mongo, "stranger")
+
+    base = "/api/groups/" + group_id + "/requests_to_join/" + stranger_id
+    assert client.put(base + "/accepted", headers=_headers(owner_id, "owner")).status_code == 404
+    assert client.put(base + "/rejected", headers=_headers(owner_id, "owner")).status_code == 404
+    assert mongo.users.find_one({"_id": ObjectId(stranger_id)})["memberOf"] == []
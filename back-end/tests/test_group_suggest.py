@@ -0,0 +1,48 @@
+''' group_suggest.py, the first build runs once per process however many suggestions arrive while it runs '''
+
+import threading, time
+import pytest
+import group_suggest
+
+
+@pytest.fixture
+def unbuilt(mongo, monkeypatch):
+    monkeypatch.setattr(group_suggest, "_builtPid", None)
+    monkeypatch.setattr(group_suggest, "_firstBuildPid", None)
+    monkeypatch.setattr(group_suggest, "_firstBuild", threading.Event())
+    mongo.groups.insert_one({"group_name": "Sim Racing Club", "category": "Sim Racing", "group_access": "Public"})
+    return mongo
+
+
+def _slow_load(monkeypatch, seconds):
+    ''' Counts the builds, each one taking seconds '''
+    loads = []
+    load = group_suggest._load
+    def counted():
+        loads.append(1)
+        time.sleep(seconds)
+        return load()
+    monkeypatch.setattr(group_suggest, "_load", counted)
+    return loads
+
+def test_concurrent_first_suggestions_build_once(unbuilt, monkeypatch):
+    loads = _slow_load(monkeypatch, 0.2)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(group_suggest.suggest("rac"))) for _ in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert len(loads) == 1
+    assert all(result and result[0]["group_name"] == "Sim Racing Club" for result in results)
+
+def test_slow_first_build_answers_nothing_instead_of_waiting(unbuilt, monkeypatch):
+    monkeypatch.setattr(group_suggest, "firstBuildWait", 0.01)
+    loads = _slow_load(monkeypatch, 0.3)
+
+    assert group_suggest.suggest("rac") == []
+
+    group_suggest._firstBuild.wait(5)
+    assert group_suggest.suggest("rac")[0]["group_name"] == "Sim Racing Club"
+    assert len(loads) == 1
@@ -0,0 +1,106 @@
+''' The groups blueprint '''
+
+import datetime
+import pytest
+from bson import ObjectId
+import pagination, principal
+from conftest import make_user, token_for
+
+
+@pytest.fixture(autouse=True)
+def fresh_principals():
+    principal._entries.clear()
+
+
+def _group(db, owner_id, **fields):
+    group = {"group_name": "Sim Racing Club", "category": "Sim Racing", "group_access": "Public", "group_owner": owner_id,
+             "requests": [], **fields}
+    return str(db.groups.insert_one(group).inserted_id)
+
+def _headers(user_id, username):
+    return {"x-access-token": token_for(user_id, username)}
+
+
+### --- GROUP PAGE --- ###
+# mongomock can't run the page's $lookup pipelines, so only the refusal is tested here
+def test_group_page_turns_away_outsiders_before_reading_the_group(client, mongo, commands):
+    owner_id = make_user(mongo, "owner")
+    group_id = _group(mongo, owner_id)
+    outsider_id = make_user(mongo, "outsider")
+
+    commands.clear()
+    response = client.get("/api/groups/" + group_id, headers=_headers(outsider_id, "outsider"))
+    assert response.status_code == 404
+    assert commands["groups.aggregate"] == 0
+    assert commands["groups.find_one"] == 0
+
+def test_group_page_is_one_aggregation_with_the_feed_and_counts_as_lookups():
+    from blueprints.groups import groups
+    group_id = "65f000000000000000000001"
+    pipeline, feedPipeline = groups.group_page_pipelines(group_id, {}, 20)
+
+    assert [list(stage)[0] for stage in pipeline] == ["$match", "$project", "$lookup", "$lookup", "$lookup"]
+    assert pipeline[0]["$match"] == {"_id": ObjectId(group_id), "deleted_at": {"$exists": False}}
+    assert [stage["$lookup"]["as"] for stage in pipeline[2:]] == ["feed", "post_count", "member_count"]
+    assert pipeline[2]["$lookup"] == {"from": "posts", "pipeline": feedPipeline, "as": "feed"}
+    assert pipeline[3]["$lookup"]["pipeline"] == [{"$match": {"group_id": group_id}}, {"$count": "count"}]
+    assert pipeline[4]["$lookup"]["pipeline"] == [{"$match": {"memberOf": group_id}}, {"$count": "count"}]
+
+    # Newest first, on the (group_id, date_posted, _id) index, one extra post to tell if there is another page
+    assert [list(stage)[0] for stage in feedPipeline] == ["$match", "$sort", "$limit", "$lookup", "$addFields", "$project"]
+    assert feedPipeline[0]["$match"] == {"group_id": group_id}
+    assert list(feedPipeline[1]["$sort"].items()) == [("date_posted", -1), ("_id", -1)]
+    assert feedPipeline[2]["$limit"] == 21
+    assert feedPipeline[3]["$lookup"]["from"] == "users"
+
+def test_group_page_pipeline_pages_with_the_cursor_and_leaves_the_feed_out_when_streaming():
+    from blueprints.groups import groups
+    group_id = "65f000000000000000000001"
+    afterCursor = pagination.keyset_filter("date_posted", pagination.encode_cursor(
+        {"_id": ObjectId(), "date_posted": datetime.datetime(2025, 1, 1)}, "date_posted"))
+
+    pipeline, feedPipeline = groups.group_page_pipelines(group_id, afterCursor, 5, stream=True)
+    assert feedPipeline[0]["$match"] == {"group_id": group_id, **afterCursor}
+    assert feedPipeline[2]["$limit"] == 6
+    assert [stage["$lookup"]["as"] for stage in pipeline if "$lookup" in stage] == ["post_count", "member_count"]
+
+
+### --- SEARCH --- ###
+def _searchable(db, owner_id, name, category="Sim Racing"):
+    import group_search
+    return _group(db, owner_id, group_name=name, category=category, **group_search.search_document(name, category))
+
+def test_search_pages_through_the_results_with_the_next_cursor_header(client, mongo):
+    owner_id = make_user(mongo, "owner")
+    for name in ("Sim Racing Club", "Sim Racing League", "Sim Rigs"):
+        _searchable(mongo, owner_id, name)
+
+    headers = _headers(owner_id, "owner")
+    first = client.get("/api/search_for_groups/group_name/sim?limit=2", headers=headers)
+    assert first.status_code == 200
+    assert [group["group_name"] for group in first.get_json()] == ["Sim Racing Club", "Sim Racing League"]
+
+    second = client.get("/api/search_for_groups/group_name/sim?limit=2&cursor=" + first.headers["X-Next-Cursor"], headers=headers)
+    assert [group["group_name"] for group in second.get_json()] == ["Sim Rigs"]
+    assert "X-Next-Cursor" not in second.headers
+
+def test_search_with_an_undecodable_cursor_is_a_bad_request(client, mongo):
+    owner_id = make_user(mongo, "owner")
+    _searchable(mongo, owner_id, "Sim Racing Club")
+
+    for cursor in ("nonsense", "1.nonsense", "3.abc"):
+        response = client.get("/api/search_for_groups/category/sim?cursor=" + cursor, headers=_headers(owner_id, "owner"))
+        assert response.status_code == 400, cursor
+        assert response.get_json() == {"error": "Invalid page cursor"}
+
+def test_search_failing_is_service_unavailable(client, mongo, monkeypatch):
+    import group_search
+    owner_id = make_user(mongo, "owner")
+
+    def search(*args):
+        raise RuntimeError("connection reset")
+    monkeypatch.setattr(group_search, "search", search)
+
+    response = client.get("/api/search_for_groups/group_name/sim", headers=_headers(owner_id, "owner"))
+    assert response.status_code == 503
+    assert response.get_json() == {"error": "connection reset"}
@@ -0,0 +1,60 @@
+''' hashing.py, bcrypt on a bounded process pool '''
+
+import time
+import pytest
+import hashing
+
+
+@pytest.fixture
+def fast_rounds(monkeypatch):
+    monkeypatch.setattr(hashing, "bcryptRounds", 4)
+
+
+def _free_slots():
+    return hashing._slots._value
+
+def test_hash_and_check_run_in_the_pool(fast_rounds):
+    hashed = hashing.hash_password("correct horse")
+    assert hashing.check_password("correct horse", hashed)
+    assert not hashing.check_password("battery staple", hashed)
+    assert hashing._pool._mp_context.get_start_method() in ("forkserver", "spawn")
+
+def test_timeout_is_busy_and_keeps_its_slot_until_the_pool_finishes(fast_rounds, monkeypatch):
+    hashing.hash_password("warm up") # the pool is started before timing anything
+    capacity = _free_slots()
+
+    monkeypatch.setattr(hashing, "bcryptRounds", 13)
+    monkeypatch.setattr(hashing, "hashTimeout", 0.01)
+
+    with pytest.raises(hashing.HashingBusy):
+        hashing.hash_password("slow")
+
+    # Still running in the pool, so the slot is still taken
+    assert _free_slots() == capacity - 1
+
+    deadline = time.monotonic() + 30
+    while _free_slots() != capacity and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert _free_slots() == capacity
+
+def test_full_pool_is_busy_straight_away(fast_rounds, monkeypatch):
+    hashing.hash_password("warm up")
+    taken = 0
+    while hashing._slots.acquire(blocking=False):
+        taken += 1
+    try:
+        with pytest.raises(hashing.HashingBusy):
+            hashing.hash_password("no room")
+    finally:
+        for _ in range(taken):
+            hashing._slots.release()
+
+def test_calibrate_warns_when_the_floor_is_over_the_target():
+    with pytest.warns(hashing.HashingOverBudget):
+        chosen, timings = hashing.calibrate(0.001, samples=1, minRounds=4, maxRounds=5)
+    assert chosen == 4
+
+def test_calibrate_is_quiet_within_the_target(recwarn):
+    chosen, timings = hashing.calibrate(10000, samples=1, minRounds=4, maxRounds=5)
+    assert chosen == 5
+    assert not [warning for warning in recwarn if issubclass(warning.category, hashing.HashingOverBudget)]
@@ -0,0 +1,52 @@
+''' health.py, the background ping and circuit breaker '''
+
+import os, time
+import pytest
+import health
+from conftest import make_user, token_for
+
+
+@pytest.fixture
+def unreachable(monkeypatch):
+    ''' Nothing listening on the mongo URI, a fresh closed breaker and short ping timeouts '''
+    monkeypatch.setenv("ALCHEMAX_MONGO_URI", "mongodb://127.0.0.1:1")
+    monkeypatch.setattr(health, "pingTimeout", 200)
+    monkeypatch.setattr(health, "_monitorPid", None)
+    monkeypatch.setattr(health, "_startedPid", os.getpid())
+    monkeypatch.setattr(health, "_state", {"state": health.CLOSED, "consecutive_failures": 0, "last_error": None,
+                                           "last_checked": None, "opened_at": None})
+
+
+def test_breaker_opens_quickly_when_mongo_is_down(unreachable):
+    start = time.monotonic()
+    for _ in range(health.failureThreshold):
+        health.check_now()
+
+    assert not health.is_available()
+    assert health.status()["state"] == health.OPEN
+    assert time.monotonic() - start < 5 # the pings time out after pingTimeout, not pymongo's default 30 seconds
+
+def test_mongo_required_fails_fast_while_open(unreachable):
+    for _ in range(health.failureThreshold):
+        health.check_now()
+
+    from flask import Flask
+    with Flask(__name__).app_context():
+        ok, (response, code) = health.mongo_required()
+
+    assert not ok
+    assert code == 503
+
+def test_public_probes_only_say_whether_it_is_up(client, mongo):
+    for path in ("/api/health/live", "/api/health/ready", "/api/database_health"):
+        body = client.get(path).get_json()
+        assert set(body) <= {"OK", "message"}, path
+
+def test_details_are_for_admins(client, mongo):
+    user_id = make_user(mongo, "someone")
+    assert client.get("/api/health/details").status_code == 401
+    assert client.get("/api/health/details", headers={"x-access-token": token_for(user_id, "someone")}).status_code == 401
+
+    admin = client.get("/api/health/details", headers={"x-access-token": token_for(user_id, "someone", admin=True)})
+    assert admin.status_code == 200
+    assert {"database", "connection_pool", "control_logs", "identity_cache"} <= set(admin.get_json())
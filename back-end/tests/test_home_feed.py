@@ -0,0 +1,55 @@
+''' /api/home costs the same number of mongoDB commands however many posts are in the feed '''
+
+import datetime
+import pytest
+import identity_cache, principal
+from conftest import make_user, token_for
+
+
+def _feed(db, posts):
+    ''' A user in five groups, with posts from a different creator each, returns the request headers '''
+    group_ids = [str(db.groups.insert_one({"group_name": "Group " + str(i), "group_access": "Public"}).inserted_id) for i in range(5)]
+    creators = [make_user(db, "creator-" + str(i)) for i in range(posts)]
+    now = datetime.datetime(2025, 1, 1)
+    db.posts.insert_many([{
+        "group_id": group_ids[i % len(group_ids)],
+        "creator": creators[i],
+        "post_title": "Post " + str(i),
+        "post_message": "Hello",
+        "event_button": "No",
+        "date_posted": now + datetime.timedelta(minutes=i),
+        "comment_count": 0
+    } for i in range(posts)])
+
+    user_id = make_user(db, "reader", memberOf=group_ids)
+    return {"x-access-token": token_for(user_id, "reader")}
+
+def _commands_for_home(client, db, commands, posts):
+    headers = _feed(db, posts)
+    for cache in (identity_cache.usernames, identity_cache.groupNames):
+        cache._entries.clear()
+    principal._entries.clear()
+
+    commands.clear()
+    response = client.get("/api/home?limit=100", headers=headers)
+    assert response.status_code == 200
+    assert len(response.get_json()["feed"]) == posts
+    return sum(commands.values()), dict(commands)
+
+
+@pytest.mark.parametrize("posts", [1, 60])
+def test_home_feed_names_every_post(client, mongo, posts):
+    headers = _feed(mongo, posts)
+    feed = client.get("/api/home?limit=100", headers=headers).get_json()["feed"]
+    assert all(post["creator_username"].startswith("creator-") for post in feed)
+    assert all(post["group_name"].startswith("Group ") for post in feed)
+
+def test_home_feed_command_count_does_not_grow_with_the_feed(app, mongo, commands):
+    one, oneDetail = _commands_for_home(app.test_client(), mongo, commands, 1)
+
+    mongo.posts.delete_many({})
+    many, manyDetail = _commands_for_home(app.test_client(), mongo, commands, 60)
+
+    assert one == many, (oneDetail, manyDetail)
+    assert manyDetail.get("users.find_one", 0) <= 1 # the reader, never one per post
+    assert manyDetail.get("groups.find_one", 0) == 0
@@ -0,0 +1,40 @@
+''' Importing the app is cheap and has no side effects, even with mongoDB unreachable (cold start for every worker)
+
+    Runs "python -X importtime -c 'import app'" in a fresh interpreter and reads the cumulative time for app from the report.
+    The budget is ALCHEMAX_IMPORT_BUDGET_SECONDS (1.5 by default, it takes about a third of a second on a dev machine)
+'''
+
+import os, subprocess, sys
+
+backEnd = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+budget = float(os.environ.get("ALCHEMAX_IMPORT_BUDGET_SECONDS", 1.5))
+
+
+def _import_app():
+    ''' Imports app in a new process with nothing listening on the mongoDB port, returns (stdout, the importtime report) '''
+    env = {**os.environ, "ALCHEMAX_MONGO_URI": "mongodb://127.0.0.1:1/?serverSelectionTimeoutMS=1", "PYTHONDONTWRITEBYTECODE": "1"}
+    script = "import app, globals, threading; print(globals._client is None, threading.active_count())"
+    result = subprocess.run([sys.executable, "-X", "importtime", "-c", script], cwd=backEnd, env=env,
+                            capture_output=True, text=True, timeout=60)
+    assert result.returncode == 0, result.stderr[-2000:]
+    return result.stdout.split(), result.stderr
+
+def _cumulative_seconds(report, module):
+    ''' The cumulative time of a top level import, from lines like "import time:   388 |   338530 | app" '''
+    for line in report.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        self, cumulative, name = line[len("import time:"):].split("|")
+        if name.rstrip() == " " + module:
+            return int(cumulative) / 1e6
+    raise AssertionError(module + " isn't in the importtime report")
+
+
+def test_importing_the_app_is_within_budget_and_does_nothing_else():
+    (noClient, threads), report = _import_app()
+
+    assert noClient == "True" # no MongoClient made, so nothing tried to connect
+    assert threads == "1" # no background threads (log writer, health monitor, job runner...) started
+
+    seconds = _cumulative_seconds(report, "app")
+    assert seconds < budget, "import app took " + str(round(seconds, 3)) + "s, the budget is " + str(budget) + "s"
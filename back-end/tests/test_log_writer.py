@@ -0,0 +1,43 @@
+''' log_writer.py, the background control log writer '''
+
+import queue, time
+import pytest
+import log_writer
+
+
+@pytest.fixture
+def writer(mongo, monkeypatch):
+    ''' A fresh queue and writer thread that holds its batch for a long time, like a quiet worker '''
+    monkeypatch.setattr(log_writer, "_queue", queue.Queue(maxsize=log_writer.queueSize))
+    monkeypatch.setattr(log_writer, "_startedPid", None)
+    monkeypatch.setattr(log_writer, "_writer", None)
+    monkeypatch.setattr(log_writer, "flushInterval", 30)
+    monkeypatch.setattr(log_writer, "writeConcern", 1)
+    yield mongo
+    log_writer.shutdown(timeout=1)
+
+
+def test_shutdown_writes_the_batch_the_writer_is_holding(writer):
+    for i in range(5):
+        log_writer.enqueue({"Action": "Test", "Message": str(i)})
+
+    # The writer has taken them off the queue and is waiting for the batch to fill up
+    deadline = time.monotonic() + 2
+    while log_writer._queue.qsize() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert log_writer._queue.qsize() == 0
+    assert writer.logs.count_documents({}) == 0
+
+    log_writer.shutdown(timeout=2)
+
+    assert writer.logs.count_documents({}) == 5
+    assert not log_writer._writer.is_alive()
+
+def test_full_queue_drops_instead_of_blocking(writer, monkeypatch):
+    monkeypatch.setattr(log_writer, "_queue", queue.Queue(maxsize=1))
+    monkeypatch.setattr(log_writer, "_startedPid", log_writer.os.getpid()) # no writer, nothing takes them off
+
+    dropped = log_writer.stats()["dropped"]
+    assert log_writer.enqueue({"Message": "kept"})
+    assert not log_writer.enqueue({"Message": "dropped"})
+    assert log_writer.stats()["dropped"] == dropped + 1
@@ -0,0 +1,55 @@
+''' Posting, editing, deleting and commenting check the membership fresh, not the cached principal '''
+
+import datetime
+import pytest
+from bson import ObjectId
+import memberships, principal
+from conftest import make_user, token_for
+
+
+@pytest.fixture(autouse=True)
+def fresh_principals():
+    principal._entries.clear()
+
+
+def _member_with_post(db):
+    owner_id = make_user(db, "owner")
+    group_id = str(db.groups.insert_one({"group_name": "Sim Racing Club", "group_access": "Public", "group_owner": owner_id,
+                                         "requests": []}).inserted_id)
+    member_id = make_user(db, "member", memberOf=[group_id])
+    memberships.add(member_id, group_id)
+    post_id = str(db.posts.insert_one({"group_id": group_id, "creator": member_id, "post_title": "Hello", "post_message": "Hi",
+                                       "event_button": "No", "date_posted": datetime.datetime(2025, 1, 1)}).inserted_id)
+    return group_id, member_id, post_id
+
+def _writes(client, group_id, member_id, post_id):
+    ''' The status of each write the member tries, in order '''
+    headers = {"x-access-token": token_for(member_id, "member")}
+    base = "/api/groups/" + group_id + "/" + post_id
+    return {
+        "comment": client.post(base + "/add_comment", headers=headers, data={"comment_text": "Nice"}).status_code,
+        "post": client.post("/api/create_post", headers=headers, data={"group_id": group_id, "post_title": "Again",
+                                                                       "post_message": "Hi", "event_button": "No"}).status_code,
+        "edit": client.put(base + "/edit_post", headers=headers, data={"post_title": "Edited", "post_message": "Hi",
+                                                                       "event_button": "No"}).status_code,
+        "delete": client.delete(base + "/delete_post", headers=headers).status_code
+    }
+
+
+def test_members_can_write(client, mongo):
+    group_id, member_id, post_id = _member_with_post(mongo)
+    assert _writes(client, group_id, member_id, post_id) == {"comment": 201, "post": 201, "edit": 201, "delete": 204}
+
+def test_a_removed_member_cant_write_while_their_principal_is_cached(client, mongo):
+    group_id, member_id, post_id = _member_with_post(mongo)
+    assert principal.Principal(member_id).in_group(group_id) # now cached
+
+    # Removed by another worker, which can't invalidate this workers cache
+    mongo.users.update_one({"_id": ObjectId(member_id)}, {"$pull": {"memberOf": group_id}})
+    memberships.remove(member_id, group_id)
+    assert principal.Principal(member_id).in_group(group_id) # still cached
+
+    # Commenting is a 403, the post endpoints have always answered 404 to non members
+    assert _writes(client, group_id, member_id, post_id) == {"comment": 403, "post": 404, "edit": 404, "delete": 404}
+    assert mongo.comments.count_documents({}) == 0
+    assert mongo.posts.find_one({"_id": ObjectId(post_id)})["post_title"] == "Hello"
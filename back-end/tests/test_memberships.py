@@ -0,0 +1,119 @@
+''' memberships.py, and the endpoints and jobs that keep it in step with memberOf/ownerOf '''
+
+import os
+import pytest
+from bson import ObjectId
+import indexes, jobs, memberships, principal
+from conftest import make_user, token_for
+
+
+@pytest.fixture(autouse=True)
+def no_runner(monkeypatch):
+    ''' Jobs are run by the test with run_pending, not by a runner thread '''
+    monkeypatch.setattr(jobs, "_startedPid", os.getpid())
+    monkeypatch.setattr(jobs, "pauseSeconds", 0)
+    principal._entries.clear()
+
+
+def _headers(user_id, username):
+    return {"x-access-token": token_for(user_id, username)}
+
+def _create_group(client, owner_id, access="Public"):
+    response = client.post("/api/create_group", headers=_headers(owner_id, "owner"), data={
+        "groupName": "Sim Racing Club", "groupLocation": "Online", "groupCategory": "Sim Racing",
+        "groupDescription": "Racing", "groupAccess": access})
+    assert response.status_code == 201
+    return response.get_json()["message"].rsplit("/", 1)[1]
+
+def _memberships(db):
+    return sorted((doc["user_id"], doc["group_id"], doc["role"]) for doc in db.memberships.find())
+
+
+def test_the_indexes_are_registered():
+    assert ("memberships", [("group_id", 1), ("user_id", 1)], {"unique": True}) in indexes._indexes
+    assert ("memberships", [("user_id", 1)], {}) in indexes._indexes
+
+def test_is_member_is_answered_by_the_index(mongo):
+    # Only the fields of the unique index come back, so mongoDB never reads the document
+    assert memberships._covered == {"_id": 0, "group_id": 1, "user_id": 1}
+
+    memberships.add("user-1", "group-1")
+    assert memberships.is_member("user-1", "group-1")
+    assert not memberships.is_member("user-2", "group-1")
+    assert not memberships.is_member("user-1", "group-2")
+
+def test_adding_twice_keeps_one_membership_and_the_role(mongo):
+    memberships.add("user-1", "group-1", "owner")
+    memberships.add("user-1", "group-1")
+    assert _memberships(mongo) == [("user-1", "group-1", "owner")]
+
+
+### --- ENDPOINTS --- ###
+def test_create_join_and_leave_write_the_memberships(client, mongo):
+    owner_id = make_user(mongo, "owner")
+    member_id = make_user(mongo, "member")
+    group_id = _create_group(client, owner_id)
+    assert _memberships(mongo) == [(owner_id, group_id, "owner")]
+
+    assert client.put("/api/" + group_id + "/join", headers=_headers(member_id, "member")).status_code == 200
+    assert memberships.is_member(member_id, group_id)
+
+    assert client.put("/api/groups/" + group_id + "/leave", headers=_headers(member_id, "member")).status_code == 201
+    assert not memberships.is_member(member_id, group_id)
+    assert _memberships(mongo) == [(owner_id, group_id, "owner")]
+
+def test_accepting_a_request_writes_the_membership(client, mongo):
+    owner_id = make_user(mongo, "owner")
+    hopeful_id = make_user(mongo, "hopeful")
+    group_id = _create_group(client, owner_id, "Private")
+
+    assert client.put("/api/" + group_id + "/join", headers=_headers(hopeful_id, "hopeful")).status_code == 200
+    assert not memberships.is_member(hopeful_id, group_id)
+
+    url = "/api/groups/" + group_id + "/requests_to_join/" + hopeful_id + "/accepted"
+    assert client.put(url, headers=_headers(owner_id, "owner")).status_code == 201
+    assert memberships.is_member(hopeful_id, group_id)
+
+    # Members can't ask to join again
+    response = client.put("/api/" + group_id + "/join", headers=_headers(hopeful_id, "hopeful"))
+    assert response.status_code == 404
+    assert mongo.groups.find_one({"_id": ObjectId(group_id)})["requests"] == []
+
+
+### --- DELETES --- ###
+def test_deleting_a_group_removes_its_memberships(client, mongo):
+    owner_id = make_user(mongo, "owner")
+    member_id = make_user(mongo, "member")
+    group_id = _create_group(client, owner_id)
+    client.put("/api/" + group_id + "/join", headers=_headers(member_id, "member"))
+    memberships.add(member_id, "another-group")
+
+    response = client.delete("/api/groups/" + group_id + "/settings/delete_group", headers=_headers(owner_id, "owner"))
+    assert response.status_code == 202
+    assert jobs.run_pending() == 1
+    assert _memberships(mongo) == [(member_id, "another-group", "member")]
+
+def test_deleting_an_account_removes_its_memberships_and_its_groups(client, mongo):
+    owner_id = make_user(mongo, "owner")
+    member_id = make_user(mongo, "member")
+    group_id = _create_group(client, owner_id)
+    client.put("/api/" + group_id + "/join", headers=_headers(member_id, "member"))
+    memberships.add(owner_id, "another-group")
+
+    assert client.delete("/api/delete_account", headers=_headers(owner_id, "owner")).status_code == 202
+    assert not memberships.is_member(owner_id, "another-group")
+
+    assert jobs.run_pending() == 1
+    assert _memberships(mongo) == []
+
+
+### --- BACKFILL --- ###
+def test_backfill_adds_the_memberships_from_the_arrays_once(mongo):
+    owner_id = make_user(mongo, "owner", ownerOf=["group-1"], memberOf=["group-2"])
+    member_id = make_user(mongo, "member", memberOf=["group-1", "group-2"])
+    make_user(mongo, "loner")
+
+    assert memberships.backfill(batchSize=2) == 4
+    assert _memberships(mongo) == sorted([(owner_id, "group-1", "owner"), (owner_id, "group-2", "member"),
+                                          (member_id, "group-1", "member"), (member_id, "group-2", "member")])
+    assert memberships.backfill() == 0
@@ -0,0 +1,69 @@
+''' The client settings in globals.py and the pool listener in mongo_pool.py '''
+
+from types import SimpleNamespace
+import os
+import pytest
+import globals, mongo_pool
+
+
+@pytest.fixture(autouse=True)
+def fresh_stats():
+    mongo_pool.reset()
+    yield
+    mongo_pool.reset()
+
+
+### --- SETTINGS --- ###
+def test_nothing_set_keeps_the_pymongo_defaults(monkeypatch):
+    for setting in [*globals.clientSettings, "ALCHEMAX_MONGO_COMPRESSORS"]:
+        monkeypatch.delenv(setting, raising=False)
+    assert globals.client_options() == {}
+
+def test_the_settings_come_from_the_environment(monkeypatch):
+    monkeypatch.setenv("ALCHEMAX_MONGO_MAX_POOL_SIZE", "20")
+    monkeypatch.setenv("ALCHEMAX_MONGO_MIN_POOL_SIZE", "2")
+    monkeypatch.setenv("ALCHEMAX_MONGO_WAIT_QUEUE_TIMEOUT_MS", "500")
+    monkeypatch.setenv("ALCHEMAX_MONGO_SERVER_SELECTION_TIMEOUT_MS", "3000")
+    monkeypatch.setenv("ALCHEMAX_MONGO_COMPRESSORS", "zstd, snappy,zlib,lz4")
+    monkeypatch.setitem(globals.compressorsAvailable, "zstd", lambda: True)
+    monkeypatch.setitem(globals.compressorsAvailable, "snappy", lambda: False) # not installed
+
+    assert globals.client_options() == {"maxPoolSize": 20, "minPoolSize": 2, "waitQueueTimeoutMS": 500,
+                                        "serverSelectionTimeoutMS": 3000, "compressors": "zstd,zlib"}
+
+def test_the_client_gets_the_settings_and_the_listener(monkeypatch):
+    made = []
+    monkeypatch.setattr(globals, "MongoClient", lambda uri, **options: made.append((uri, options)) or object())
+    monkeypatch.setattr(globals, "_clientPid", None)
+    monkeypatch.setattr(globals, "_client", None)
+    monkeypatch.setenv("ALCHEMAX_MONGO_MAX_POOL_SIZE", "20")
+
+    globals.get_client()
+    uri, options = made[0]
+    assert options["maxPoolSize"] == 20
+    assert options["connect"] is False
+    assert options["event_listeners"] == [mongo_pool.listener]
+
+
+### --- LISTENER --- ###
+def test_the_listener_counts_checkouts_waits_and_failures():
+    listener = mongo_pool.listener
+    for _ in range(3):
+        listener.connection_created(SimpleNamespace())
+    for waited in (0.001, 0.002, 0.050):
+        listener.connection_check_out_started(SimpleNamespace())
+        listener.connection_checked_out(SimpleNamespace(duration=waited))
+    listener.connection_checked_in(SimpleNamespace())
+    listener.connection_check_out_started(SimpleNamespace())
+    listener.connection_check_out_failed(SimpleNamespace(reason="timeout", duration=0.5))
+    listener.connection_check_out_started(SimpleNamespace()) # still waiting
+    listener.connection_closed(SimpleNamespace())
+
+    stats = mongo_pool.stats()
+    assert stats["connections_open"] == 2
+    assert stats["connections_in_use"] == 2
+    assert stats["waiting_for_connection"] == 1
+    assert stats["checkouts"] == 3
+    assert stats["checkout_wait_ms"] == {"p50": pytest.approx(2), "p99": pytest.approx(50), "max": pytest.approx(50)}
+    assert stats["checkout_failures"] == 1
+    assert stats["checkout_failures_by_reason"] == {"timeout": 1}
@@ -0,0 +1,55 @@
+''' revocation.py, the per worker set of logged out tokens '''
+
+import datetime, os, struct
+from bson import ObjectId
+import pytest
+import revocation
+
+
+@pytest.fixture
+def fresh(mongo, monkeypatch):
+    ''' A revocation set that has loaded nothing yet and has no refresh thread '''
+    monkeypatch.setattr(revocation, "_revoked", {})
+    monkeypatch.setattr(revocation, "_lastRefresh", None)
+    monkeypatch.setattr(revocation, "_startedPid", os.getpid())
+    return mongo
+
+def _object_id(when, randomPart):
+    ''' An ObjectId as another worker would make it, the time, that workers random part and a counter '''
+    return ObjectId(struct.pack(">I", int(when.timestamp())) + randomPart.to_bytes(5, "big") + (1).to_bytes(3, "big"))
+
+def _blacklist(db, _id, token):
+    db.blacklist.insert_one({"_id": _id, "fingerprint": revocation.fingerprint(token),
+                             "expires_at": revocation._utcnow() + datetime.timedelta(minutes=60)})
+
+
+def test_logout_on_this_worker_is_revoked_straight_away(fresh):
+    revocation.revoke("token-a")
+    assert revocation.is_revoked("token-a")
+    assert not revocation.is_revoked("token-b")
+
+def test_other_workers_logouts_are_picked_up_by_refresh(fresh):
+    revocation.refresh()
+    _blacklist(fresh, ObjectId(), "token-a")
+    revocation.refresh()
+    assert revocation.is_revoked("token-a")
+
+def test_logout_committed_out_of_id_order_is_not_missed(fresh):
+    now = datetime.datetime.now(datetime.UTC)
+
+    # B has the higher id and is committed first, A from another worker in the same second is committed after
+    _blacklist(fresh, _object_id(now, 0xFFFFFFFFFF), "token-b")
+    revocation.refresh()
+    _blacklist(fresh, _object_id(now, 0x0000000001), "token-a")
+    revocation.refresh()
+    revocation.refresh()
+
+    assert revocation.is_revoked("token-b")
+    assert revocation.is_revoked("token-a")
+
+def test_expired_tokens_are_pruned(fresh):
+    fresh.blacklist.insert_one({"fingerprint": revocation.fingerprint("old"),
+                                "expires_at": revocation._utcnow() - datetime.timedelta(seconds=1)})
+    revocation.refresh()
+    assert not revocation.is_revoked("old")
+    assert revocation.fingerprint("old") not in revocation._revoked
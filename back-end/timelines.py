@@ -0,0 +1,187 @@
+''' This is the optional timeline mode for the home feed (fan-out-on-write), turned on with ALCHEMAX_TIMELINE_MODE=1
+
+    Without it, /api/home runs a $in over every group the user is in and sorts the posts when the feed is read.
+    With it, each user has their own timeline (the timelines collection), one small document per post in their feed:
+        1) Creating a post adds it to the timeline of every member of the group
+        2) Deleting a post removes it from every timeline
+        3) Joining a group (or being accepted) copies the groups recent posts into the users timeline, leaving removes them
+        4) Reading the home feed is then one range scan over the users timeline
+
+    Groups with more than ALCHEMAX_TIMELINE_FANOUT_LIMIT members are marked fanout_on_read, their posts aren't copied
+    (one post would be thousands of writes), instead the home feed reads them from the posts collection and merges them in
+
+    If the mode is turned on with existing data, fill the timelines first with:
+        flask --app app rebuild-timelines
+'''
+
+### --- IMPORTS --- ###
+from pymongo import InsertOne
+from pymongo.errors import BulkWriteError
+from bson import ObjectId
+import datetime, os
+import click
+import globals, indexes, pagination, parallel
+
+### --- SETTINGS --- ###
+timelineMode = os.environ.get("ALCHEMAX_TIMELINE_MODE", "0") == "1"
+fanoutLimit = int(os.environ.get("ALCHEMAX_TIMELINE_FANOUT_LIMIT", 1000)) # members before a group is read on demand instead
+backfillLimit = int(os.environ.get("ALCHEMAX_TIMELINE_BACKFILL", 200)) # recent posts copied in when joining a group
+
+### --- INDEXES --- ###
+indexes.register("timelines", [("user_id", 1), ("date_posted", -1), ("post_id", -1)]) # reading a users feed
+indexes.register("timelines", [("user_id", 1), ("post_id", 1)], unique=True) # no duplicate entries
+indexes.register("timelines", [("post_id", 1)]) # removing a deleted post
+indexes.register("timelines", [("group_id", 1), ("user_id", 1)]) # leaving or deleting a group
+indexes.register("users", [("ownerOf", 1)]) # fan out finds the owner as well as the members
+indexes.register_query("home feed (timeline)", "timelines",
+                       {"user_id": "user-1"}, pagination.keyset_sort("date_posted", idField="post_id"),
+                       seed=[{"user_id": "user-" + str(i % 7), "post_id": ObjectId(), "group_id": "group-" + str(i % 5),
+                              "date_posted": datetime.datetime(2025, 1, 1) + datetime.timedelta(minutes=i)} for i in range(50)])
+
+
+def enabled():
+    return timelineMode
+
+def _timelines():
+    return globals.db.timelines
+
+def _member_filter(group_id):
+    return {"$or": [{"memberOf": group_id}, {"ownerOf": group_id}]}
+
+def _insert(entries):
+    ''' Inserts timeline entries, ignoring the ones that are already there '''
+    if not entries:
+        return
+    try:
+        _timelines().bulk_write([InsertOne(entry) for entry in entries], ordered=False)
+    except BulkWriteError as e:
+        # 11000 is a duplicate key, that entry is already in the timeline which is fine
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+def _entry(user_id, post):
+    return {
+        "user_id" : str(user_id),
+        "post_id" : post["_id"],
+        "group_id" : post["group_id"],
+        "date_posted" : post["date_posted"]
+    }
+
+
+### --- LARGE GROUPS --- ###
+def _is_large(group_id):
+    ''' Checks whether the group is (or now is) too big to fan out to, marking it on the group document if so '''
+    group = globals.db.groups.find_one({"_id": ObjectId(group_id)}, {"fanout_on_read": 1})
+    if group and group.get("fanout_on_read"):
+        return True
+
+    members = globals.db.users.count_documents(_member_filter(group_id), limit=fanoutLimit + 1)
+    if members > fanoutLimit:
+        globals.db.groups.update_one({"_id": ObjectId(group_id)}, {"$set": {"fanout_on_read": True}})
+        return True
+    return False
+
+def large_groups(group_ids):
+    ''' Which of these groups are read on demand instead of from the timeline '''
+    objectIds = [ObjectId(gid) for gid in group_ids if ObjectId.is_valid(gid)]
+    if not objectIds:
+        return []
+    return [str(grp["_id"]) for grp in globals.db.groups.find({"_id": {"$in": objectIds}, "fanout_on_read": True}, {"_id": 1})]
+
+
+### --- WRITES --- ###
+def fan_out(post):
+    ''' Called when a post is created, adds it to every members timeline '''
+    if not timelineMode or _is_large(post["group_id"]):
+        return
+
+    members = globals.db.users.find(_member_filter(post["group_id"]), {"_id": 1})
+    _insert([_entry(member["_id"], post) for member in members])
+
+def remove_post(post_id):
+    ''' Called when a post is deleted '''
+    remove_posts([post_id])
+
+def remove_posts(post_ids):
+    ''' Called when a batch of posts is deleted (see cascades.py) '''
+    if timelineMode and post_ids:
+        _timelines().delete_many({"post_id": {"$in": [ObjectId(post_id) for post_id in post_ids]}})
+
+def backfill(user_id, group_id):
+    ''' Called when a user joins a group, copies its recent posts into their timeline '''
+    if not timelineMode or _is_large(group_id):
+        return
+
+    recentPosts = globals.db.posts.find({"group_id": group_id}, {"group_id": 1, "date_posted": 1}) \
+        .sort(pagination.keyset_sort("date_posted")).limit(backfillLimit)
+    _insert([_entry(user_id, post) for post in recentPosts])
+
+def trim(user_id, group_id):
+    ''' Called when a user leaves a group '''
+    if timelineMode:
+        _timelines().delete_many({"user_id": str(user_id), "group_id": group_id})
+
+def remove_group(group_id):
+    ''' Called when a group is deleted '''
+    if timelineMode:
+        _timelines().delete_many({"group_id": group_id})
+
+def remove_user(user_id):
+    ''' Called when an account is deleted '''
+    if timelineMode:
+        _timelines().delete_many({"user_id": str(user_id)})
+
+
+### --- READ --- ###
+def read_feed(user_id, group_ids, limit, cursor):
+    ''' Returns (posts, next_cursor) for the home feed, newest first.
+
+        The users timeline is one indexed range scan, posts from large groups are read from the posts collection and merged in
+    '''
+    timelineFilter = pagination.keyset_filter("date_posted", cursor, idField="post_id")
+    postFilter = pagination.keyset_filter("date_posted", cursor)
+
+    # The timeline and the list of large groups don't depend on each other
+    entries, onRead = parallel.gather(
+        lambda: list(_timelines().find({"user_id": str(user_id), **timelineFilter}, {"post_id": 1, "date_posted": 1})
+                     .sort(pagination.keyset_sort("date_posted", idField="post_id")).limit(limit + 1)),
+        lambda: large_groups(group_ids)
+    )
+    candidates = [{"_id": entry["post_id"], "date_posted": entry["date_posted"]} for entry in entries]
+
+    if onRead:
+        candidates += list(globals.db.posts.find({"group_id": {"$in": onRead}, **postFilter}, {"date_posted": 1})
+                           .sort(pagination.keyset_sort("date_posted")).limit(limit + 1))
+
+    # Merge, newest first, a post can be in both if its group grew large after it was posted
+    seen = set()
+    merged = []
+    for candidate in sorted(candidates, key=lambda c: (c["date_posted"], c["_id"]), reverse=True):
+        if candidate["_id"] not in seen:
+            seen.add(candidate["_id"])
+            merged.append(candidate)
+
+    page, nextCursor = pagination.next_page(merged[:limit + 1], "date_posted", limit)
+
+    # Load the actual posts, in the same order (leaving out groups that aren't in group_ids, i.e. ones being deleted)
+    found = {post["_id"]: post for post in globals.db.posts.find({"_id": {"$in": [c["_id"] for c in page]}, "group_id": {"$in": list(group_ids)}})}
+    return [found[c["_id"]] for c in page if c["_id"] in found], nextCursor
+
+
+### --- REBUILD --- ###
+def rebuild():
+    ''' Fills every users timeline from scratch, for turning the mode on with existing data '''
+    _timelines().delete_many({})
+    for user in globals.db.users.find({}, {"memberOf": 1, "ownerOf": 1}):
+        for group_id in set(user.get("memberOf", []) + user.get("ownerOf", [])):
+            backfill(user["_id"], group_id)
+
+def init_app(app):
+    ''' Adds the rebuild-timelines command to the flask cli '''
+
+    @app.cli.command("rebuild-timelines")
+    def rebuild_timelines_command():
+        if not timelineMode:
+            raise click.ClickException("Timeline mode is off, set ALCHEMAX_TIMELINE_MODE=1 first")
+        rebuild()
+        click.echo("Timelines rebuilt")
@@ -0,0 +1,65 @@
+''' This marks groups that are being deleted, so they disappear straight away while the delete_group job (see cascades.py)
+    works through their members, posts and comments in the background
+
+    1) tombstone() sets deleted_at on the group, bumps its version (so no poll gets a 304) and takes it out of the search
+    2) Anything that reads a group document by id adds notDeleted to its filter, so the group page, joining, requests
+       and settings all answer as if the group had already gone
+    3) The members still have it in memberOf until the job reaches them, so live_groups() is used wherever a users groups
+       decide what they can see (the home feed, posts, comments), the set of tombstoned groups is tiny and is read at most
+       once every ALCHEMAX_TOMBSTONE_CACHE_SECONDS per process
+    4) The job deletes the group document last, which also ends the tombstone
+'''
+
+### --- IMPORTS --- ###
+from bson import ObjectId
+import datetime, os, threading, time
+import globals, indexes, group_search
+
+### --- SETTINGS --- ###
+cacheSeconds = float(os.environ.get("ALCHEMAX_TOMBSTONE_CACHE_SECONDS", 1))
+
+notDeleted = {"deleted_at": {"$exists": False}}
+
+### --- INDEXES --- ###
+indexes.register("groups", [("deleted_at", 1)], sparse=True) # only tombstoned groups are in it
+
+### --- STATE --- ###
+_lock = threading.Lock()
+_deleted = frozenset()
+_loadedAt = None
+
+
+def tombstone(*group_ids):
+    ''' Marks the groups as deleted, returns how many were (ones that don't exist or are already tombstoned are skipped) '''
+    global _loadedAt
+    if not group_ids:
+        return 0
+
+    result = globals.db.groups.update_many(
+        {"_id": {"$in": [ObjectId(group_id) for group_id in group_ids]}, **notDeleted},
+        {"$set": {"deleted_at": datetime.datetime.now(datetime.UTC)},
+         "$inc": {"version": 1},
+         "$unset": {field: "" for fields in group_search.searchFields.values() for field in fields}}
+    )
+    with _lock:
+        _loadedAt = None # this process sees it straight away
+    return result.modified_count
+
+def deleted_groups():
+    ''' The ids (strings) of the groups that are still being deleted '''
+    global _deleted, _loadedAt
+    with _lock:
+        if _loadedAt is not None and time.monotonic() - _loadedAt < cacheSeconds:
+            return _deleted
+
+    deleted = frozenset(str(group["_id"]) for group in globals.db.groups.find({"deleted_at": {"$exists": True}}, {"_id": 1}))
+    with _lock:
+        _deleted, _loadedAt = deleted, time.monotonic()
+    return deleted
+
+def live_groups(group_ids):
+    ''' group_ids without the tombstoned ones, order kept '''
+    deleted = deleted_groups()
+    if not deleted:
+        return list(group_ids)
+    return [group_id for group_id in group_ids if str(group_id) not in deleted]
@@ -0,0 +1,12 @@
+''' This is the production entry point, for a WSGI server instead of the flask development server
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+'''
+
+### --- IMPORTS --- ###
+from dotenv import load_dotenv
+load_dotenv() # before the app is imported, the modules read their settings from the environment
+
+from app import create_app
+
+app = create_app()
@@ -13,6 +13,7 @@ import { WebService } from '../../services/web-service';
 export class GroupHome implements OnInit {
   group: any = {};
   feed: any[] = [];
+  nextCursor: string | null = null;
   errorMessage: string = "";
   isOwner: boolean = false;
   groupId: string = "";
@@ -31,6 +32,7 @@ export class GroupHome implements OnInit {
       next: (data: any) => {
         this.group = data;
         this.feed = data.feed || [];
+        this.nextCursor = data.next_cursor;
 
         const currentUserId = localStorage.getItem('user_id');
         if (currentUserId === data.group_owner) {
@@ -43,6 +45,21 @@ export class GroupHome implements OnInit {
     });
   }
 
+  // Gets the next page of the group feed and adds it to the end
+  loadMore() {
+    if (!this.nextCursor) return;
+
+    this.webService.getGroupById(this.groupId, this.nextCursor).subscribe({
+      next: (data: any) => {
+        this.feed = this.feed.concat(data.feed || []);
+        this.nextCursor = data.next_cursor;
+      },
+      error: (err) => {
+        this.errorMessage = "Unable to load more posts.";
+      }
+    });
+  }
+
   onLeaveGroup() {
     if (confirm("Are you sure you want to leave this community?")) {
       this.webService.leaveGroup(this.groupId).subscribe({
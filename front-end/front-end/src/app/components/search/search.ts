@@ -15,6 +15,7 @@ export class Search implements OnInit {
   searchQuery: string = "";
   searchType: string = "category"; // this is the default search type
   results: any[] = [];
+  nextCursor: string | null = null;
   errorMessage: string = "";
   hasSearched: boolean = false;
   userGroups: string[] = [];
@@ -36,18 +37,31 @@ export class Search implements OnInit {
 
     this.errorMessage = "";
     this.results = [];
+    this.nextCursor = null;
     this.hasSearched = true;
 
+    this.search();
+  }
+
+  // Gets the next page of results (the X-Next-Cursor header of the last page) and adds it to the end
+  loadMore() {
+    if (!this.nextCursor) return;
+    this.search(this.nextCursor);
+  }
+
+  search(cursor?: string) {
     const searchRequest = this.searchType === 'category'
-      ? this.webService.searchGroupByCategory(this.searchQuery)
-      : this.webService.searchGroupByName(this.searchQuery);
+      ? this.webService.searchGroupByCategory(this.searchQuery, cursor)
+      : this.webService.searchGroupByName(this.searchQuery, cursor);
 
     searchRequest.subscribe({
-      next: (data: any) => {
-        this.results = data;
+      next: (response: any) => {
+        this.results = this.results.concat(response.body);
+        this.nextCursor = response.headers.get('X-Next-Cursor');
       },
       error: (err: any) => {
         this.results = [];
+        this.nextCursor = null;
         this.errorMessage = err.error.error || "No results found.";
       }
     });
@@ -13,6 +13,7 @@ export class UserHome implements OnInit {
 
   // Variables to hold data
   feed: any = [];
+  nextCursor: string | null = null;
   errorMessage: string = "";
 
   constructor(private webService : WebService) {}
@@ -23,6 +24,7 @@ export class UserHome implements OnInit {
       this.webService.getHomeFeed().subscribe({
         next: (response: any) => {
           this.feed = response.feed;
+          this.nextCursor = response.next_cursor;
         },
         error: (error: any) => {
           this.errorMessage = "Unable to load feed"
@@ -30,4 +32,19 @@ export class UserHome implements OnInit {
       });
   }
 
+  // Gets the next page of the feed and adds it to the end
+  loadMore() {
+    if (!this.nextCursor) return;
+
+    this.webService.getHomeFeed(this.nextCursor).subscribe({
+      next: (response: any) => {
+        this.feed = this.feed.concat(response.feed);
+        this.nextCursor = response.next_cursor;
+      },
+      error: (error: any) => {
+        this.errorMessage = "Unable to load more posts"
+      }
+    });
+  }
+
 }
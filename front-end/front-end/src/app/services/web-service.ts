@@ -1,7 +1,7 @@
 /// --- IMPORTS --- ///
 import { Injectable } from '@angular/core';
 import { Router } from '@angular/router';
-import { HttpClient, HttpHeaders } from '@angular/common/http';
+import { HttpClient, HttpHeaders, HttpParams } from '@angular/common/http';
 
 @Injectable({
   providedIn: 'root',
@@ -11,7 +11,8 @@ export class WebService {
   constructor(private http: HttpClient, public router: Router) {}
 
   // Connects the front end to Flask (back-end) to retrieve the users home feed
-  getHomeFeed() {
+  // The feed comes back as { feed, next_cursor }, pass next_cursor back in to get the next page (null means no more posts)
+  getHomeFeed(cursor?: string) {
     // get the jwt token stored in the browser during login
     const sessionToken = localStorage.getItem('token');
     console.log("Current Token ", sessionToken)
@@ -20,7 +21,9 @@ export class WebService {
     const headers = new HttpHeaders().set(`x-access-token`, `${sessionToken}`);
 
     // Make the GET request
-    return this.http.get('https://alchemaxdemo.co.uk/api/home', { headers: headers });
+    const params = cursor ? new HttpParams().set('cursor', cursor) : new HttpParams();
+
+    return this.http.get('https://alchemaxdemo.co.uk/api/home', { headers: headers, params: params });
   }
 
   // Get a single post from Flask
@@ -39,11 +42,12 @@ export class WebService {
     return this.http.get('https://alchemaxdemo.co.uk/api/get_user_groups', { headers: headers });
   }
 
-  // Gets the group home page
-  getGroupById(id: string) {
+  // Gets the group home page, the group has its feed and next_cursor like the home feed
+  getGroupById(id: string, cursor?: string) {
     const headers = new HttpHeaders().set('x-access-token', localStorage.getItem('token') || '');
+    const params = cursor ? new HttpParams().set('cursor', cursor) : new HttpParams();
 
-    return this.http.get(`https://alchemaxdemo.co.uk/api/groups/${id}`, { headers });
+    return this.http.get(`https://alchemaxdemo.co.uk/api/groups/${id}`, { headers, params });
   }
 
   // Allows a user to upload a post to their groups page, aka it sends a request to the backend to upload the post
@@ -127,17 +131,20 @@ export class WebService {
   }
 
   // Search for a group by name
-  searchGroupByName(name: string) {
+  // The searches return the whole response, the groups are the body and the X-Next-Cursor header has the next page (if there is one)
+  searchGroupByName(name: string, cursor?: string) {
     const token = localStorage.getItem('token');
     const headers = new HttpHeaders().set('x-access-token', token || '');
-    return this.http.get(`https://alchemaxdemo.co.uk/api/search_for_groups/group_name/${name}`, {headers});
+    const params = cursor ? new HttpParams().set('cursor', cursor) : new HttpParams();
+    return this.http.get(`https://alchemaxdemo.co.uk/api/search_for_groups/group_name/${name}`, {headers, params, observe: 'response'});
   }
 
   // Search for a group by cateogry
-  searchGroupByCategory(category: string) {
+  searchGroupByCategory(category: string, cursor?: string) {
     const token = localStorage.getItem('token');
     const headers = new HttpHeaders().set('x-access-token', token || '');
-    return this.http.get(`https://alchemaxdemo.co.uk/api/search_for_groups/category/${category}`, {headers});
+    const params = cursor ? new HttpParams().set('cursor', cursor) : new HttpParams();
+    return this.http.get(`https://alchemaxdemo.co.uk/api/search_for_groups/category/${category}`, {headers, params, observe: 'response'});
   }
 
   // Create comment